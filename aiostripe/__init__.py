@@ -5,13 +5,21 @@
 # Greg Brockman <gdb@stripe.com>
 # Andrew Metcalf <andrew@stripe.com>
 
+import os
+
 # Configuration variables
 api_key = None
 api_base = 'https://api.stripe.com'
 upload_api_base = 'https://uploads.stripe.com'
 api_version = None
 verify_ssl_certs = True
+ca_bundle_path = os.path.join(os.path.dirname(__file__), 'data', 'ca-certificates.crt')
 default_http_client = None
+# Successful responses of at least this many bytes are decoded from JSON in `offload_executor` rather than on the event
+# loop; None turns this off. `offload_executor` is a concurrent.futures executor, or None for the event loop's default
+# one.
+offload_threshold = None
+offload_executor = None
 
 # Resource
 from aiostripe.resource import (
@@ -1,3 +1,4 @@
+import asyncio
 import calendar
 import datetime
 import json
@@ -6,9 +7,10 @@ import time
 import urllib.parse
 
 import aiostripe
-from aiostripe import error, http_client, version
+from aiostripe import error, http_client, instrumentation, streaming, version
 from aiostripe.logger import logger
 from aiostripe.multipart_data_generator import MultipartDataGenerator
+from coroutils.generator import async_generator
 
 
 def _encode_datetime(dttime):
@@ -51,6 +53,13 @@ def _api_encode(data):
             yield key, value
 
 
+def _decode_body(rbody):
+    if hasattr(rbody, 'decode'):
+        rbody = rbody.decode('utf-8')
+
+    return json.loads(rbody)
+
+
 def _build_api_url(url, query):
     scheme, netloc, path, base_query, fragment = urllib.parse.urlsplit(url)
 
@@ -72,13 +81,124 @@ class APIRequestor(object):
         from aiostripe import verify_ssl_certs as verify
 
         self._client = client or aiostripe.default_http_client or \
-                       http_client.new_default_http_client(verify_ssl_certs=verify)
+                       http_client.default_http_client(verify_ssl_certs=verify)
 
     async def request(self, method, url, params=None, headers=None):
-        rbody, rcode, rheaders, my_api_key = await self.request_raw(method.lower(), url, params, headers)
-        resp = self.interpret_response(rbody, rcode, rheaders)
+        """Returns the decoded JSON of the response, as plain dicts and lists, and the API key used."""
+
+        timing = instrumentation.start(method, url)
+
+        try:
+            rbody, rcode, rheaders, my_api_key = await self.request_raw(method.lower(), url, params, headers,
+                                                                        timing=timing)
+
+            if timing is not None:
+                timing.status = rcode
+                timing.request_id = rheaders.get('request-id')
+
+            with instrumentation.phase(timing, 'decode'):
+                threshold = aiostripe.offload_threshold
+                if threshold is not None and len(rbody) >= threshold and 200 <= rcode < 300:
+                    resp = await self._interpret_response_offloaded(rbody, rcode, rheaders)
+                else:
+                    resp = self.interpret_response(rbody, rcode, rheaders)
+        except Exception as e:
+            if timing is not None:
+                timing.finish(e)
+            raise
+
+        if timing is not None:
+            instrumentation.hand_off(timing)
+
         return resp, my_api_key
 
+    async def _interpret_response_offloaded(self, rbody, rcode, rheaders):
+        """Decodes a big successful response in `aiostripe.offload_executor`, so the event loop can serve other requests
+        in the meantime. The result is the same plain JSON as that of `interpret_response`."""
+
+        loop = asyncio.get_event_loop()
+
+        try:
+            return await loop.run_in_executor(aiostripe.offload_executor, _decode_body, rbody)
+        except ValueError:
+            # let the usual path raise the usual error
+            return self.interpret_response(rbody, rcode, rheaders)
+
+    @async_generator
+    async def stream_list(self, url, params=None, headers=None, envelope=None):
+        """Yields the items of the list at `url`, decoded from JSON, as soon as each of them has been received. The
+        other fields of the list, such as `has_more`, are put in the `envelope` dict once the whole page is in.
+
+        Stop early with `close()` on the iterator, which releases the connection."""
+
+        if envelope is None:
+            envelope = {}
+
+        if not getattr(self._client, 'supports_streaming', False):
+            resp, _ = await self.request('get', url, params, headers)
+            envelope.update((k, v) for k, v in resp.items() if k != 'data')
+
+            return await async_yield_from(resp.get('data', []))
+
+        timing = instrumentation.start('get', url)
+
+        try:
+            abs_url, headers, _, _ = self._prepare_request('get', url, params, headers)
+
+            kwargs = {}
+            if timing is not None:
+                timing.add('encode', timing.since())
+                if getattr(self._client, 'supports_timing', False):
+                    kwargs['timing'] = timing
+
+            async with self._client.request_stream('get', abs_url, headers, **kwargs) as response:
+                logger.info('%s %s %d', 'GET', abs_url, response.status)
+
+                if timing is not None:
+                    timing.status = response.status
+                    timing.request_id = response.headers.get('request-id')
+
+                if not (200 <= response.status < 300):
+                    rbody = await response.read()
+                    with instrumentation.phase(timing, 'decode'):
+                        self.interpret_response(rbody, response.status, response.headers)
+
+                parser = streaming.ListParser()
+                chunks = response.chunks()
+
+                try:
+                    async for chunk in chunks:
+                        with instrumentation.phase(timing, 'decode'):
+                            try:
+                                items = parser.feed(chunk)
+                            except ValueError as e:
+                                raise error.APIError('Invalid response body from API: %s' % e, None,
+                                                     response.status, None, response.headers)
+
+                        for item in items:
+                            await async_yield(item)
+                finally:
+                    await chunks.close()
+
+                with instrumentation.phase(timing, 'decode'):
+                    try:
+                        items = parser.close()
+                    except ValueError as e:
+                        raise error.APIError('Invalid response body from API: %s' % e, None, response.status, None,
+                                             response.headers)
+
+                for item in items:
+                    await async_yield(item)
+
+                envelope.update(parser.envelope)
+        except Exception as e:
+            if timing is not None:
+                timing.finish(e)
+            raise
+
+        if timing is not None:
+            timing.finish()
+
     @staticmethod
     def handle_api_error(rbody, rcode, resp, rheaders):
         try:
@@ -99,10 +219,29 @@ class APIRequestor(object):
         else:
             raise error.APIError(err.get('message'), rbody, rcode, resp, rheaders)
 
-    async def request_raw(self, method, url, params=None, supplied_headers=None):
+    async def request_raw(self, method, url, params=None, supplied_headers=None, timing=None):
         """
         Mechanism for issuing an API call
         """
+        abs_url, headers, post_data, my_api_key = self._prepare_request(method, url, params, supplied_headers)
+
+        if timing is None:
+            rbody, rcode, rheaders = await self._client.request(method, abs_url, headers, post_data)
+        elif getattr(self._client, 'supports_timing', False):
+            timing.add('encode', timing.since())
+            rbody, rcode, rheaders = await self._client.request(method, abs_url, headers, post_data, timing=timing)
+        else:
+            timing.add('encode', timing.since())
+            # the client cannot tell the network phases apart, so all of the call counts as waiting
+            with instrumentation.phase(timing, 'wait'):
+                rbody, rcode, rheaders = await self._client.request(method, abs_url, headers, post_data)
+
+        logger.info('%s %s %d', method.upper(), abs_url, rcode)
+        logger.debug('API request to %s returned (response code, response body) of (%d, %r)', abs_url, rcode, rbody)
+
+        return rbody, rcode, rheaders, my_api_key
+
+    def _prepare_request(self, method, url, params, supplied_headers):
         from aiostripe import api_version
 
         if self.api_key:
@@ -130,8 +269,15 @@ class APIRequestor(object):
             if supplied_headers is not None and supplied_headers.get('Content-Type') == 'multipart/form-data':
                 generator = MultipartDataGenerator()
                 generator.add_params(params or {})
-                post_data = generator.get_post_data()
                 supplied_headers['Content-Type'] = 'multipart/form-data; boundary=%s' % generator.boundary
+
+                if getattr(self._client, 'supports_streaming_uploads', False):
+                    post_data = generator.stream()
+
+                    if post_data.size is not None:
+                        supplied_headers['Content-Length'] = str(post_data.size)
+                else:
+                    post_data = generator.get_post_data()
             else:
                 post_data = encoded_params
         else:
@@ -173,12 +319,7 @@ class APIRequestor(object):
             for key, value in supplied_headers.items():
                 headers[key] = value
 
-        rbody, rcode, rheaders = await self._client.request(method, abs_url, headers, post_data)
-
-        logger.info('%s %s %d', method.upper(), abs_url, rcode)
-        logger.debug('API request to %s returned (response code, response body) of (%d, %r)', abs_url, rcode, rbody)
-
-        return rbody, rcode, rheaders, my_api_key
+        return abs_url, headers, post_data, my_api_key
 
     def interpret_response(self, rbody, rcode, rheaders):
         try:
@@ -0,0 +1,574 @@
+"""Read-through cache of retrieved objects, opt-in per resource class.
+
+    aiostripe.cache.enable(aiostripe.Plan, ttl=3600)
+    plan = await aiostripe.Plan.retrieve('gold')  # from the API
+    plan = await aiostripe.Plan.retrieve('gold')  # from the cache
+
+`retrieve` and `refresh` of an enabled class are answered from its cache while the entry is younger than `ttl` seconds.
+Every hit builds new objects, so changing them leaves the cache alone. Writes made through an object (`save`, `delete`
+and actions such as `Charge.refund`) update or drop the cached copies of that object. Changes made anywhere else, such
+as in the dashboard or by another process, only show once the entry expires, unless the events announcing them are
+passed to a `CacheUpdater`; with one in place the TTLs can be long.
+
+Entries are kept per API key, `Stripe-Account` and retrieve parameters (`expand`, ...), and the least recently used
+ones are evicted beyond `max_size`.
+
+Objects that can no longer change, such as events and balance transactions, can also be kept on disk across restarts:
+
+    aiostripe.cache.enable_persistent('stripe-cache.sqlite3')
+
+`IMMUTABLE` says which objects qualify. They are then retrieved from the API only once, whether or not their class has
+an in-memory cache, which is looked up first. The queries run in a thread of the persistent cache, so the event loop
+never waits for the disk: retrieves await their lookups there, and writes are queued without waiting for them.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import json
+import math
+import random
+import sqlite3
+import time
+
+import aiostripe
+from aiostripe import error, util
+from aiostripe.logger import logger
+
+# resource class: RetrieveCache
+caches = {}
+
+# PersistentCache, if enabled
+persistent = None
+
+# object: None if no object of the type ever changes, or a function telling whether the given one cannot change anymore
+IMMUTABLE = {
+    'balance_transaction': None,
+    'event': None,
+    'application_fee': lambda values: values.get('refunded') is True,
+    'invoice': lambda values: values.get('paid') is True,
+}
+
+
+class RetrieveCache(object):
+    """LRU cache of the objects of one class.
+
+    Misses for ids that do not exist are remembered for `negative_ttl` seconds, and raise the same error until then.
+    To keep the callers of a popular object from all missing at once when it expires, each hit refreshes the entry
+    early with a probability that grows as the expiry nears, and with the time the object took to load, scaled by
+    `beta` ("XFetch"). Set `beta` to 0 to turn that off."""
+
+    def __init__(self, ttl=300.0, max_size=1000, negative_ttl=30.0, beta=1.0, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        self.beta = beta
+        self.clock = clock
+
+        # (api_key, account, id, params): (values or error, stored at, ttl, seconds it took to load)
+        self._entries = collections.OrderedDict()
+        # (account, id): (api_key, params) of its entries
+        self._variants = {}
+
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'invalidations': 0, 'negative_hits': 0,
+                      'early_refreshes': 0, 'collapsed': 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """The cached values of `key`, or None when there are none, they are older than `ttl` or they are picked for
+        an early refresh. Raises the cached error of a missing object."""
+
+        entry = self._entries.get(key)
+
+        if entry is not None:
+            values, stored_at, ttl, cost = entry
+            age = self.clock() - stored_at
+
+            if age < ttl:
+                self._entries.move_to_end(key)
+
+                if isinstance(values, error.StripeError):
+                    self.stats['negative_hits'] += 1
+                    raise values.with_traceback(None)
+
+                # 1 - random() is in (0, 1], so the log is defined and at most 0
+                if cost and self.beta and age - cost * self.beta * math.log(1.0 - random.random()) >= ttl:
+                    self.stats['early_refreshes'] += 1
+                    return None
+
+                self.stats['hits'] += 1
+
+                return values
+
+            self.stats['expired'] += 1
+            self._remove(key)
+
+        self.stats['misses'] += 1
+
+    def put(self, key, values, cost=0.0):
+        """Caches `values`, which took `cost` seconds to load."""
+
+        self._store(key, (util.plain(values), self.clock(), self.ttl, cost))
+
+    def put_missing(self, key, err):
+        """Caches the error raised for an object that does not exist."""
+
+        if self.negative_ttl:
+            self._store(key, (err, self.clock(), self.negative_ttl, 0.0))
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self._variants.setdefault(key[1:3], set()).add((key[0], key[3]))
+
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+            self.stats['evictions'] += 1
+
+    def invalidate(self, account, id):
+        """Drops the entries of one object, whatever API key and parameters it was retrieved with."""
+
+        for api_key, params in self._variants.pop((account, id), ()):
+            del self._entries[(api_key, account, id, params)]
+            self.stats['invalidations'] += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._variants.clear()
+
+    def _remove(self, key):
+        del self._entries[key]
+
+        variants = self._variants[key[1:3]]
+        variants.discard((key[0], key[3]))
+        if not variants:
+            del self._variants[key[1:3]]
+
+
+class PersistentCache(object):
+    """Raw JSON of immutable objects in a sqlite database, keyed by (account, object, id). The database holds no API
+    key, so use one file per Stripe account unless the objects are retrieved through `Stripe-Account`."""
+
+    def __init__(self, path, immutable=None):
+        self.path = path
+        self.immutable = IMMUTABLE if immutable is None else immutable
+
+        # the queries run in this thread, one at a time and in the order they were made
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._db = self._executor.submit(self._connect).result()
+
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0}
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('CREATE TABLE IF NOT EXISTS objects (account TEXT NOT NULL, object TEXT NOT NULL, '
+                   'id TEXT NOT NULL, body TEXT NOT NULL, PRIMARY KEY (account, object, id)) WITHOUT ROWID')
+
+        return db
+
+    def covers(self, object):
+        """Whether objects of the type `object` may be stored."""
+
+        return object in self.immutable
+
+    def is_immutable(self, values):
+        object = values.get('object')
+        if object not in self.immutable:
+            return False
+
+        check = self.immutable[object]
+
+        return check is None or bool(check(values))
+
+    def _submit(self, wait, method, *args):
+        future = self._executor.submit(method, *args)
+
+        if wait:
+            return future.result()
+
+        future.add_done_callback(_log_failure)
+
+    def get(self, account, object, id):
+        """The stored values of the object, or None. Blocks until the queries made before are done; coroutines use
+        `get_async` instead."""
+
+        return self._submit(True, self._get, account, object, id)
+
+    async def get_async(self, account, object, id):
+        return await asyncio.wrap_future(self._executor.submit(self._get, account, object, id))
+
+    def _get(self, account, object, id):
+        row = self._db.execute('SELECT body FROM objects WHERE account = ? AND object = ? AND id = ?',
+                               (account or '', object, id)).fetchone()
+
+        if row is None:
+            self.stats['misses'] += 1
+            return None
+
+        self.stats['hits'] += 1
+
+        return json.loads(row[0])
+
+    def put(self, account, values, wait=True):
+        """Stores `values` if they are of an immutable object, and tells whether they were. With `wait` unset, the
+        query is only queued, as it is for the writes made on the event loop; failures are then logged."""
+
+        if not values.get('id') or not self.is_immutable(values):
+            return False
+
+        # encoded right away, as the values may change before the query runs
+        self._submit(wait, self._put, account or '', values['object'], values['id'],
+                     json.dumps(values, separators=(',', ':')))
+
+        return True
+
+    def _put(self, account, object, id, body):
+        self._db.execute('INSERT OR REPLACE INTO objects (account, object, id, body) VALUES (?, ?, ?, ?)',
+                         (account, object, id, body))
+        self.stats['writes'] += 1
+
+    def delete(self, account, object, id, wait=True):
+        self._submit(wait, self._delete, account or '', object, id)
+
+    def _delete(self, account, object, id):
+        self._db.execute('DELETE FROM objects WHERE account = ? AND object = ? AND id = ?', (account, object, id))
+
+    def __len__(self):
+        return self._submit(True, lambda: self._db.execute('SELECT COUNT(*) FROM objects').fetchone()[0])
+
+    def close(self):
+        """Closes the database once the queued writes are done."""
+
+        self._submit(True, self._db.close)
+        self._executor.shutdown()
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.warning('Writing to the persistent cache failed: %r', future.exception())
+
+
+def enable(cls, ttl=300.0, max_size=1000, negative_ttl=30.0, beta=1.0):
+    """Starts caching the retrieves of the resource class `cls`, or changes the settings of its cache, and returns the
+    cache."""
+
+    cache = caches.get(cls)
+
+    if cache is None:
+        cache = caches[cls] = RetrieveCache(ttl, max_size, negative_ttl, beta)
+    else:
+        cache.ttl = ttl
+        cache.max_size = max_size
+        cache.negative_ttl = negative_ttl
+        cache.beta = beta
+
+    return cache
+
+
+def disable(cls=None):
+    """Stops caching the retrieves of `cls`, or of every class, and drops the cached objects."""
+
+    if cls is None:
+        caches.clear()
+    else:
+        caches.pop(cls, None)
+
+
+def enable_persistent(path, immutable=None):
+    """Keeps the immutable objects retrieved from now on in the sqlite database at `path`, and serves them from it.
+    `immutable` replaces `IMMUTABLE`."""
+
+    global persistent
+
+    disable_persistent()
+    persistent = PersistentCache(path, immutable)
+
+    return persistent
+
+
+def disable_persistent():
+    global persistent
+
+    if persistent is not None:
+        persistent.close()
+        persistent = None
+
+
+_object_names = {}
+
+
+def object_name(cls):
+    """The `object` of the API responses that `cls` stands for."""
+
+    if not _object_names:
+        from aiostripe.resource import OBJECT_CLASSES
+
+        _object_names.update((klass, name) for name, klass in OBJECT_CLASSES.items())
+
+    return _object_names.get(cls)
+
+
+def enabled(cls):
+    return cls in caches or (persistent is not None and persistent.covers(object_name(cls)))
+
+
+def scope(obj):
+    return obj.api_key or aiostripe.api_key, obj.stripe_account, obj.get('id')
+
+
+def key(obj):
+    params = obj._retrieve_params
+
+    return scope(obj) + (json.dumps(params, sort_keys=True, default=str) if params else '',)
+
+
+# (class, api_key, account, id, params): running load of the object
+_loads = {}
+
+
+async def fetch(obj, load):
+    """The values of `obj` from the in-memory cache of its class or from the persistent cache, or else the response of
+    the coroutine function `load`, which is then cached. Concurrent fetches of an object share one load."""
+
+    memory = caches.get(type(obj))
+    obj_key = key(obj)
+
+    if memory is not None:
+        values = memory.get(obj_key)
+        if values is not None:
+            return values
+
+    load_key = (type(obj),) + obj_key
+    running = _loads.get(load_key)
+
+    if running is None:
+        running = _loads[load_key] = asyncio.ensure_future(_load(obj, obj_key, memory, load))
+        running.add_done_callback(lambda f: _load_done(load_key, f))
+
+        return await asyncio.shield(running)
+
+    if memory is not None:
+        memory.stats['collapsed'] += 1
+
+    # the first caller gets the response itself, the others copies of it
+    return util.plain(await asyncio.shield(running))
+
+
+def _load_done(load_key, running):
+    if _loads.get(load_key) is running:
+        del _loads[load_key]
+
+    # loads whose callers were all cancelled must not leave "exception was never retrieved" behind
+    if not running.cancelled():
+        running.exception()
+
+
+async def _load(obj, obj_key, memory, load):
+    name = object_name(type(obj))
+    # objects retrieved with parameters such as `expand` differ from the stored ones
+    on_disk = persistent is not None and not obj_key[3] and persistent.covers(name)
+
+    values = await persistent.get_async(obj_key[1], name, obj_key[2]) if on_disk else None
+    cost = 0.0
+
+    if values is None:
+        started = time.monotonic()
+
+        try:
+            values = await load()
+        except error.InvalidRequestError as e:
+            if memory is not None and e.http_status == 404:
+                memory.put_missing(obj_key, e)
+            raise
+
+        cost = time.monotonic() - started
+
+        if on_disk:
+            persistent.put(obj_key[1], values, wait=False)
+
+    if memory is not None:
+        memory.put(obj_key, values, cost)
+
+    return values
+
+
+def invalidate(obj):
+    cache = caches.get(type(obj))
+
+    if cache is not None:
+        cache.invalidate(obj.stripe_account, obj.get('id'))
+
+    if persistent is not None and persistent.covers(object_name(type(obj))):
+        persistent.delete(obj.stripe_account, object_name(type(obj)), obj.get('id'), wait=False)
+
+
+def written(obj, response):
+    """Called with the response of every write made through `obj`. A response holding the object itself, as those of
+    `save` and most actions do, replaces the cached copies; anything else drops them."""
+
+    if not enabled(type(obj)):
+        return
+
+    invalidate(obj)
+
+    if type(response) is type(obj) and response.get('id') == obj.get('id') and not response.get('deleted'):
+        cache = caches.get(type(obj))
+        if cache is not None:
+            cache.put(scope(obj) + ('',), response)
+
+        if persistent is not None:
+            persistent.put(obj.stripe_account, response, wait=False)
+
+
+def stats():
+    """The hit, miss and eviction counts and the size of each class's cache, by class name."""
+
+    return dict((cls.__name__, dict(cache.stats, size=len(cache))) for cls, cache in caches.items())
+
+
+# object: (field, object it is shown in) for objects that are also embedded in another one
+EMBEDDED_IN = {
+    'bank_account': ('customer', 'customer'),
+    'card': ('customer', 'customer'),
+    'discount': ('customer', 'customer'),
+    'dispute': ('charge', 'charge'),
+    'refund': ('charge', 'charge'),
+    'subscription': ('customer', 'customer'),
+}
+
+
+class CacheUpdater(util.BackgroundTask):
+    """Keeps the retrieve caches in line with the changes announced by Stripe events.
+
+    Pass the events received by a webhook handler to `apply`, or have them pulled from `Event.list` every `interval`
+    seconds by `start` (or by awaiting `poll`). The object of a created or updated event replaces the cached copies of
+    that object, unless a later event about it was applied already; a deletion drops them. Changes to objects that are
+    also shown inside another one, such as a customer's subscriptions or a charge's refunds, drop the cached copies of
+    the other object.
+
+    Events are tied to the API key and `Stripe-Account` given here; connect events carry their own `account`.
+    """
+
+    def __init__(self, api_key=None, stripe_account=None, interval=5.0, max_tracked=10000):
+        self.api_key = api_key
+        self.stripe_account = stripe_account
+        self.interval = interval
+        self.max_tracked = max_tracked
+
+        # id of the newest event pulled so far
+        self.cursor = None
+
+        # (account, id): created and id of the last event seen for the object
+        self._applied = collections.OrderedDict()
+
+        self.stats = {'events': 0, 'updates': 0, 'invalidations': 0, 'out_of_order': 0}
+
+    def apply(self, event):
+        """Updates the caches with one event, a dict such as the parsed body of a webhook or an `Event`."""
+
+        from aiostripe.resource import convert_to_stripe_object
+
+        self.stats['events'] += 1
+
+        obj = event.get('data', {}).get('object')
+        if not (caches or persistent) or not isinstance(obj, dict):
+            return
+
+        account = event.get('account') or self.stripe_account
+        api_key = self.api_key or aiostripe.api_key
+
+        embedded = EMBEDDED_IN.get(obj.get('object'))
+        if embedded is not None and isinstance(obj.get(embedded[0]), str):
+            self._invalidate(account, obj[embedded[0]])
+
+        if not obj.get('id'):
+            return
+
+        deleted = event.get('type', '').endswith('.deleted') or obj.get('deleted')
+
+        if persistent is not None and persistent.covers(obj.get('object')):
+            if deleted:
+                persistent.delete(account, obj['object'], obj['id'], wait=False)
+            else:
+                persistent.put(account, obj, wait=False)
+
+        resource = convert_to_stripe_object(obj, api_key, account)
+        cache = caches.get(type(resource))
+        if cache is None:
+            return
+
+        tracked = (account, obj['id'])
+        created = event.get('created') or 0
+        last = self._applied.get(tracked)
+
+        # `created` has a resolution of one second, so of two events from the same second either may be the newer
+        if last is not None and (created < last[0] or created == last[0] and event.get('id') != last[1]):
+            self.stats['out_of_order'] += 1
+            self._invalidate(account, obj['id'])
+            self._applied[tracked] = (max(created, last[0]), event.get('id'))
+            return
+
+        self._applied[tracked] = (created, event.get('id'))
+        self._applied.move_to_end(tracked)
+        while len(self._applied) > self.max_tracked:
+            self._applied.popitem(last=False)
+
+        cache.invalidate(account, obj['id'])
+
+        if deleted:
+            self.stats['invalidations'] += 1
+        else:
+            cache.put((api_key, account, obj['id'], ''), resource)
+            self.stats['updates'] += 1
+
+    def _invalidate(self, account, id):
+        for cache in caches.values():
+            cache.invalidate(account, id)
+
+        self.stats['invalidations'] += 1
+
+    async def poll(self):
+        """Applies the events created since the last poll, oldest first. The first poll only looks up the newest
+        event, so history is not replayed; set `cursor` to an event id to start after that event instead."""
+
+        from aiostripe.resource import Event
+
+        if self.cursor is None:
+            page = await Event.list(api_key=self.api_key, stripe_account=self.stripe_account, limit=1)
+            if page.data:
+                self.cursor = page.data[0].id
+            else:
+                self.cursor = ''
+
+            return
+
+        while True:
+            params = {'limit': 100}
+            if self.cursor:
+                params['ending_before'] = self.cursor
+
+            page = await Event.list(api_key=self.api_key, stripe_account=self.stripe_account, **params)
+            if not page.data:
+                return
+
+            for event in reversed(page.data):
+                self.apply(event)
+
+            self.cursor = page.data[0].id
+
+            if not page.has_more:
+                return
+
+    async def _prepare(self):
+        await self.poll()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+
+            try:
+                await self.poll()
+            except error.StripeError as e:
+                logger.warning('Polling events for the caches failed: %r', e)
@@ -0,0 +1,164 @@
+"""Columnar iteration over list endpoints, for loading many objects into dataframes and the like.
+
+    fields = ['amount', 'currency', 'created', 'status', 'customer']
+    async for batch in aiostripe.columnar.iter_batches(aiostripe.Charge, fields, created={'gte': since}):
+        frame = pandas.DataFrame(batch.columns)
+
+The items of the pages are used as they were decoded, without turning them into Stripe objects, and only the projected
+fields of them are kept, in one column per field: integers, timestamps, floats and booleans in `array.array`s, strings
+in lists sharing one interned copy of each value, so categorical fields such as `currency` or `status` cost a pointer
+per item. Fields are paths into the objects, and expanded objects are represented by their id.
+
+The kind of a column is that of the first value found for it unless given in `kinds`; give it for fields that can be
+null. Missing values of numeric columns are stored as 0 and flagged in `batch.nulls`.
+"""
+import collections
+import sys
+from array import array
+
+from aiostripe import api_requestor, util
+from coroutils.generator import async_generator
+
+KINDS = ('int', 'timestamp', 'float', 'bool', 'category', 'str', 'object')
+
+TYPECODES = {'int': 'q', 'timestamp': 'q', 'float': 'd', 'bool': 'b'}
+
+CONVERSIONS = {'int': int, 'timestamp': int, 'float': float, 'bool': int}
+
+
+def infer_kind(field, value):
+    if isinstance(value, bool):
+        return 'bool'
+    elif isinstance(value, int):
+        name = field.rsplit('.', 1)[-1]
+        if name in ('created', 'date', 'period_start', 'period_end') or name.endswith(('_at', '_date')):
+            return 'timestamp'
+        return 'int'
+    elif isinstance(value, float):
+        return 'float'
+    elif isinstance(value, str):
+        return 'category'
+
+    return 'object'
+
+
+class Column(object):
+    def __init__(self, kind, length=0):
+        if kind not in KINDS:
+            raise ValueError('Unknown column kind: %r' % kind)
+
+        self.kind = kind
+        self.typecode = TYPECODES.get(kind)
+        self.values = array(self.typecode) if self.typecode else []
+        # numeric columns: 1 for each missing value, created with the first of them
+        self.nulls = None
+
+        for _ in range(length):
+            self.append(None)
+
+    def append(self, value):
+        if self.typecode is None:
+            self.values.append(sys.intern(value) if self.kind == 'category' and isinstance(value, str) else value)
+        elif value is None:
+            if self.nulls is None:
+                self.nulls = array('b', bytes(len(self.values)))
+            self.values.append(0)
+            self.nulls.append(1)
+        else:
+            self.values.append(CONVERSIONS[self.kind](value))
+            if self.nulls is not None:
+                self.nulls.append(0)
+
+
+class Batch(object):
+    def __init__(self, columns):
+        # field: array or list, in the order of the projection
+        self.columns = collections.OrderedDict((field, column.values) for field, column in columns.items())
+        self.kinds = dict((field, column.kind) for field, column in columns.items())
+        # field: array of 1 for each missing value, for the numeric columns with missing values
+        self.nulls = dict((field, column.nulls) for field, column in columns.items() if column.nulls is not None)
+
+    def __len__(self):
+        for values in self.columns.values():
+            return len(values)
+
+        return 0
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    def __iter__(self):
+        return iter(self.columns)
+
+
+class _BatchBuilder(object):
+    def __init__(self, fields, kinds):
+        self.fields = fields
+        # kinds given or inferred so far, kept for the following batches
+        self.kinds = kinds
+        self.columns = collections.OrderedDict()
+        self.length = 0
+
+    def append(self, item):
+        for field in self.fields:
+            value = util.field(item, field)
+            column = self.columns.get(field)
+
+            if column is None:
+                kind = self.kinds.get(field)
+
+                if kind is None and value is None:
+                    continue
+                elif kind is None:
+                    kind = self.kinds[field] = infer_kind(field, value)
+
+                # the items so far had no value for it
+                column = self.columns[field] = Column(kind, self.length)
+
+            column.append(value)
+
+        self.length += 1
+
+    def build(self):
+        columns = collections.OrderedDict()
+        for field in self.fields:
+            columns[field] = self.columns.get(field) or Column(self.kinds.get(field, 'object'), self.length)
+
+        return Batch(columns)
+
+
+@async_generator
+async def iter_batches(cls, fields, batch_size=10000, kinds=None, api_key=None, stripe_account=None, **params):
+    """Yields the `fields` of the objects listed by the resource class `cls`, in `Batch`es of `batch_size` items.
+    `params` are those of `cls.list`, e.g. `created` or `customer`. Leaving the batches early, `await batches.close()`
+    to release the response being read."""
+
+    params.setdefault('limit', 100)
+    kinds = dict(kinds or {})
+    builder = _BatchBuilder(list(fields), kinds)
+
+    while True:
+        requestor = api_requestor.APIRequestor(api_key, account=stripe_account)
+        envelope = {}
+        item_id = None
+
+        items = requestor.stream_list(cls.class_url(), params, envelope=envelope)
+        try:
+            async for item in items:
+                item_id = item.get('id')
+                builder.append(item)
+
+                if builder.length == batch_size:
+                    await async_yield(builder.build())
+                    builder = _BatchBuilder(builder.fields, kinds)
+        finally:
+            # releases the response of the page when the batches are closed before the end
+            await items.close()
+
+        if not envelope.get('has_more', False) or item_id is None:
+            break
+
+        params['starting_after'] = item_id
+
+    if builder.length:
+        await async_yield(builder.build())
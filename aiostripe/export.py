@@ -0,0 +1,339 @@
+"""Exports all objects of a resource to a file of newline-delimited JSON or CSV.
+
+    python -m aiostripe.export charges --created-gte 2017-01-01 --partitions 8 -o charges.ndjson.gz
+
+The objects are written as their pages arrive, so the export never holds more than a page per partition. With
+`--partitions`, the `created` range is split into that many parts of equal length which are paged concurrently; the
+objects of different parts are interleaved in the output. Encoding, compression and writing happen in a thread, off
+the event loop.
+
+After each page written, the progress is saved to a checkpoint file next to the output. An export started again with
+the same arguments resumes from there: the output is cut back to the last page checkpointed and the paging continues
+after it. The checkpoint is removed once the export is complete. Compressed outputs are written as one gzip member per
+page, which gzip readers handle like a single one.
+
+The API key is taken from `--api-key` or the STRIPE_API_KEY environment variable.
+"""
+import argparse
+import asyncio
+import calendar
+import concurrent.futures
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+import time
+
+import aiostripe
+from aiostripe import resource, util
+from aiostripe.http_client import close_default_http_clients
+from aiostripe.logger import logger
+
+
+def resource_class(name):
+    """The listable resource class of `name`, either its object name (`charge`) or its URL name (`charges`)."""
+
+    for object, cls in resource.OBJECT_CLASSES.items():
+        if not issubclass(cls, resource.ListableAPIResource):
+            continue
+
+        if name in (object, cls.class_url().rsplit('/', 1)[-1]):
+            return cls
+
+    raise ValueError('%r is not a resource that can be listed' % name)
+
+
+def timestamp(value):
+    """A Unix timestamp from an integer or an UTC date and time such as `2017-01-31` or `2017-01-31T12:00:00`."""
+
+    if value.isdigit():
+        return int(value)
+
+    for format in ('%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return calendar.timegm(time.strptime(value, format))
+        except ValueError:
+            pass
+
+    raise ValueError('Invalid timestamp: %r' % value)
+
+
+def partition(gte, lt, count):
+    """Splits [gte, lt) into `count` consecutive ranges of about the same length."""
+
+    step = max(1, -(-(lt - gte) // count))
+
+    return [(start, min(start + step, lt)) for start in range(gte, lt, step)]
+
+
+def _cell(obj, field):
+    value = util.field(obj, field)
+
+    if value is None:
+        return ''
+    elif isinstance(value, bool):
+        return 'true' if value else 'false'
+    elif isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(',', ':'), sort_keys=True)
+
+    return value
+
+
+class Exporter(object):
+    def __init__(self, cls, path, format='ndjson', fields=None, compress=False, created_gte=None, created_lt=None,
+                 partitions=1, page_size=100, params=None, api_key=None, stripe_account=None, checkpoint=True):
+        if format not in ('ndjson', 'csv'):
+            raise ValueError('Unknown format: %r' % format)
+        if partitions > 1 and created_gte is None:
+            raise ValueError('Partitioning needs the start of the created range')
+
+        self.cls = cls
+        self.path = path
+        self.format = format
+        self.fields = list(fields) if fields else None
+        self.compress = compress
+        self.page_size = page_size
+        self.params = dict(params or {})
+        self.api_key = api_key
+        self.stripe_account = stripe_account
+        self.checkpoint_path = path + '.checkpoint' if checkpoint and path != '-' else None
+
+        if created_gte is not None:
+            lt = created_lt if created_lt is not None else int(time.time()) + 1
+            ranges = partition(created_gte, lt, partitions)
+        else:
+            ranges = [(None, created_lt)]
+
+        # state of the export, saved as checkpoint
+        self.state = {
+            'query': {'resource': cls.class_url(), 'params': self.params, 'created_gte': created_gte,
+                      'created_lt': created_lt, 'partitions': partitions, 'format': format, 'compress': compress,
+                      'stripe_account': stripe_account},
+            'partitions': [{'gte': gte, 'lt': lt, 'last_id': None, 'done': False} for gte, lt in ranges],
+            'fields': self.fields,
+            'items': 0,
+            'bytes': 0,
+        }
+
+        self._file = None
+        self._writer = None
+
+        self.stats = {'items': 0, 'bytes': 0, 'seconds': 0.0}
+
+    def _resume(self):
+        if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+            return False
+
+        with open(self.checkpoint_path) as f:
+            state = json.load(f)
+
+        if state['query'] != self.state['query']:
+            raise ValueError('%s belongs to an export with other arguments' % self.checkpoint_path)
+
+        self.state = state
+        self.fields = state['fields']
+
+        return True
+
+    def _open(self):
+        if self.path == '-':
+            self._file = sys.stdout.buffer
+        elif self._resume():
+            self._file = open(self.path, 'r+b')
+            # drop whatever was written after the last checkpoint
+            self._file.truncate(self.state['bytes'])
+            self._file.seek(self.state['bytes'])
+        else:
+            self._file = open(self.path, 'wb')
+
+    def _encode(self, objects):
+        if self.format == 'ndjson':
+            return ''.join(json.dumps(obj, separators=(',', ':')) + '\n' for obj in objects).encode('utf-8')
+
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator='\n')
+
+        if self.fields is None:
+            self.fields = self.state['fields'] = sorted(objects[0])
+        if self.state['bytes'] == 0:
+            writer.writerow(self.fields)
+
+        for obj in objects:
+            writer.writerow([_cell(obj, field) for field in self.fields])
+
+        return out.getvalue().encode('utf-8')
+
+    def _write(self, objects, partition, last_id, done=False):
+        """Writes a page and checkpoints it; runs in the writer thread, one page at a time, and is the only place
+        the state changes in."""
+
+        data = self._encode(objects) if objects else b''
+        if self.compress and data:
+            data = gzip.compress(data)
+
+        self._file.write(data)
+        self._file.flush()
+
+        partition['last_id'] = last_id
+        partition['done'] = done
+        self.state['items'] += len(objects)
+        self.state['bytes'] += len(data)
+        self.stats['items'] += len(objects)
+        self.stats['bytes'] += len(data)
+
+        if self.checkpoint_path is not None:
+            os.fsync(self._file.fileno())
+
+            with open(self.checkpoint_path + '.tmp', 'w') as f:
+                json.dump(self.state, f)
+            os.replace(self.checkpoint_path + '.tmp', self.checkpoint_path)
+
+    async def _export(self, partition):
+        params = dict(self.params, limit=self.page_size)
+
+        created = {}
+        if partition['gte'] is not None:
+            created['gte'] = partition['gte']
+        if partition['lt'] is not None:
+            created['lt'] = partition['lt']
+        if created:
+            params['created'] = created
+
+        if partition['last_id'] is not None:
+            params['starting_after'] = partition['last_id']
+
+        loop = asyncio.get_event_loop()
+        page = []
+
+        objects = self.cls.auto_paging_iter(api_key=self.api_key, stripe_account=self.stripe_account, stream=True,
+                                            **params)
+
+        try:
+            async for obj in objects:
+                page.append(obj)
+
+                if len(page) == self.page_size:
+                    await loop.run_in_executor(self._writer, self._write, page, partition, obj.id)
+                    page = []
+        finally:
+            await objects.close()
+
+        await loop.run_in_executor(self._writer, self._write, page, partition,
+                                   page[-1].id if page else partition['last_id'], True)
+
+    async def run(self, progress=None, interval=1.0):
+        """Exports the objects, calling `progress(stats)` every `interval` seconds and once at the end."""
+
+        self._writer = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._open()
+
+        started = time.monotonic()
+        reporter = None
+
+        async def report():
+            while True:
+                await asyncio.sleep(interval)
+                self.stats['seconds'] = time.monotonic() - started
+                progress(dict(self.stats))
+
+        if progress is not None:
+            reporter = asyncio.ensure_future(report())
+
+        tasks = [asyncio.ensure_future(self._export(partition)) for partition in self.state['partitions']
+                 if not partition['done']]
+
+        failure = None
+        try:
+            await asyncio.gather(*tasks)
+        except Exception as e:
+            failure = e
+            raise
+        finally:
+            # when a partition failed, the others have to stop before the writer and the file go away
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.wait(tasks)
+            # gather raised the first failure, the others are only logged
+            for task in tasks:
+                if not task.cancelled() and task.exception() is not None and task.exception() is not failure:
+                    logger.warning('Exporting a partition failed: %r', task.exception())
+
+            if reporter is not None:
+                reporter.cancel()
+
+            self._writer.shutdown()
+            if self._file is not sys.stdout.buffer:
+                self._file.close()
+
+        if self.checkpoint_path is not None and os.path.exists(self.checkpoint_path):
+            os.unlink(self.checkpoint_path)
+
+        self.stats['seconds'] = time.monotonic() - started
+        if progress is not None:
+            progress(dict(self.stats))
+
+        return self.stats
+
+
+def print_progress(stats):
+    rate = stats['items'] / stats['seconds'] if stats['seconds'] else 0.0
+
+    sys.stderr.write('%d objects, %.1f/s, %.2f MB written\n' % (stats['items'], rate, stats['bytes'] / 1e6))
+    sys.stderr.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m aiostripe.export', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('resource', help='resource to export, such as charges or customer')
+    parser.add_argument('-o', '--output', default='-', help='file to write to, standard output by default')
+    parser.add_argument('--format', choices=('ndjson', 'csv'), help='by default csv for *.csv[.gz], else ndjson')
+    parser.add_argument('--fields', help='comma separated fields of the CSV columns, such as id,amount,metadata.order')
+    parser.add_argument('--gzip', action='store_true', help='compress the output, the default for *.gz')
+    parser.add_argument('--created-gte', type=timestamp, metavar='TIME', help='only objects created at or after')
+    parser.add_argument('--created-lt', type=timestamp, metavar='TIME', help='only objects created before')
+    parser.add_argument('--customer', help='only objects of this customer')
+    parser.add_argument('--account', help='export from this connected account')
+    parser.add_argument('--api-key', default=os.environ.get('STRIPE_API_KEY'))
+    parser.add_argument('--partitions', type=int, default=1, help='parts of the created range paged concurrently')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--progress', type=float, default=1.0, metavar='SECONDS', help='0 to turn it off')
+    args = parser.parse_args(argv)
+
+    try:
+        cls = resource_class(args.resource)
+    except ValueError as e:
+        parser.error(str(e))
+
+    name = args.output[:-3] if args.output.endswith('.gz') else args.output
+    format = args.format or ('csv' if name.endswith('.csv') else 'ndjson')
+
+    params = {}
+    if args.customer:
+        params['customer'] = args.customer
+
+    try:
+        exporter = Exporter(cls, args.output, format=format, fields=args.fields.split(',') if args.fields else None,
+                            compress=args.gzip or args.output.endswith('.gz'), created_gte=args.created_gte,
+                            created_lt=args.created_lt, partitions=args.partitions, page_size=args.page_size,
+                            params=params, api_key=args.api_key, stripe_account=args.account)
+    except ValueError as e:
+        parser.error(str(e))
+
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(exporter.run(print_progress if args.progress else None, args.progress))
+    except aiostripe.error.StripeError as e:
+        sys.stderr.write('%s\n' % e)
+        return 1
+    finally:
+        loop.run_until_complete(close_default_http_clients())
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
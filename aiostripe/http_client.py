@@ -1,46 +1,607 @@
+import asyncio
+import ssl
 import textwrap
+import time
+import zlib
 
 import aiohttp
 
-from aiostripe import error
+import aiostripe
+from aiostripe import error, instrumentation, util
+from aiostripe.logger import logger
+from aiostripe.resolver import CachingResolver
+from coroutils.generator import async_generator
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+ACCEPT_ENCODING = 'gzip, deflate, br' if brotli is not None else 'gzip, deflate'
+
+# compressed bodies are read and decompressed in chunks of this size, yielding to the event loop in between
+DECOMPRESS_CHUNK_SIZE = 64 * 1024
+
+_default_clients = {}
 
 
 def new_default_http_client(*args, **kwargs):
     return AsyncioClient(*args, **kwargs)
 
 
+def default_http_client(verify_ssl_certs=True, ca_bundle_path=None):
+    """A client shared by every request made with the same settings, so that they share connections."""
+
+    key = (verify_ssl_certs, ca_bundle_path or aiostripe.ca_bundle_path)
+
+    client = _default_clients.get(key)
+    if client is None:
+        client = _default_clients[key] = new_default_http_client(verify_ssl_certs=verify_ssl_certs,
+                                                                 ca_bundle_path=ca_bundle_path)
+
+    return client
+
+
+async def close_default_http_clients():
+    clients = list(_default_clients.values())
+    _default_clients.clear()
+
+    for client in clients:
+        await client.close()
+
+
 class HTTPClient(object):
+    # whether the client has `request_stream`
+    supports_streaming = False
+    # whether `request` and `request_stream` take `timing`
+    supports_timing = False
+    # whether `request` takes an async iterable as `post_data`; other clients get multipart bodies as bytes
+    supports_streaming_uploads = False
+
     def __init__(self, verify_ssl_certs=True):
         self._verify_ssl_certs = verify_ssl_certs
 
-    def request(self, method, url, headers, post_data=None):
+    def request(self, method, url, headers, post_data=None, timing=None):
+        """`post_data` is either a string, bytes or, with `supports_streaming_uploads` set, an async iterable of bytes
+        to be sent chunked. `timing` is only passed to clients with `supports_timing` set: an
+        `instrumentation.RequestTiming` to record the network phases of the request in."""
+
         raise NotImplementedError('HTTPClient subclasses must implement `request`')
 
+    async def warmup(self, n=1, upload=False):
+        return 0
+
+    async def close(self):
+        pass
+
+    def stats(self):
+        return {}
+
+
+class SessionCachingSSLContext(ssl.SSLContext):
+    """Remembers the TLS session of the latest connection to every host and offers it when connecting to that host
+    again, so reconnects after the pool dropped an idle connection resume the session rather than doing a full
+    handshake. Python only supports this from 3.6; before that the context behaves like a plain one."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+
+        self._last_connections = {}
+        self._resumed = 0
+
+    if hasattr(ssl.SSLObject, 'session'):
+        def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+            if session is None and not server_side:
+                previous = self._last_connections.get(server_hostname)
+                if previous is not None:
+                    session = previous.session
+
+            sslobj = super().wrap_bio(incoming, outgoing, server_side=server_side, server_hostname=server_hostname,
+                                      session=session)
+
+            previous = self._last_connections.get(server_hostname)
+            if previous is not None and previous.session_reused:
+                self._resumed += 1
+            self._last_connections[server_hostname] = sslobj
+
+            return sslobj
+
+    @property
+    def resumed_handshakes(self):
+        current = self._last_connections.values()
+
+        return self._resumed + sum(1 for o in current if getattr(o, 'session_reused', False))
+
+
+def new_ssl_context(verify_ssl_certs=True, ca_bundle_path=None):
+    context = SessionCachingSSLContext(getattr(ssl, 'PROTOCOL_TLS_CLIENT', ssl.PROTOCOL_SSLv23))
+    context.options |= ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3
+
+    if verify_ssl_certs:
+        context.verify_mode = ssl.CERT_REQUIRED
+        context.check_hostname = True
+        context.load_verify_locations(cafile=ca_bundle_path or aiostripe.ca_bundle_path)
+    else:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+
+    return context
+
+
+class _DeflateDecoder(object):
+    """`Content-Encoding: deflate` should be zlib-wrapped, but some servers send raw deflate data."""
+
+    def __init__(self):
+        self._decompressor = None
+
+    def decompress(self, data):
+        if self._decompressor is None:
+            self._decompressor = zlib.decompressobj()
+            try:
+                return self._decompressor.decompress(data)
+            except zlib.error:
+                self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+
+        return self._decompressor.decompress(data)
+
+    def flush(self):
+        return self._decompressor.flush() if self._decompressor is not None else b''
+
+
+class _BrotliDecoder(object):
+    def __init__(self):
+        self._decompressor = brotli.Decompressor()
+
+    def decompress(self, data):
+        if hasattr(self._decompressor, 'process'):
+            return self._decompressor.process(data)
+
+        return self._decompressor.decompress(data)
+
+    def flush(self):
+        return b''
+
+
+def new_decoder(content_encoding):
+    """A decompressor for a `Content-Encoding`, or None when the body is not compressed in a supported way."""
+
+    content_encoding = content_encoding.strip().lower()
+
+    if content_encoding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif content_encoding == 'deflate':
+        return _DeflateDecoder()
+    elif content_encoding == 'br' and brotli is not None:
+        return _BrotliDecoder()
+
 
 class AsyncioClient(HTTPClient):
     name = 'aiohttp'
+    supports_streaming = True
+    supports_timing = True
+    supports_streaming_uploads = True
+
+    def __init__(self, verify_ssl_certs=True, ca_bundle_path=None, keepalive_timeout=15.0, dns_ttl=60.0):
+        """Idle pooled connections are closed after `keepalive_timeout` seconds. Keep it below the idle timeout of
+        the server, so connections are evicted before the server closes them under a request. Host names are resolved
+        through a `resolver.CachingResolver` with a TTL of `dns_ttl` seconds; None leaves resolution to aiohttp."""
+
+        super().__init__(verify_ssl_certs=verify_ssl_certs)
+
+        self._ca_bundle_path = ca_bundle_path
+        self._keepalive_timeout = keepalive_timeout
+        self._dns_ttl = dns_ttl
+        self._resolver = None
+        self._bytes_received = 0
+        self._bytes_decoded = 0
+        self._decompress_seconds = 0.0
+        self._ssl_context = None
+        self._session = None
+        self._loop = None
+        self._sessions_created = 0
 
-    async def request(self, method, url, headers, post_data=None):
+    @property
+    def ssl_context(self):
+        if self._ssl_context is None:
+            self._ssl_context = new_ssl_context(self._verify_ssl_certs, self._ca_bundle_path)
+
+        return self._ssl_context
+
+    def _get_session(self):
+        loop = asyncio.get_event_loop()
+
+        # a session belongs to the event loop it was created in
+        if self._session is not None and self._loop is not loop:
+            self._discard_session()
+
+        if self._session is None or self._session.closed:
+            kwargs = {}
+            if trace_config is not None:
+                kwargs['trace_configs'] = [trace_config]
+
+            connector_kwargs = {}
+            if self._dns_ttl is not None:
+                self._resolver = CachingResolver(ttl=self._dns_ttl)
+                # trace events for host resolution are only sent when the connector's own cache is off
+                connector_kwargs.update(resolver=self._resolver, use_dns_cache=False)
+
+            connector = aiohttp.TCPConnector(ssl=self.ssl_context, keepalive_timeout=self._keepalive_timeout,
+                                             **connector_kwargs)
+            self._session = aiohttp.ClientSession(connector=connector, auto_decompress=False,
+                                                  skip_auto_headers=('User-Agent', 'Content-Type', 'Authorization'),
+                                                  **kwargs)
+            self._loop = loop
+            self._sessions_created += 1
+
+        return self._session
+
+    def _request(self, method, url, headers, post_data, timing):
         if isinstance(post_data, str):
             post_data = post_data.encode('utf8')
 
-        with aiohttp.ClientSession(headers=headers,
-                                   skip_auto_headers=('User-Agent', 'Content-Type', 'Authorization')) as client:
-            try:
-                async with client.request(method.upper(), url, data=post_data) as res:
-                    rbody = await res.read()
-                    rstatus = res.status
-                    rheaders = {k.lower(): v for k, v in res.headers.items()}
-            except Exception as e:
-                self._handle_request_error(e)
+        kwargs = {}
+        if timing is not None and trace_config is not None:
+            kwargs['trace_request_ctx'] = timing
+
+        if 'Accept-Encoding' not in headers:
+            headers = dict(headers, **{'Accept-Encoding': ACCEPT_ENCODING})
 
-                assert False, 'unreachable'
+        return self._get_session().request(method.upper(), url, data=post_data, headers=headers, **kwargs)
+
+    async def request(self, method, url, headers, post_data=None, timing=None):
+        try:
+            async with self._request(method, url, headers, post_data, timing) as res:
+                with instrumentation.phase(timing, 'read'):
+                    rbody = await self._read_body(res, timing)
+                rstatus = res.status
+                rheaders = {k.lower(): v for k, v in res.headers.items()}
+        except Exception as e:
+            self._handle_request_error(e)
+
+            assert False, 'unreachable'
 
         return rbody, rstatus, rheaders
 
+    def request_stream(self, method, url, headers, post_data=None, timing=None):
+        """Like `request`, but returns an async context manager for a `StreamedResponse` as soon as the response
+        headers are in, so the body can be consumed while it is being received.
+
+            async with client.request_stream('get', url, headers) as response:
+                async for chunk in response.chunks():
+                    ...
+        """
+
+        return _StreamedRequest(self, method, url, headers, post_data, timing)
+
+    async def _read_body(self, res, timing):
+        reader = _BodyReader(res)
+
+        if reader.decoder is None:
+            rbody = reader.decode(await res.read())
+        else:
+            # decompressing a large body in one go would hold up the event loop for as long as it takes
+            parts = []
+            async for chunk in res.content.iter_chunked(DECOMPRESS_CHUNK_SIZE):
+                parts.append(reader.decode(chunk))
+                await asyncio.sleep(0)
+
+            parts.append(reader.flush())
+            rbody = b''.join(parts)
+
+        self._account(reader, timing)
+
+        return rbody
+
+    def _account(self, reader, timing):
+        self._bytes_received += reader.received
+        self._bytes_decoded += reader.decoded
+        self._decompress_seconds += reader.decompress_seconds
+
+        if timing is not None:
+            timing.content_encoding = reader.content_encoding or None
+            timing.bytes_received = reader.received
+            timing.bytes_decoded = reader.decoded
+            if reader.decoder is not None:
+                timing.add('decompress', reader.decompress_seconds)
+
+    async def warmup(self, n=1, upload=False):
+        """Opens up to `n` pooled connections to `aiostripe.api_base`, and as many to `upload_api_base` when `upload`
+        is set, so the first API requests do not pay for DNS, TCP and TLS setup. Idle connections already in the pool
+        count towards `n`. Returns how many of the connections could be used; failures are logged, not raised."""
+
+        bases = [aiostripe.api_base]
+        if upload and aiostripe.upload_api_base != aiostripe.api_base:
+            bases.append(aiostripe.upload_api_base)
+
+        # concurrent requests cannot share a connection, so n of them leave n connections in the pool
+        results = await asyncio.gather(*[self._ping(base) for base in bases for _ in range(n)])
+
+        return sum(results)
+
+    async def _ping(self, base):
+        try:
+            async with self._get_session().request('HEAD', base + '/') as res:
+                await res.read()
+        except Exception as e:
+            logger.debug('Warming up a connection to %s failed: %r', base, e)
+            return False
+
+        return True
+
+    def _discard_session(self):
+        """Lets go of the session and resolver of the event loop used before the current one."""
+
+        session, self._session = self._session, None
+        resolver, self._resolver = self._resolver, None
+        loop, self._loop = self._loop, None
+
+        if session.closed:
+            return
+
+        if not loop.is_closed():
+            # e.g. the loop of another thread: close them the next time it runs
+            asyncio.run_coroutine_threadsafe(self._close(session, resolver), loop)
+            return
+
+        # the connections went down with the loop, only the session and connector are left to mark as closed
+        connector = session.connector
+        session.detach()
+
+        if connector is not None:
+            try:
+                connector.close()
+            except RuntimeError:  # aiohttp versions closing the transports even though their loop is closed
+                pass
+
+    @staticmethod
+    async def _close(session, resolver):
+        if session is not None:
+            await session.close()
+
+        if resolver is not None:
+            await resolver.close()
+
+    async def close(self):
+        session, self._session = self._session, None
+        resolver, self._resolver = self._resolver, None
+
+        await self._close(session, resolver)
+
+    def stats(self):
+        """Counters of the work done setting up connections. `handshakes` is the number of completed TLS handshakes,
+        `resumed_handshakes` those of them that resumed an earlier session, and the `dns_` counters are the
+        `CachingResolver` stats of the current session. `bytes_received` counts response bodies as sent over the wire,
+        `bytes_decoded` after decompression, and `decompress_seconds` is the CPU time spent decompressing."""
+
+        ssl_stats = self._ssl_context.session_stats() if self._ssl_context is not None else {}
+
+        stats = {
+            'sessions': self._sessions_created,
+            'handshakes': ssl_stats.get('connect_good', 0),
+            'resumed_handshakes': self._ssl_context.resumed_handshakes if self._ssl_context is not None else 0,
+            'bytes_received': self._bytes_received,
+            'bytes_decoded': self._bytes_decoded,
+            'decompress_seconds': self._decompress_seconds,
+        }
+
+        if self._resolver is not None:
+            for key, value in self._resolver.stats.items():
+                stats['dns_%s' % key] = value
+
+        return stats
+
     @staticmethod
     def _handle_request_error(e):
         msg = 'Unexpected error communicating with Stripe. If this problem persists, let me know at ' \
               '<alex@downtownapp.co>.'
         msg = textwrap.fill(msg) + '\n\n(Network error: %r)' % e
         raise error.APIConnectionError(msg) from e
+
+
+class _BodyReader(object):
+    """Decompresses a response body as it is read and counts its size on the wire and decoded."""
+
+    def __init__(self, res):
+        self.content_encoding = res.headers.get('Content-Encoding', '')
+        self.decoder = new_decoder(self.content_encoding) if self.content_encoding else None
+
+        self.received = 0
+        self.decoded = 0
+        self.decompress_seconds = 0.0
+
+    def decode(self, chunk):
+        self.received += len(chunk)
+
+        if self.decoder is not None:
+            started = time.perf_counter()
+            chunk = self.decoder.decompress(chunk)
+            self.decompress_seconds += time.perf_counter() - started
+
+        self.decoded += len(chunk)
+
+        return chunk
+
+    def flush(self):
+        tail = self.decoder.flush() if self.decoder is not None else b''
+        self.decoded += len(tail)
+
+        return tail
+
+
+class _StreamedRequest(object):
+    def __init__(self, client, method, url, headers, post_data, timing):
+        self._client = client
+        self._args = (method, url, headers, post_data, timing)
+        self._context = None
+
+    async def __aenter__(self):
+        self._context = self._client._request(*self._args)
+
+        try:
+            res = await self._context.__aenter__()
+        except Exception as e:
+            self._client._handle_request_error(e)
+
+        return StreamedResponse(self._client, res, self._args[-1])
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return await self._context.__aexit__(exc_type, exc_val, exc_tb)
+
+
+class StreamedResponse(object):
+    def __init__(self, client, res, timing):
+        self.status = res.status
+        self.headers = {k.lower(): v for k, v in res.headers.items()}
+
+        self._client = client
+        self._res = res
+        self._timing = timing
+
+    @async_generator
+    async def chunks(self, chunk_size=DECOMPRESS_CHUNK_SIZE):
+        """Yields the decompressed body in chunks as it arrives."""
+
+        reader = _BodyReader(self._res)
+        iterator = self._res.content.iter_chunked(chunk_size)
+        read_seconds = 0.0
+
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    chunk = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    read_seconds += time.perf_counter() - started
+
+                chunk = reader.decode(chunk)
+                if chunk:
+                    await async_yield(chunk)
+
+            tail = reader.flush()
+            if tail:
+                await async_yield(tail)
+        except Exception as e:
+            self._client._handle_request_error(e)
+
+        self._client._account(reader, self._timing)
+        if self._timing is not None:
+            self._timing.add('read', read_seconds)
+
+    async def read(self):
+        parts = []
+        async for chunk in self.chunks():
+            parts.append(chunk)
+
+        return b''.join(parts)
+
+
+class KeepAliveManager(util.BackgroundTask):
+    """Keeps at least `min_idle` warm connections in the pool of `client` by calling `client.warmup(min_idle)` every
+    `interval` seconds. The pings also keep those connections from going idle for long, while connections opened
+    for bursts above `min_idle` age out through the client's `keepalive_timeout`.
+
+        async with KeepAliveManager(client, min_idle=4):
+            ...
+    """
+
+    def __init__(self, client, min_idle=2, interval=10.0, upload=False):
+        self.client = client
+        self.min_idle = min_idle
+        self.interval = interval
+        self.upload = upload
+
+    async def _prepare(self):
+        await self.client.warmup(self.min_idle, self.upload)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.client.warmup(self.min_idle, self.upload)
+
+
+def _traced(handler):
+    """Skips trace events of requests that are not being timed."""
+
+    async def inner(session, context, params):
+        timing = context.trace_request_ctx
+        if timing is not None:
+            handler(timing, params)
+
+    return inner
+
+
+@_traced
+def _on_request_start(timing, params):
+    timing.mark('request_start')
+
+
+@_traced
+def _on_connection_queued_end(timing, params):
+    timing.add('queued', timing.since('request_start'))
+
+
+@_traced
+def _on_connection_create_start(timing, params):
+    timing.mark('connect_start')
+
+
+@_traced
+def _on_connection_create_end(timing, params):
+    # host resolution happens while the connection is being created
+    timing.add('connect', timing.since('connect_start') - timing.phases.get('dns', 0.0))
+    timing.mark('connected')
+
+
+@_traced
+def _on_connection_reuseconn(timing, params):
+    timing.mark('connected')
+
+
+@_traced
+def _on_dns_resolvehost_start(timing, params):
+    timing.mark('dns_start')
+
+
+@_traced
+def _on_dns_resolvehost_end(timing, params):
+    timing.add('dns', timing.since('dns_start'))
+
+
+@_traced
+def _on_request_chunk_sent(timing, params):
+    timing.mark('sent')
+
+
+@_traced
+def _on_request_end(timing, params):
+    send = timing.between('connected', 'sent')
+    if send is not None:
+        timing.add('send', send)
+
+    timing.add('wait', timing.since('request_start', 'connected', 'sent'))
+
+
+def _new_trace_config():
+    if not hasattr(aiohttp, 'TraceConfig'):
+        return None
+
+    config = aiohttp.TraceConfig()
+    config.on_request_start.append(_on_request_start)
+    config.on_connection_queued_end.append(_on_connection_queued_end)
+    config.on_connection_create_start.append(_on_connection_create_start)
+    config.on_connection_create_end.append(_on_connection_create_end)
+    config.on_connection_reuseconn.append(_on_connection_reuseconn)
+    config.on_dns_resolvehost_start.append(_on_dns_resolvehost_start)
+    config.on_dns_resolvehost_end.append(_on_dns_resolvehost_end)
+    config.on_request_chunk_sent.append(_on_request_chunk_sent)
+    config.on_request_end.append(_on_request_end)
+
+    return config
+
+
+trace_config = _new_trace_config()
@@ -0,0 +1,85 @@
+"""Identity maps, which turn every copy of an object in a response, or in the pages of a list, into one instance.
+
+    customers = aiostripe.identity.IdentityMap()
+    async for charge in aiostripe.Charge.auto_paging_iter(expand=['data.customer'], identity_map=customers):
+        ...
+
+Charges of the same customer then share one `Customer` instead of each getting their own, which saves the memory and
+the conversion of the copies. Only objects nested in another one are shared: the items of the pages are neither kept
+by the map nor shared, so the map grows with the distinct customers, cards, balance transactions, ... the items refer
+to, not with the items listed. Shared objects are read-only, as a change through one of the places they appear in
+would show in all of them; retrieve an object to get a copy of your own. When copies of an object differ, e.g. because
+they were expanded to different depths, the first one converted is used for all of them.
+"""
+import contextlib
+import threading
+
+_local = threading.local()
+
+
+class IdentityMap(object):
+    def __init__(self):
+        # (class, account, id): object
+        self._objects = {}
+
+        self.stats = {'objects': 0, 'shared': 0}
+
+    def __len__(self):
+        return len(self._objects)
+
+    def get(self, klass, account, id):
+        obj = self._objects.get((klass, account, id))
+
+        if obj is not None:
+            self.stats['shared'] += 1
+
+        return obj
+
+    def add(self, obj, account):
+        obj._read_only = True
+        self._objects[(type(obj), account, obj['id'])] = obj
+        self.stats['objects'] += 1
+
+    def clear(self):
+        self._objects.clear()
+
+
+def active():
+    """The identity map the conversions on this thread are using, or None."""
+
+    return getattr(_local, 'identity_map', None)
+
+
+def nested():
+    """Whether the object being converted on this thread is nested in another one."""
+
+    return getattr(_local, 'depth', 0) > 0
+
+
+@contextlib.contextmanager
+def converting():
+    """Marks the conversions inside the block as those of the objects nested in the one being converted."""
+
+    _local.depth = getattr(_local, 'depth', 0) + 1
+
+    try:
+        yield
+    finally:
+        _local.depth -= 1
+
+
+@contextlib.contextmanager
+def using(identity_map):
+    """Makes the conversions inside the block use `identity_map`; they have to be synchronous."""
+
+    if identity_map is None:
+        yield
+        return
+
+    previous = active()
+    _local.identity_map = identity_map
+
+    try:
+        yield
+    finally:
+        _local.identity_map = previous
@@ -0,0 +1,196 @@
+"""Per-request timing records.
+
+Register a callback with `add_callback` and it is called with a `RequestTiming` once every API request has finished,
+including conversion of the response into Stripe objects. Nothing is measured while no callback is registered.
+
+Phases, in seconds (a phase is missing when it did not happen, e.g. no `dns` or `connect` on a reused connection):
+
+    encode      building the URL, parameters and headers
+    queued      waiting for a free connection in the pool
+    dns         resolving the host name
+    connect     opening the connection, including the TLS handshake
+    send        sending the request body
+    wait        waiting for the response headers after the request was sent
+    read        reading the response body, including decompressing it
+    decompress  the part of `read` spent decompressing the body
+    decode      interpret_response: JSON decoding and error handling
+    convert     convert_to_stripe_object
+
+The network phases come from aiohttp's client tracing and need aiohttp 3.0 or later. `bytes_received` is the size of
+the response body as sent, `bytes_decoded` its size after decompression and `content_encoding` the compression used.
+"""
+import asyncio
+import threading
+import time
+import urllib.parse
+
+from aiostripe.logger import logger
+
+callbacks = []
+
+# Every path segment that is not one of these is taken for an object ID in `normalize_path`
+PATH_WORDS = frozenset([
+    'v1', 'account', 'accounts', 'application_fees', 'balance', 'bank_accounts', 'bitcoin', 'cancel', 'capture',
+    'cards', 'charges', 'close', 'coupons', 'customers', 'discount', 'dispute', 'disputes', 'events',
+    'external_accounts', 'files', 'history', 'invoiceitems', 'invoices', 'lines', 'orders', 'pay', 'plans', 'products',
+    'receivers', 'recipients', 'refund', 'refunds', 'reversals', 'skus', 'sources', 'subscriptions', 'tokens',
+    'transactions', 'transfers', 'upcoming', 'verify',
+])
+
+
+def add_callback(callback):
+    callbacks.append(callback)
+
+
+def remove_callback(callback):
+    callbacks.remove(callback)
+
+
+def normalize_path(path):
+    """Replaces object IDs in an API path, so that `/v1/customers/cus_123/sources` becomes
+    `/v1/customers/{id}/sources`."""
+
+    return '/'.join(s if not s or s in PATH_WORDS else '{id}' for s in path.split('/'))
+
+
+class RequestTiming(object):
+    def __init__(self, method, url):
+        self.method = method.upper()
+        self.path = urllib.parse.urlsplit(url).path
+        self.path_template = normalize_path(self.path)
+        self.status = None
+        self.request_id = None
+        # there is no retry logic in the bindings yet, but callbacks should not have to special-case its absence
+        self.retries = 0
+        self.error = None
+        self.content_encoding = None
+        self.bytes_received = None
+        self.bytes_decoded = None
+        self.phases = {}
+        self.started_at = time.time()
+        self.duration = None
+
+        self._start = time.perf_counter()
+        self._marks = {}
+        self._finished = False
+
+    def mark(self, name):
+        self._marks[name] = time.perf_counter()
+
+    def since(self, *names):
+        """Seconds since the latest of the named marks that was set, or since the start of the request."""
+
+        start = max([self._marks[n] for n in names if n in self._marks] or [self._start])
+        return time.perf_counter() - start
+
+    def between(self, start, end):
+        if start in self._marks and end in self._marks:
+            return self._marks[end] - self._marks[start]
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def finish(self, error=None):
+        """Records the total duration and hands the timing to the callbacks. Only the first call has any effect."""
+
+        if self._finished:
+            return
+        self._finished = True
+
+        self.duration = time.perf_counter() - self._start
+        if error is not None:
+            self.error = type(error).__name__
+            self.status = self.status or getattr(error, 'http_status', None)
+
+        for callback in list(callbacks):
+            try:
+                callback(self)
+            except Exception:
+                logger.exception('Request timing callback %r failed', callback)
+
+    def as_dict(self):
+        return {
+            'method': self.method,
+            'path': self.path,
+            'path_template': self.path_template,
+            'status': self.status,
+            'request_id': self.request_id,
+            'retries': self.retries,
+            'error': self.error,
+            'content_encoding': self.content_encoding,
+            'bytes_received': self.bytes_received,
+            'bytes_decoded': self.bytes_decoded,
+            'started_at': self.started_at,
+            'duration': self.duration,
+            'phases': dict(self.phases),
+        }
+
+    def __repr__(self):
+        return '<RequestTiming %s %s %s %.1fms>' % (self.method, self.path_template, self.status,
+                                                    (self.duration or 0) * 1000)
+
+
+class _Phase(object):
+    def __init__(self, timing, name):
+        self.timing = timing
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.timing.add(self.name, time.perf_counter() - self.start)
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+_null_phase = _NullPhase()
+
+
+def start(method, url):
+    """A new `RequestTiming`, or None when no callback would receive it."""
+
+    if callbacks:
+        return RequestTiming(method, url)
+
+
+def phase(timing, name):
+    if timing is None:
+        return _null_phase
+
+    return timing.phase(name)
+
+
+# APIRequestor.request returns the decoded response before it is converted to Stripe objects, so the timing of a
+# successful request is parked here for the next convert_to_stripe_object call to pick up. The caller converts in the
+# same event loop step as the request returns; whatever is not picked up by the end of that step is finished without a
+# convert phase.
+_local = threading.local()
+
+
+def hand_off(timing):
+    _local.pending = timing
+    asyncio.get_event_loop().call_soon(_flush, timing)
+
+
+def take_pending():
+    timing = getattr(_local, 'pending', None)
+    _local.pending = None
+
+    return timing
+
+
+def _flush(timing):
+    if getattr(_local, 'pending', None) is timing:
+        _local.pending = None
+
+    timing.finish()
@@ -0,0 +1,135 @@
+"""Resolution of object ids within a scope, such as one request of a web application.
+
+    async with aiostripe.loader.Loader() as loader:
+        charges = await aiostripe.Charge.list(limit=100)
+        customers = await asyncio.gather(*[loader.resolve(charge, 'customer', aiostripe.Customer)
+                                           for charge in charges])
+
+The ids asked for while the event loop runs one round are collected, each one retrieved once with at most
+`max_concurrency` retrieves at a time, and the objects kept for the rest of the scope, so resolving an id again costs
+nothing. Stripe has no endpoint fetching several objects by id, so the retrieves of a round run concurrently rather
+than as one request.
+
+Within `async with`, `aiostripe.loader.current()` returns the loader to code that was not handed it (Python 3.7+).
+"""
+import asyncio
+
+try:
+    import contextvars
+except ImportError:  # Python < 3.7
+    contextvars = None
+
+_current = contextvars.ContextVar('aiostripe_loader', default=None) if contextvars is not None else None
+
+
+def current():
+    """The loader of the enclosing `async with Loader()` block, or None."""
+
+    if _current is None:
+        return None
+
+    return _current.get()
+
+
+class Loader(object):
+    def __init__(self, max_concurrency=10, api_key=None, stripe_account=None):
+        self.api_key = api_key
+        self.stripe_account = stripe_account
+
+        self._slots = asyncio.Semaphore(max_concurrency)
+        # (class, id): future of the object
+        self._objects = {}
+        # (class, id) and future of the objects asked for in the current round
+        self._pending = []
+        self._token = None
+
+        self.stats = {'loads': 0, 'deduplicated': 0, 'retrieves': 0}
+
+    def load(self, cls, id):
+        """A future of the object of the resource class `cls` with the given id."""
+
+        self.stats['loads'] += 1
+        key = (cls, id)
+
+        future = self._objects.get(key)
+
+        if future is not None:
+            self.stats['deduplicated'] += 1
+        else:
+            loop = asyncio.get_event_loop()
+            future = self._objects[key] = loop.create_future()
+
+            if not self._pending:
+                loop.call_soon(self._dispatch)
+            self._pending.append((key, future))
+
+        # one caller giving up must not cancel the load for the others
+        return asyncio.shield(future)
+
+    async def load_many(self, cls, ids):
+        return await asyncio.gather(*[self.load(cls, id) for id in ids])
+
+    async def resolve(self, obj, field, cls):
+        """The object `obj[field]` refers to: loaded if it is an id, or kept for later loads if it was expanded."""
+
+        value = obj.get(field)
+
+        if value is None:
+            return None
+        elif isinstance(value, str):
+            return await self.load(cls, value)
+
+        self.prime(value)
+
+        return value
+
+    def prime(self, obj):
+        """Keeps `obj`, a resource that is already at hand, for the loads of its id."""
+
+        key = (type(obj), obj.get('id'))
+
+        if key not in self._objects:
+            future = self._objects[key] = asyncio.get_event_loop().create_future()
+            future.set_result(obj)
+
+    def clear(self, cls=None, id=None):
+        """Forgets the loaded objects, or those of one class, or one of them."""
+
+        for key in list(self._objects):
+            if (cls is None or key[0] is cls) and (id is None or key[1] == id) and self._objects[key].done():
+                del self._objects[key]
+
+    def _dispatch(self):
+        pending, self._pending = self._pending, []
+
+        for key, future in pending:
+            asyncio.ensure_future(self._retrieve(key, future))
+
+    async def _retrieve(self, key, future):
+        cls, id = key
+
+        async with self._slots:
+            self.stats['retrieves'] += 1
+
+            try:
+                obj = await cls.retrieve(id, api_key=self.api_key, stripe_account=self.stripe_account)
+            except Exception as e:
+                # failures are not kept, so the id can be loaded again
+                if self._objects.get(key) is future:
+                    del self._objects[key]
+                future.set_exception(e)
+            else:
+                future.set_result(obj)
+
+    async def __aenter__(self):
+        if _current is not None:
+            self._token = _current.set(self)
+
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._token is not None:
+            _current.reset(self._token)
+            self._token = None
+
+        self._objects.clear()
@@ -0,0 +1,240 @@
+"""Request counters and latency histograms, fed by `aiostripe.instrumentation`.
+
+    registry = aiostripe.metrics.enable()
+    ...
+    print(registry.snapshot().to_prometheus())
+
+Series are keyed by normalised endpoint (`/v1/customers/{id}`), method, status class (`2xx`, `4xx`, ...) and error type
+(`CardError`, `RateLimitError`, ...). Snapshots of several registries, e.g. one per worker process, can be merged with
+`Snapshot.merge`. While no registry is enabled the bindings measure nothing.
+"""
+import bisect
+import threading
+
+from aiostripe import instrumentation
+
+# Upper bounds of the latency buckets in seconds: 0.5ms to about 65s, growing by a factor of sqrt(2)
+BUCKETS = tuple(round(0.0005 * 2 ** (i / 2), 6) for i in range(35))
+
+REQUESTS = 'aiostripe_requests_total'
+DURATION = 'aiostripe_request_duration_seconds'
+PHASE_DURATION = 'aiostripe_request_phase_duration_seconds'
+RECEIVED_BYTES = 'aiostripe_response_received_bytes_total'
+DECODED_BYTES = 'aiostripe_response_decoded_bytes_total'
+
+HELP = {
+    REQUESTS: ('counter', 'Stripe API requests made.'),
+    DURATION: ('histogram', 'Duration of Stripe API requests, including conversion of the response.'),
+    PHASE_DURATION: ('histogram', 'Duration of the phases of Stripe API requests.'),
+    RECEIVED_BYTES: ('counter', 'Size of Stripe API response bodies as received.'),
+    DECODED_BYTES: ('counter', 'Size of Stripe API response bodies after decompression.'),
+}
+
+LABELS = ('endpoint', 'method', 'status', 'error')
+PHASE_LABELS = ('endpoint', 'method', 'phase')
+
+
+def status_class(status):
+    if status is None:
+        return 'none'
+
+    return '%dxx' % (status // 100)
+
+
+class Histogram(object):
+    def __init__(self, counts=None, sum=0.0):
+        self.counts = counts or [0] * (len(BUCKETS) + 1)
+        self.sum = sum
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+
+    def copy(self):
+        return Histogram(list(self.counts), self.sum)
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.sum += other.sum
+
+    def quantile(self, q):
+        """Upper bound of the bucket the q-quantile falls in; None when nothing was observed."""
+
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS + (float('inf'),), self.counts):
+            seen += n
+            if n and seen >= rank:
+                return bound
+
+
+class Snapshot(object):
+    """Point-in-time copy of a registry: `counters` maps (name, labels) to a number and `histograms` maps
+    (name, labels) to a `Histogram`, where labels is a tuple of (label, value) pairs."""
+
+    def __init__(self, counters=None, histograms=None):
+        self.counters = counters or {}
+        self.histograms = histograms or {}
+
+    def merge(self, *others):
+        """A new snapshot with the values of this one and `others` added up."""
+
+        merged = Snapshot(dict(self.counters), dict((k, h.copy()) for k, h in self.histograms.items()))
+
+        for other in others:
+            for key, value in other.counters.items():
+                merged.counters[key] = merged.counters.get(key, 0) + value
+
+            for key, histogram in other.histograms.items():
+                if key in merged.histograms:
+                    merged.histograms[key].merge(histogram)
+                else:
+                    merged.histograms[key] = histogram.copy()
+
+        return merged
+
+    def to_dict(self):
+        return {
+            'counters': [[name, list(map(list, labels)), value]
+                         for (name, labels), value in sorted(self.counters.items())],
+            'histograms': [[name, list(map(list, labels)), h.counts, h.sum]
+                           for (name, labels), h in sorted(self.histograms.items())],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        counters = dict(((name, tuple(map(tuple, labels))), value) for name, labels, value in data['counters'])
+        histograms = dict(((name, tuple(map(tuple, labels))), Histogram(list(counts), total))
+                          for name, labels, counts, total in data['histograms'])
+
+        return cls(counters, histograms)
+
+    def to_prometheus(self):
+        """The snapshot in the Prometheus text exposition format."""
+
+        lines = []
+        described = set()
+
+        def describe(name):
+            if name not in described:
+                described.add(name)
+                kind, text = HELP.get(name, ('untyped', name))
+                lines.append('# HELP %s %s' % (name, text))
+                lines.append('# TYPE %s %s' % (name, kind))
+
+        for (name, labels), value in sorted(self.counters.items()):
+            describe(name)
+            lines.append('%s%s %s' % (name, _format_labels(labels), _format_value(value)))
+
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            describe(name)
+
+            cumulative = 0
+            for bound, n in zip(BUCKETS, histogram.counts):
+                cumulative += n
+                lines.append('%s_bucket%s %d' % (name, _format_labels(labels + (('le', repr(bound)),)), cumulative))
+
+            lines.append('%s_bucket%s %d' % (name, _format_labels(labels + (('le', '+Inf'),)), histogram.count))
+            lines.append('%s_sum%s %s' % (name, _format_labels(labels), _format_value(histogram.sum)))
+            lines.append('%s_count%s %d' % (name, _format_labels(labels), histogram.count))
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{%s}' % ','.join('%s="%s"' % (k, _escape(v)) for k, v in labels)
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+
+    return str(value)
+
+
+class MetricsRegistry(object):
+    def __init__(self, phases=True):
+        self.phases = phases
+
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram()
+
+        histogram.observe(value)
+
+    def increment(self, name, labels, value=1):
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def record(self, timing):
+        """`instrumentation` callback."""
+
+        labels = tuple(zip(LABELS, (timing.path_template, timing.method, status_class(timing.status),
+                                    timing.error or '')))
+
+        with self._lock:
+            self.increment(REQUESTS, labels)
+            self.observe(DURATION, labels, timing.duration)
+
+            if timing.bytes_received is not None:
+                endpoint = labels[:2]
+                self.increment(RECEIVED_BYTES, endpoint, timing.bytes_received)
+                self.increment(DECODED_BYTES, endpoint, timing.bytes_decoded)
+
+            if self.phases:
+                for phase, seconds in timing.phases.items():
+                    self.observe(PHASE_DURATION, tuple(zip(PHASE_LABELS, (timing.path_template, timing.method,
+                                                                          phase))), seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return Snapshot(dict(self._counters), dict((k, h.copy()) for k, h in self._histograms.items()))
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+registry = None
+
+
+def enable(phases=True):
+    """Starts collecting metrics into the module's `registry`, creating it on first use, and returns it."""
+
+    global registry
+
+    if registry is None:
+        registry = MetricsRegistry(phases=phases)
+    else:
+        registry.phases = phases
+
+    if registry.record not in instrumentation.callbacks:
+        instrumentation.add_callback(registry.record)
+
+    return registry
+
+
+def disable():
+    """Stops collecting metrics; the values collected so far stay in `registry`."""
+
+    if registry is not None and registry.record in instrumentation.callbacks:
+        instrumentation.remove_callback(registry.record)
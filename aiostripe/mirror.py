@@ -0,0 +1,619 @@
+"""Local mirror of Stripe objects, kept up to date from the event stream.
+
+    store = aiostripe.mirror.SqliteStore('mirror.sqlite3')
+    engine = aiostripe.mirror.SyncEngine(store, objects=('customer', 'subscription', 'invoice'))
+    await engine.start()
+
+The first run records the newest event and then lists every object of the mirrored types, one type at a time per task
+and all types in parallel. From then on the engine asks for the events after the last one it applied every `interval`
+seconds, and stores the object each of them carries, or drops it for deletions. Progress is checkpointed in the store
+along with the objects, so a restarted engine resumes a backfill from the last page it saved and the event stream from
+the last event it applied. Stripe keeps events for 30 days, so a mirror left alone for longer has to be built anew.
+
+Objects that cannot be listed on their own are read from the lists embedded in their parent (`EMBEDDED_LISTS`), e.g.
+subscriptions from customers.
+
+A store is anything with the coroutine methods of `MemoryStore`; the objects are kept as plain dicts, as the API
+returned them. `SqliteStore` runs its queries in a thread of its own, so the engine never waits for the disk on the
+event loop.
+
+Stores can index fields of the objects, so they can be looked up by more than their id:
+
+    await store.add_index('customer', 'email')
+    await store.add_index('charge', 'metadata.order_id')
+    await store.add_index('subscription', 'status')
+    await store.add_index('subscription', 'current_period_end', sorted=True)
+
+    await engine.query('subscription', {'plan.id': 'gold', 'status': 'active'})
+    await engine.query('subscription', {'current_period_end': Range(high=time.time() + 86400)},
+                       order_by='current_period_end')
+
+Fields are given as paths into the object; expanded objects are indexed by their id, so `customer` matches charges
+whether or not their customer was expanded. Hash indexes answer equality conditions, sorted indexes also `Range`s.
+Conditions on fields without an index are checked against the objects the indexed ones leave, or against all objects
+of the type if none of them is indexed. The indexes are updated along with every object stored or deleted.
+"""
+import asyncio
+import bisect
+import concurrent.futures
+import functools
+import json
+import sqlite3
+
+from aiostripe import error, resource, util
+from aiostripe.logger import logger
+
+# object: (parent object, field of the parent holding the list of them)
+EMBEDDED_LISTS = {
+    'subscription': ('customer', 'subscriptions'),
+}
+
+# objects whose `.deleted` events mean they ended rather than disappeared, e.g. canceled subscriptions
+KEPT_ON_DELETE = {'subscription'}
+
+CURSOR = 'events.cursor'
+
+
+def _backfill_checkpoint(object):
+    return 'backfill.%s' % object
+
+
+class Range(object):
+    """Condition of a query on a field with a sorted index: `low` <= value < `high`, either end left open if None."""
+
+    def __init__(self, low=None, high=None):
+        self.low = low
+        self.high = high
+
+    def __contains__(self, value):
+        if value is None:
+            return False
+
+        key = _sort_key(value)
+
+        return (self.low is None or key >= _sort_key(self.low)) and (self.high is None or key < _sort_key(self.high))
+
+    def __repr__(self):
+        return 'Range(%r, %r)' % (self.low, self.high)
+
+
+def _field(values, field):
+    """`util.field` of `values` if it can be indexed; None for lists and objects without id."""
+
+    value = util.field(values, field)
+
+    return value if isinstance(value, (str, int, float)) else None
+
+
+def _sort_key(value):
+    # numbers before strings, as SQLite orders them
+    if isinstance(value, (int, float)):
+        return 0, value
+
+    return 1, value
+
+
+def _matches(values, where):
+    for field, condition in where.items():
+        value = _field(values, field)
+
+        if isinstance(condition, Range):
+            if value not in condition:
+                return False
+        elif value != condition:
+            return False
+
+    return True
+
+
+def _select(candidates, where, order_by, descending, limit):
+    found = [values for values in candidates if _matches(values, where)]
+
+    if order_by is not None:
+        # objects without the field last
+        present = [values for values in found if _field(values, order_by) is not None]
+        present.sort(key=lambda values: (_sort_key(_field(values, order_by)), values['id']), reverse=descending)
+        found = present + [values for values in found if _field(values, order_by) is None]
+
+    return found[:limit] if limit is not None else found
+
+
+class HashIndex(object):
+    sorted = False
+
+    def __init__(self):
+        # value: set of ids
+        self._ids = {}
+
+    def add(self, id, value):
+        self._ids.setdefault(value, set()).add(id)
+
+    def remove(self, id, value):
+        ids = self._ids.get(value)
+
+        if ids is not None:
+            ids.discard(id)
+            if not ids:
+                del self._ids[value]
+
+    def find(self, condition):
+        if isinstance(condition, Range):
+            raise ValueError('Ranges need a sorted index')
+
+        return set(self._ids.get(condition, ()))
+
+
+class SortedIndex(object):
+    sorted = True
+
+    def __init__(self):
+        # sorted (sort key, id)
+        self._keys = []
+
+    def add(self, id, value):
+        bisect.insort(self._keys, (_sort_key(value), id))
+
+    def remove(self, id, value):
+        key = (_sort_key(value), id)
+        i = bisect.bisect_left(self._keys, key)
+
+        if i < len(self._keys) and self._keys[i] == key:
+            del self._keys[i]
+
+    def find(self, condition):
+        if not isinstance(condition, Range):
+            key = _sort_key(condition)
+            i = bisect.bisect_left(self._keys, (key,))
+
+            ids = set()
+            while i < len(self._keys) and self._keys[i][0] == key:
+                ids.add(self._keys[i][1])
+                i += 1
+
+            return ids
+
+        start = bisect.bisect_left(self._keys, (_sort_key(condition.low),)) if condition.low is not None else 0
+        end = bisect.bisect_left(self._keys, (_sort_key(condition.high),)) if condition.high is not None else None
+
+        return set(id for key, id in self._keys[start:end])
+
+
+def _in_thread(method):
+    """Turns a method of `SqliteStore` into a coroutine function running it in the thread of the store."""
+
+    @functools.wraps(method)
+    async def inner(self, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+
+        return await loop.run_in_executor(self._executor, functools.partial(method, self, *args, **kwargs))
+
+    return inner
+
+
+class MemoryStore(object):
+    def __init__(self):
+        # object: {id: values}
+        self._objects = {}
+        # object: {field: index}
+        self._indexes = {}
+        self._checkpoints = {}
+
+    async def add_index(self, object, field, sorted=False):
+        """Indexes `field` of the objects of type `object`, a sorted index also answering range conditions."""
+
+        indexes = self._indexes.setdefault(object, {})
+
+        if field in indexes and indexes[field].sorted == sorted:
+            return
+
+        index = indexes[field] = SortedIndex() if sorted else HashIndex()
+
+        for values in self._objects.get(object, {}).values():
+            value = _field(values, field)
+            if value is not None:
+                index.add(values['id'], value)
+
+    def _unindex(self, values):
+        for field, index in self._indexes.get(values['object'], {}).items():
+            value = _field(values, field)
+            if value is not None:
+                index.remove(values['id'], value)
+
+    async def get(self, object, id):
+        return self._objects.get(object, {}).get(id)
+
+    async def put(self, values):
+        objects = self._objects.setdefault(values['object'], {})
+
+        previous = objects.get(values['id'])
+        if previous is not None:
+            self._unindex(previous)
+
+        objects[values['id']] = values
+
+        for field, index in self._indexes.get(values['object'], {}).items():
+            value = _field(values, field)
+            if value is not None:
+                index.add(values['id'], value)
+
+    async def delete(self, object, id):
+        previous = self._objects.get(object, {}).pop(id, None)
+
+        if previous is not None:
+            self._unindex(previous)
+
+    async def find(self, object, where=None, order_by=None, descending=False, limit=None):
+        """The objects of type `object` whose fields match `where`, a dict of field: value or `Range`."""
+
+        objects = self._objects.get(object, {})
+        indexes = self._indexes.get(object, {})
+
+        ids = None
+        rest = {}
+        for field, condition in (where or {}).items():
+            if field not in indexes or condition is None:
+                rest[field] = condition
+                continue
+
+            found = indexes[field].find(condition)
+            ids = found if ids is None else ids & found
+
+        candidates = objects.values() if ids is None else [objects[id] for id in ids]
+
+        return _select(candidates, rest, order_by, descending, limit)
+
+    async def objects(self, object):
+        return list(self._objects.get(object, {}).values())
+
+    async def count(self, object):
+        return len(self._objects.get(object, {}))
+
+    async def get_checkpoint(self, name):
+        return self._checkpoints.get(name)
+
+    async def set_checkpoint(self, name, value):
+        self._checkpoints[name] = value
+
+    async def commit(self):
+        """Makes the changes since the last commit durable, all of them or none."""
+
+    async def close(self):
+        pass
+
+
+class SqliteStore(object):
+    """Store in a sqlite database. The queries run in a thread of the store, one at a time and in the order they were
+    made, so a backfill does not hold up the event loop while the disk is busy."""
+
+    def __init__(self, path):
+        self.path = path
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        # object: {field: sorted}
+        self._indexes = {}
+        self._db = self._executor.submit(self._connect).result()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute('CREATE TABLE IF NOT EXISTS objects (object TEXT NOT NULL, id TEXT NOT NULL, '
+                   'body TEXT NOT NULL, PRIMARY KEY (object, id)) WITHOUT ROWID')
+        db.execute('CREATE TABLE IF NOT EXISTS checkpoints (name TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        db.execute('CREATE TABLE IF NOT EXISTS indexes (object TEXT NOT NULL, field TEXT NOT NULL, '
+                   'sorted INTEGER NOT NULL, PRIMARY KEY (object, field))')
+        # one B-tree serves both kinds of indexes; `sorted` only decides which conditions they answer
+        db.execute('CREATE TABLE IF NOT EXISTS index_entries (object TEXT NOT NULL, field TEXT NOT NULL, '
+                   'value NOT NULL, id TEXT NOT NULL, PRIMARY KEY (object, field, value, id)) WITHOUT ROWID')
+        db.execute('CREATE INDEX IF NOT EXISTS index_entries_by_id ON index_entries (object, id)')
+        db.commit()
+
+        for object, field, sorted in db.execute('SELECT object, field, sorted FROM indexes'):
+            self._indexes.setdefault(object, {})[field] = bool(sorted)
+
+        return db
+
+    @_in_thread
+    def add_index(self, object, field, sorted=False):
+        """Indexes `field` of the objects of type `object`, a sorted index also answering range conditions."""
+
+        indexes = self._indexes.setdefault(object, {})
+
+        if indexes.get(field) == sorted:
+            return
+
+        self._db.execute('INSERT OR REPLACE INTO indexes (object, field, sorted) VALUES (?, ?, ?)',
+                         (object, field, int(sorted)))
+
+        if field not in indexes:
+            self._db.executemany('INSERT OR IGNORE INTO index_entries (object, field, value, id) VALUES (?, ?, ?, ?)',
+                                 self._entries(list(self._rows(object)), [field]))
+
+        indexes[field] = sorted
+        self._db.commit()
+
+    def _entries(self, objects, fields):
+        for values in objects:
+            for field in fields:
+                value = _field(values, field)
+                if value is not None:
+                    yield values['object'], field, value, values['id']
+
+    @_in_thread
+    def get(self, object, id):
+        row = self._db.execute('SELECT body FROM objects WHERE object = ? AND id = ?', (object, id)).fetchone()
+
+        return json.loads(row[0]) if row is not None else None
+
+    @_in_thread
+    def put(self, values):
+        self._db.execute('INSERT OR REPLACE INTO objects (object, id, body) VALUES (?, ?, ?)',
+                         (values['object'], values['id'], json.dumps(values, separators=(',', ':'))))
+
+        fields = self._indexes.get(values['object'])
+        if fields:
+            self._db.execute('DELETE FROM index_entries WHERE object = ? AND id = ?', (values['object'], values['id']))
+            self._db.executemany('INSERT INTO index_entries (object, field, value, id) VALUES (?, ?, ?, ?)',
+                                 self._entries([values], fields))
+
+    @_in_thread
+    def delete(self, object, id):
+        self._db.execute('DELETE FROM objects WHERE object = ? AND id = ?', (object, id))
+
+        if self._indexes.get(object):
+            self._db.execute('DELETE FROM index_entries WHERE object = ? AND id = ?', (object, id))
+
+    @_in_thread
+    def find(self, object, where=None, order_by=None, descending=False, limit=None):
+        """The objects of type `object` whose fields match `where`, a dict of field: value or `Range`."""
+
+        indexes = self._indexes.get(object, {})
+
+        queries = []
+        args = [object]
+        rest = {}
+        for field, condition in (where or {}).items():
+            if field not in indexes or condition is None:
+                rest[field] = condition
+                continue
+
+            query = 'SELECT id FROM index_entries WHERE object = ? AND field = ?'
+            args.extend((object, field))
+
+            if not isinstance(condition, Range):
+                query += ' AND value = ?'
+                args.append(condition)
+            elif not indexes[field]:
+                raise ValueError('Ranges need a sorted index')
+            else:
+                if condition.low is not None:
+                    query += ' AND value >= ?'
+                    args.append(condition.low)
+                if condition.high is not None:
+                    query += ' AND value < ?'
+                    args.append(condition.high)
+
+            queries.append(query)
+
+        query = 'SELECT body FROM objects WHERE object = ?'
+        if queries:
+            query += ' AND id IN (%s)' % ' INTERSECT '.join(queries)
+
+        candidates = (json.loads(row[0]) for row in self._db.execute(query, args))
+
+        return _select(candidates, rest, order_by, descending, limit)
+
+    @_in_thread
+    def objects(self, object):
+        return list(self._rows(object))
+
+    def _rows(self, object):
+        for row in self._db.execute('SELECT body FROM objects WHERE object = ?', (object,)):
+            yield json.loads(row[0])
+
+    @_in_thread
+    def count(self, object):
+        return self._db.execute('SELECT COUNT(*) FROM objects WHERE object = ?', (object,)).fetchone()[0]
+
+    @_in_thread
+    def get_checkpoint(self, name):
+        row = self._db.execute('SELECT value FROM checkpoints WHERE name = ?', (name,)).fetchone()
+
+        return row[0] if row is not None else None
+
+    @_in_thread
+    def set_checkpoint(self, name, value):
+        self._db.execute('INSERT OR REPLACE INTO checkpoints (name, value) VALUES (?, ?)', (name, value))
+
+    @_in_thread
+    def commit(self):
+        self._db.commit()
+
+    async def close(self):
+        """Closes the database once the queries made before are done."""
+
+        await self._close()
+        self._executor.shutdown()
+
+    @_in_thread
+    def _close(self):
+        self._db.close()
+
+
+class SyncEngine(util.BackgroundTask):
+    def __init__(self, store, objects=('customer', 'subscription', 'invoice'), api_key=None, stripe_account=None,
+                 interval=5.0, page_size=100):
+        self.store = store
+        self.objects = frozenset(objects)
+        self.api_key = api_key
+        self.stripe_account = stripe_account
+        self.interval = interval
+        self.page_size = page_size
+
+        self.stats = {'backfilled': 0, 'events': 0, 'stored': 0, 'deleted': 0}
+
+        for object in self.objects:
+            cls = resource.OBJECT_CLASSES.get(EMBEDDED_LISTS.get(object, (object,))[0])
+            if cls is None or not issubclass(cls, resource.ListableAPIResource):
+                raise ValueError('Objects of type %r cannot be listed' % object)
+
+    async def backfilled(self):
+        """Whether every object type has been listed completely."""
+
+        for object in self._listed_objects():
+            if await self.store.get_checkpoint(_backfill_checkpoint(object)) != 'done':
+                return False
+
+        return True
+
+    def _listed_objects(self):
+        """The object types to list, each with the types embedded in it that are mirrored."""
+
+        listed = {}
+        for object in self.objects:
+            if object in EMBEDDED_LISTS:
+                listed.setdefault(EMBEDDED_LISTS[object][0], []).append(object)
+            else:
+                listed.setdefault(object, [])
+
+        return listed
+
+    async def backfill(self):
+        """Lists every object of the mirrored types that has not been listed yet. The event stream is picked up from
+        the newest event at the time of the first backfill, so nothing that changes meanwhile is missed."""
+
+        if await self.store.get_checkpoint(CURSOR) is None:
+            page = await resource.Event.list(api_key=self.api_key, stripe_account=self.stripe_account, limit=1)
+            await self.store.set_checkpoint(CURSOR, page.data[0].id if page.data else '')
+            await self.store.commit()
+
+        await asyncio.gather(*[self._backfill(object, embedded) for object, embedded in self._listed_objects().items()])
+
+    async def _backfill(self, object, embedded):
+        checkpoint = _backfill_checkpoint(object)
+        last_id = await self.store.get_checkpoint(checkpoint)
+
+        if last_id == 'done':
+            return
+
+        params = {'limit': self.page_size}
+        if last_id:
+            params['starting_after'] = last_id
+
+        cls = resource.OBJECT_CLASSES[object]
+        stored = 0
+
+        async for obj in cls.auto_paging_iter(api_key=self.api_key, stripe_account=self.stripe_account, stream=True,
+                                              **params):
+            if object in self.objects:
+                await self._store(obj)
+
+            for child in embedded:
+                async for item in obj[EMBEDDED_LISTS[child][1]].auto_paging_iter():
+                    await self._store(item)
+
+            self.stats['backfilled'] += 1
+            stored += 1
+
+            if stored % self.page_size == 0:
+                await self.store.set_checkpoint(checkpoint, obj.id)
+                await self.store.commit()
+
+        await self.store.set_checkpoint(checkpoint, 'done')
+        await self.store.commit()
+
+        logger.info('Backfilled %d %s objects of the mirror', stored, object)
+
+    async def _store(self, obj):
+        await self.store.put(util.plain(obj))
+        self.stats['stored'] += 1
+
+    async def get(self, object, id):
+        """The mirrored object of type `object` with the given id as a Stripe object, or None."""
+
+        values = await self.store.get(object, id)
+
+        return self._convert(values) if values is not None else None
+
+    async def query(self, object, where=None, order_by=None, descending=False, limit=None):
+        """The mirrored objects of type `object` matching `where` as Stripe objects, see `MemoryStore.find`."""
+
+        found = await self.store.find(object, where, order_by, descending, limit)
+
+        return [self._convert(values) for values in found]
+
+    def _convert(self, values):
+        return resource.convert_to_stripe_object(values, self.api_key, self.stripe_account)
+
+    async def apply(self, event):
+        """Applies one event to the store; also usable with the events a webhook handler receives."""
+
+        self.stats['events'] += 1
+
+        obj = event.get('data', {}).get('object')
+        if not isinstance(obj, dict) or obj.get('object') not in self.objects or not obj.get('id'):
+            return
+
+        deleted = event.get('type', '').endswith('.deleted') or obj.get('deleted')
+
+        if deleted and obj['object'] not in KEPT_ON_DELETE:
+            await self.store.delete(obj['object'], obj['id'])
+            self.stats['deleted'] += 1
+        else:
+            await self._store(obj)
+
+    async def sync_events(self):
+        """Applies the events created since the last one applied, oldest first, checkpointing after each page."""
+
+        cursor = await self.store.get_checkpoint(CURSOR)
+        if cursor is None:
+            raise error.StripeError('The mirror has not been backfilled yet')
+
+        if not cursor:
+            # no event existed when the mirror was built: every event there is now is new
+            events = []
+            async for event in resource.Event.auto_paging_iter(api_key=self.api_key,
+                                                               stripe_account=self.stripe_account,
+                                                               limit=self.page_size):
+                events.append(event)
+
+            for event in reversed(events):
+                await self.apply(event)
+
+            if events:
+                await self.store.set_checkpoint(CURSOR, events[0].id)
+                await self.store.commit()
+
+            return
+
+        while True:
+            page = await resource.Event.list(api_key=self.api_key, stripe_account=self.stripe_account,
+                                             limit=self.page_size, ending_before=cursor)
+            if not page.data:
+                return
+
+            for event in reversed(page.data):
+                await self.apply(event)
+
+            cursor = page.data[0].id
+            await self.store.set_checkpoint(CURSOR, cursor)
+            await self.store.commit()
+
+            if not page.has_more:
+                return
+
+    async def run(self):
+        """Backfills the mirror if needed, then keeps applying new events."""
+
+        await self.backfill()
+
+        while True:
+            try:
+                await self.sync_events()
+            except error.StripeError as e:
+                logger.warning('Syncing the mirror from events failed: %r', e)
+
+            await asyncio.sleep(self.interval)
+
+    async def _run(self):
+        await self.run()
@@ -1,47 +1,92 @@
+import asyncio
 import io
+import mmap
+import os
 import random
+import stat
+
+# page-aligned, so file reads line up with the page cache
+DEFAULT_CHUNK_SIZE = 16 * mmap.PAGESIZE
+
+
+def _encode(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return value
+
+    return str(value).encode('utf-8')
 
 
 class MultipartDataGenerator(object):
-    def __init__(self, chunk_size=1028):
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, mmap_files=True):
         self.data = io.BytesIO()
         self.line_break = '\r\n'
         self.boundary = self._initialize_boundary()
         self.chunk_size = chunk_size
+        self.mmap_files = mmap_files
+        self.parts = []
 
     def add_params(self, params):
         for key, value in params.items():
             if value is None:
                 continue
 
-            self._write(self.param_header())
-            self._write(self.line_break)
+            header = [self.param_header(), self.line_break]
             if hasattr(value, 'read'):
-                self._write('Content-Disposition: form-data; name="%s"; filename="%s"' % (key, value.name))
-                self._write(self.line_break)
-                self._write('Content-Type: application/octet-stream')
-                self._write(self.line_break)
-                self._write(self.line_break)
-
-                self._write_file(value)
+                header.append('Content-Disposition: form-data; name="%s"; filename="%s"' % (key, value.name))
+                header.append(self.line_break)
+                header.append('Content-Type: application/octet-stream')
             else:
-                self._write('Content-Disposition: form-data; name="%s"' % key)
-                self._write(self.line_break)
-                self._write(self.line_break)
-                self._write(value)
+                header.append('Content-Disposition: form-data; name="%s"' % key)
 
-            self._write(self.line_break)
+            header.append(self.line_break)
+            header.append(self.line_break)
+
+            self.parts.append((''.join(header), value))
 
     def param_header(self):
         return '--%s' % self.boundary
 
     def get_post_data(self):
+        for header, value in self.parts:
+            self._write(header)
+
+            if hasattr(value, 'read'):
+                self._write_file(value)
+            else:
+                self._write(value)
+
+            self._write(self.line_break)
+
         self._write('--%s--' % self.boundary)
         self._write(self.line_break)
         return self.data.getvalue()
 
+    def stream(self, loop=None, executor=None):
+        return MultipartStream(self, loop=loop, executor=executor)
+
+    def iter_chunks(self):
+        """Yields the body as encoded bytes, with file parts yielded as the file objects themselves."""
+
+        pending = []
+        for header, value in self.parts:
+            pending.append(_encode(header))
+
+            if hasattr(value, 'read'):
+                yield b''.join(pending)
+                yield value
+
+                pending = []
+            else:
+                pending.append(_encode(value))
+
+            pending.append(_encode(self.line_break))
+
+        pending.append(_encode('--%s--' % self.boundary))
+        pending.append(_encode(self.line_break))
+        yield b''.join(pending)
+
     def _write(self, value):
-        self.data.write(bytes(value, 'utf-8'))
+        self.data.write(_encode(value))
 
     def _write_file(self, f):
         while True:
@@ -53,3 +98,93 @@ class MultipartDataGenerator(object):
     @staticmethod
     def _initialize_boundary():
         return random.randint(0, 2 ** 63)
+
+
+def _map_file(f):
+    """Returns a read-only mapping of `f` from its current position, or None if it is not a regular file on disk."""
+
+    try:
+        fd = f.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+    if 'b' not in getattr(f, 'mode', 'b'):
+        return None
+
+    st = os.fstat(fd)
+    if not stat.S_ISREG(st.st_mode):
+        return None
+
+    offset = f.tell()
+    if offset >= st.st_size:
+        return memoryview(b'')
+
+    # the mapping stays alive for as long as any slice handed to the transport does
+    return memoryview(mmap.mmap(fd, 0, access=mmap.ACCESS_READ))[offset:]
+
+
+class MultipartStream(object):
+    """Async iterator over a multipart body, holding at most one chunk of file data at a time.
+
+    Regular files are memory-mapped and sent as `memoryview` slices without copying; `size` is then the exact body
+    length. Other files are read in `executor` (the loop's default one if None) and `size` is None."""
+
+    def __init__(self, generator, loop=None, executor=None):
+        self.boundary = generator.boundary
+        self.chunk_size = generator.chunk_size
+
+        self._chunks = []
+        self.size = 0
+        for chunk in generator.iter_chunks():
+            if hasattr(chunk, 'read'):
+                view = _map_file(chunk) if generator.mmap_files else None
+
+                if view is not None:
+                    chunk = view
+                else:
+                    self.size = None
+            elif not chunk:
+                continue
+
+            if self.size is not None:
+                self.size += len(chunk)
+
+            self._chunks.append(chunk)
+
+        self._chunks.reverse()
+        self._file = None
+        self._view = None
+        self._loop = loop
+        self._executor = executor
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            if self._view is not None:
+                chunk = self._view[:self.chunk_size]
+                self._view = self._view[self.chunk_size:] or None
+
+                return chunk
+
+            if self._file is not None:
+                loop = self._loop or asyncio.get_event_loop()
+                chunk = await loop.run_in_executor(self._executor, self._file.read, self.chunk_size)
+
+                if chunk:
+                    return _encode(chunk)
+
+                self._file = None
+
+            if not self._chunks:
+                raise StopAsyncIteration
+
+            chunk = self._chunks.pop()
+
+            if hasattr(chunk, 'read'):
+                self._file = chunk
+            elif isinstance(chunk, memoryview):
+                self._view = chunk or None
+            else:
+                return chunk
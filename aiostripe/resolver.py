@@ -0,0 +1,100 @@
+import asyncio
+import collections
+import socket
+
+from aiohttp.abc import AbstractResolver
+from aiohttp.resolver import DefaultResolver
+
+from aiostripe.logger import logger
+
+
+class CachingResolver(AbstractResolver):
+    """Caches host name resolutions for `ttl` seconds, in front of aiohttp's default resolver.
+
+    A lookup for an entry older than `refresh_ahead` * `ttl` is answered from the cache while the entry is refreshed
+    in the background, so busy hosts never expire. If resolving an expired entry fails or takes longer than `timeout`
+    seconds, the last known good addresses are used instead. At most `max_hosts` entries are kept."""
+
+    def __init__(self, ttl=60.0, refresh_ahead=0.8, timeout=2.0, max_hosts=64, resolver=None):
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.timeout = timeout
+        self.max_hosts = max_hosts
+
+        self._resolver = resolver or DefaultResolver()
+        self._cache = collections.OrderedDict()
+        self._lookups = {}
+
+        self.stats = {'hits': 0, 'misses': 0, 'refreshes': 0, 'stale': 0, 'failures': 0}
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        key = (host, port, family)
+        entry = self._cache.get(key)
+
+        if entry is not None:
+            addresses, resolved_at = entry
+            age = asyncio.get_event_loop().time() - resolved_at
+
+            if age < self.ttl:
+                self.stats['hits'] += 1
+                self._cache.move_to_end(key)
+
+                if age >= self.ttl * self.refresh_ahead and key not in self._lookups:
+                    self.stats['refreshes'] += 1
+                    self._lookup(key)
+
+                return addresses
+
+        self.stats['misses'] += 1
+        lookup = self._lookup(key)
+
+        if entry is None:
+            return await asyncio.shield(lookup)
+
+        try:
+            # the lookup goes on in the background when it times out, and updates the cache once it is done
+            return await asyncio.wait_for(asyncio.shield(lookup), self.timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning('Resolving %s failed (%r), using the last known addresses', host, e)
+            self.stats['stale'] += 1
+
+            return entry[0]
+
+    def _lookup(self, key):
+        """The running lookup of `key`, or a new one; concurrent resolutions of a host share one lookup."""
+
+        lookup = self._lookups.get(key)
+        if lookup is None:
+            lookup = self._lookups[key] = asyncio.ensure_future(self._resolve(key))
+            lookup.add_done_callback(lambda f: self._lookup_done(key, f))
+
+        return lookup
+
+    def _lookup_done(self, key, lookup):
+        self._lookups.pop(key, None)
+
+        # refreshes nobody waits for must not leave "exception was never retrieved" behind
+        if not lookup.cancelled() and lookup.exception() is not None:
+            self.stats['failures'] += 1
+
+    async def _resolve(self, key):
+        host, port, family = key
+        addresses = await self._resolver.resolve(host, port, family=family)
+
+        self._cache[key] = (addresses, asyncio.get_event_loop().time())
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_hosts:
+            self._cache.popitem(last=False)
+
+        return addresses
+
+    def clear(self):
+        self._cache.clear()
+
+    async def close(self):
+        for lookup in list(self._lookups.values()):
+            lookup.cancel()
+
+        await self._resolver.close()
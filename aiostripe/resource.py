@@ -1,40 +1,21 @@
 import json
 from urllib.parse import quote_plus
 
-from aiostripe import api_requestor, error, upload_api_base
+import aiostripe
+from aiostripe import api_requestor, cache, error, identity, instrumentation
 from aiostripe.logger import logger
 from coroutils.generator import async_generator
 
 
 def convert_to_stripe_object(resp, api_key, account):
-    types = {
-        'account': Account,
-        'application_fee': ApplicationFee,
-        'bank_account': BankAccount,
-        'bitcoin_receiver': BitcoinReceiver,
-        'bitcoin_transaction': BitcoinTransaction,
-        'card': Card,
-        'charge': Charge,
-        'coupon': Coupon,
-        'customer': Customer,
-        'dispute': Dispute,
-        'event': Event,
-        'fee_refund': ApplicationFeeRefund,
-        'file_upload': FileUpload,
-        'invoice': Invoice,
-        'invoiceitem': InvoiceItem,
-        'list': ListObject,
-        'plan': Plan,
-        'recipient': Recipient,
-        'refund': Refund,
-        'subscription': Subscription,
-        'token': Token,
-        'transfer': Transfer,
-        'transfer_reversal': Reversal,
-        'product': Product,
-        'sku': SKU,
-        'order': Order
-    }
+    if instrumentation.callbacks:
+        timing = instrumentation.take_pending()
+        if timing is not None:
+            with timing.phase('convert'):
+                obj = convert_to_stripe_object(resp, api_key, account)
+            timing.finish()
+
+            return obj
 
     if isinstance(resp, list):
         return [convert_to_stripe_object(i, api_key, account) for i in resp]
@@ -44,15 +25,58 @@ def convert_to_stripe_object(resp, api_key, account):
         klass_name = resp.get('object')
 
         if isinstance(klass_name, str):
-            klass = types.get(klass_name, StripeObject)
+            klass = OBJECT_CLASSES.get(klass_name, StripeObject)
         else:
             klass = StripeObject
 
-        return klass.construct_from(resp, api_key, stripe_account=account)
+        identity_map = identity.active()
+        if identity_map is None or not issubclass(klass, APIResource) or not resp.get('id'):
+            return klass.construct_from(resp, api_key, stripe_account=account)
+
+        if not identity.nested():
+            # the items of a page are the caller's own, only the objects they refer to are shared
+            with identity.converting():
+                return klass.construct_from(resp, api_key, stripe_account=account)
+
+        obj = identity_map.get(klass, account, resp['id'])
+        if obj is None:
+            with identity.converting():
+                obj = klass.construct_from(resp, api_key, stripe_account=account)
+            identity_map.add(obj, account)
+
+        return obj
     else:
         return resp
 
 
+@async_generator
+async def _stream_pages(url, api_key, stripe_account, params, identity_map=None):
+    params = dict(params)
+    my_api_key = api_key or aiostripe.api_key
+
+    while True:
+        requestor = api_requestor.APIRequestor(api_key, account=stripe_account)
+        envelope = {}
+        item_id = None
+
+        items = requestor.stream_list(url, params, envelope=envelope)
+
+        try:
+            async for item in items:
+                with identity.using(identity_map):
+                    item = convert_to_stripe_object(item, my_api_key, stripe_account)
+                item_id = item.get('id', None)
+                await async_yield(item)
+        finally:
+            # releases the response when the caller closes the iteration early
+            await items.close()
+
+        if not envelope.get('has_more', False) or item_id is None:
+            return
+
+        params['starting_after'] = item_id
+
+
 def populate_headers(idempotency_key):
     if idempotency_key is not None:
         return {'Idempotency-Key': idempotency_key}
@@ -90,6 +114,9 @@ def _serialize_list(array, previous):
 
 
 class StripeObject(dict):
+    # set on the objects an identity map shares
+    _read_only = False
+
     def __init__(self, id=None, api_key=None, stripe_account=None, **kwargs):
         super().__init__()
 
@@ -105,7 +132,14 @@ class StripeObject(dict):
         if id:
             self['id'] = id
 
+    def _check_writable(self):
+        if self._read_only:
+            raise TypeError('%s %s is shared through an identity map and cannot be changed. Retrieve it to get a copy '
+                            'of your own.' % (type(self).__name__, self.get('id')))
+
     def update(self, update_dict=None, **kwargs):
+        self._check_writable()
+
         if update_dict is not None:
             for k in update_dict:
                 self._unsaved_values.add(k)
@@ -137,6 +171,8 @@ class StripeObject(dict):
             del self[k]
 
     def __setitem__(self, k, v):
+        self._check_writable()
+
         if v == '':
             raise ValueError('You cannot set %s to an empty string. We interpret empty strings as None in requests. '
                              'You may set %s.%s = None to delete the property' % (k, self, k))
@@ -162,6 +198,8 @@ class StripeObject(dict):
                 raise
 
     def __delitem__(self, k):
+        self._check_writable()
+
         super().__delitem__(k)
 
         # Allows for unpickling in Python 3.x
@@ -175,6 +213,8 @@ class StripeObject(dict):
         return instance
 
     def refresh_from(self, values, api_key=None, partial=False, stripe_account=None):
+        self._check_writable()
+
         self.api_key = api_key or getattr(values, 'api_key', None)
         self.stripe_account = stripe_account or getattr(values, 'stripe_account', None)
 
@@ -258,10 +298,26 @@ class APIResource(StripeObject):
         return instance
 
     async def refresh(self):
-        self.refresh_from(await self.request('get', self.instance_url()))
+        if not cache.enabled(type(self)):
+            self.refresh_from(await self.request('get', self.instance_url()))
+        else:
+            values = await cache.fetch(self, lambda: self.request('get', self.instance_url()))
+            self.refresh_from(values, cache.scope(self)[0], stripe_account=self.stripe_account)
 
         return self
 
+    async def request(self, method, url, params=None, headers=None):
+        if method != 'get':
+            # before the write is made, rather than when its response is applied
+            self._check_writable()
+
+        response = await super().request(method, url, params, headers)
+
+        if method != 'get':
+            cache.written(self, response)
+
+        return response
+
     @classmethod
     def class_name(cls):
         if cls is APIResource:
@@ -290,11 +346,30 @@ class APIResource(StripeObject):
 
 
 class ListObject(StripeObject):
+    # shared by the following pages
+    _identity_map = None
+
     async def list(self, **kwargs):
-        return await self.request('get', self['url'], kwargs)
+        if self._identity_map is None:
+            return await self.request('get', self['url'], kwargs)
+
+        requestor = api_requestor.APIRequestor(key=self.api_key, api_base=self.api_base(), account=self.stripe_account)
+        response, api_key = await requestor.request('get', self['url'], kwargs)
+
+        with identity.using(self._identity_map):
+            page = convert_to_stripe_object(response, api_key, self.stripe_account)
+
+        if isinstance(page, ListObject):
+            page._identity_map = self._identity_map
+
+        return page
 
     @async_generator
-    async def auto_paging_iter(self):
+    async def auto_paging_iter(self, stream=False):
+        """Yields the items of this page and of the pages after it. With `stream` set, the items of the following
+        pages are yielded as soon as each of them has been received, see `APIRequestor.stream_list`; a streamed
+        response is only released once the iteration ends, so when leaving it early, `await iterator.close()`."""
+
         page = self
         params = dict(self._retrieve_params)
 
@@ -308,6 +383,15 @@ class ListObject(StripeObject):
                 return
 
             params['starting_after'] = item_id
+
+            if stream:
+                pages = _stream_pages(self['url'], self.api_key, self.stripe_account, params, self._identity_map)
+
+                try:
+                    return await async_yield_from(pages)
+                finally:
+                    await pages.close()
+
             page = await self.list(**params)
 
     async def create(self, idempotency_key=None, **kwargs):
@@ -345,17 +429,56 @@ class SingletonAPIResource(APIResource):
 class ListableAPIResource(APIResource):
     @classmethod
     @async_generator
-    async def auto_paging_iter(cls, *args, **kwargs):
-        return await async_yield_from((await cls.list(*args, **kwargs)).auto_paging_iter())
+    async def auto_paging_iter(cls, *args, stream=False, identity_map=None, **kwargs):
+        """Yields the objects of all pages. With `stream` set, each of them as soon as it has been received; the
+        response is then only released once the iteration ends, so when leaving it early, `await iterator.close()`:
+
+            charges = aiostripe.Charge.auto_paging_iter(stream=True)
+            async for charge in charges:
+                if charge.refunded:
+                    break
+            await charges.close()
+        """
+
+        if identity_map is True:
+            identity_map = identity.IdentityMap()
+
+        if stream:
+            pages = cls._stream_pages(*args, identity_map=identity_map, **kwargs)
+
+            try:
+                return await async_yield_from(pages)
+            finally:
+                await pages.close()
+
+        return await async_yield_from((await cls.list(*args, identity_map=identity_map, **kwargs)).auto_paging_iter())
+
+    @classmethod
+    def _stream_pages(cls, api_key=None, idempotency_key=None, stripe_account=None, identity_map=None, **kwargs):
+        return _stream_pages(cls.class_url(), api_key, stripe_account, kwargs, identity_map)
 
     @classmethod
-    async def list(cls, api_key=None, idempotency_key=None, stripe_account=None, **kwargs):
+    async def list(cls, api_key=None, idempotency_key=None, stripe_account=None, identity_map=None, **kwargs):
+        """With `identity_map`, an `aiostripe.identity.IdentityMap` or True for a new one, the copies of an object
+        in the page and in the pages fetched through it share one read-only instance."""
+
         requestor = api_requestor.APIRequestor(api_key, account=stripe_account)
         url = cls.class_url()
 
         response, api_key = await requestor.request('get', url, kwargs)
 
-        return convert_to_stripe_object(response, api_key, stripe_account)
+        if identity_map is True:
+            identity_map = identity.IdentityMap()
+
+        with identity.using(identity_map):
+            page = convert_to_stripe_object(response, api_key, stripe_account)
+
+        if isinstance(page, ListObject):
+            # the following pages are fetched with the same filters and expansions
+            page._retrieve_params = dict(kwargs)
+            page._identity_map = identity_map
+
+        return page
 
 
 class CreateableAPIResource(APIResource):
@@ -366,8 +489,12 @@ class CreateableAPIResource(APIResource):
         headers = populate_headers(idempotency_key)
 
         response, api_key = await requestor.request('post', url, kwargs, headers)
+        obj = convert_to_stripe_object(response, api_key, stripe_account)
 
-        return convert_to_stripe_object(response, api_key, stripe_account)
+        # objects with ids of their own choosing, such as plans, may have been cached as missing
+        cache.invalidate(obj)
+
+        return obj
 
 
 class UpdateableAPIResource(APIResource):
@@ -513,20 +640,26 @@ class Charge(CreateableAPIResource, ListableAPIResource, UpdateableAPIResource):
         return self
 
     async def update_dispute(self, idempotency_key=None, **kwargs):
+        self._check_writable()
+
         requestor = api_requestor.APIRequestor(self.api_key, account=self.stripe_account)
         url = self.instance_url() + '/dispute'
         headers = populate_headers(idempotency_key)
         response, api_key = await requestor.request('post', url, kwargs, headers)
         self.refresh_from({'dispute': response}, api_key, True)
+        cache.invalidate(self)
 
         return self.dispute
 
     async def close_dispute(self, idempotency_key=None):
+        self._check_writable()
+
         requestor = api_requestor.APIRequestor(self.api_key, account=self.stripe_account)
         url = self.instance_url() + '/dispute/close'
         headers = populate_headers(idempotency_key)
         response, api_key = await requestor.request('post', url, {}, headers)
         self.refresh_from({'dispute': response}, api_key, True)
+        cache.invalidate(self)
 
         return self.dispute
 
@@ -582,12 +715,15 @@ class Customer(CreateableAPIResource, UpdateableAPIResource, ListableAPIResource
         return charges
 
     async def delete_discount(self, **kwargs):
+        self._check_writable()
+
         requestor = api_requestor.APIRequestor(self.api_key, account=self.stripe_account)
         url = self.instance_url() + '/discount'
 
         _, api_key = await requestor.request('delete', url)
 
         self.refresh_from({'discount': None}, api_key, True)
+        cache.invalidate(self)
 
 
 class Invoice(CreateableAPIResource, ListableAPIResource, UpdateableAPIResource):
@@ -626,6 +762,8 @@ class Subscription(UpdateableAPIResource, DeletableAPIResource):
                                   "customer.subscriptions.retrieve('subscription_id') instead.")
 
     async def delete_discount(self, **kwargs):
+        self._check_writable()
+
         requestor = api_requestor.APIRequestor(self.api_key,
                                                account=self.stripe_account)
         url = self.instance_url() + '/discount'
@@ -633,6 +771,7 @@ class Subscription(UpdateableAPIResource, DeletableAPIResource):
         _, api_key = await requestor.request('delete', url)
 
         self.refresh_from({'discount': None}, api_key, True)
+        cache.invalidate(self)
 
 
 class Refund(CreateableAPIResource, ListableAPIResource, UpdateableAPIResource):
@@ -681,7 +820,7 @@ class Recipient(CreateableAPIResource, UpdateableAPIResource, ListableAPIResourc
 class FileUpload(ListableAPIResource):
     @classmethod
     def api_base(cls):
-        return upload_api_base
+        return aiostripe.upload_api_base
 
     @classmethod
     def class_name(cls):
@@ -760,3 +899,35 @@ class Order(CreateableAPIResource, UpdateableAPIResource, ListableAPIResource):
         headers = populate_headers(idempotency_key)
         return await self.request(
             'post', self.instance_url() + '/pay', kwargs, headers)
+
+
+# value of `object` in API responses: resource class
+OBJECT_CLASSES = {
+    'account': Account,
+    'application_fee': ApplicationFee,
+    'balance_transaction': BalanceTransaction,
+    'bank_account': BankAccount,
+    'bitcoin_receiver': BitcoinReceiver,
+    'bitcoin_transaction': BitcoinTransaction,
+    'card': Card,
+    'charge': Charge,
+    'coupon': Coupon,
+    'customer': Customer,
+    'dispute': Dispute,
+    'event': Event,
+    'fee_refund': ApplicationFeeRefund,
+    'file_upload': FileUpload,
+    'invoice': Invoice,
+    'invoiceitem': InvoiceItem,
+    'list': ListObject,
+    'plan': Plan,
+    'recipient': Recipient,
+    'refund': Refund,
+    'subscription': Subscription,
+    'token': Token,
+    'transfer': Transfer,
+    'transfer_reversal': Reversal,
+    'product': Product,
+    'sku': SKU,
+    'order': Order,
+}
@@ -0,0 +1,146 @@
+"""Incremental parsing of list responses.
+
+A list page is one JSON object whose `data` array holds the items. `ListParser` is fed the body as it arrives and
+hands out every item of `data` as soon as its closing brace is in, so the first items can be processed while the rest
+of the page is still being received, and the text of items already handed out is dropped.
+"""
+import codecs
+import json
+from json.decoder import WHITESPACE
+
+_decoder = json.JSONDecoder()
+
+# characters that can follow a complete number or literal
+DELIMITERS = frozenset(' \t\n\r,]}')
+
+# the buffer is only compacted once this much of it has been consumed, to keep the copying linear
+COMPACT_THRESHOLD = 64 * 1024
+
+
+class ListParser(object):
+    def __init__(self):
+        self.envelope = {}
+
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._state = 'start'
+        self._key = None
+        self._done = False
+
+    def feed(self, data):
+        """Adds a chunk of the body, bytes or str, and returns the list of items completed by it."""
+
+        if isinstance(data, bytes):
+            data = self._text.decode(data)
+
+        self._buffer += data
+        items = self._parse(final=False)
+
+        if self._pos >= COMPACT_THRESHOLD:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+
+        return items
+
+    def close(self):
+        """Returns the items completed by the end of the body. `envelope` then holds every field of the list but
+        `data`. Raises ValueError when the body was not a complete JSON object."""
+
+        self._buffer += self._text.decode(b'', final=True)
+        items = self._parse(final=True)
+
+        if not self._done:
+            raise ValueError('Truncated or invalid list response: %r' % self._buffer[self._pos:self._pos + 100])
+
+        return items
+
+    def _skip(self):
+        self._pos = WHITESPACE.match(self._buffer, self._pos).end()
+
+        return self._buffer[self._pos:self._pos + 1]
+
+    def _value(self, final):
+        """Decodes the JSON value at the current position, or returns (None, False) when it is not complete yet."""
+
+        try:
+            value, end = _decoder.raw_decode(self._buffer, self._pos)
+        except ValueError:
+            if final:
+                raise
+
+            return None, False
+
+        # a number or literal is only complete once followed by a delimiter: up to the end of the buffer, or to a
+        # "." or an exponent the decoder stopped at, it may go on in the next chunk
+        if not final and self._buffer[self._pos] not in '{["' and self._buffer[end:end + 1] not in DELIMITERS:
+            return None, False
+
+        self._pos = end
+
+        return value, True
+
+    def _parse(self, final):
+        items = []
+
+        while True:
+            char = self._skip()
+            if not char:
+                return items
+
+            if self._state == 'start':
+                if char != '{':
+                    raise ValueError('Expected a JSON object, got %r' % self._buffer[self._pos:self._pos + 100])
+                self._pos += 1
+                self._state = 'key'
+
+            elif self._state == 'key':
+                if char == '}':
+                    self._pos += 1
+                    self._state = 'end'
+                    self._done = True
+                    continue
+                elif char == ',':
+                    self._pos += 1
+                    continue
+
+                key, complete = self._value(final)
+                if not complete:
+                    return items
+                self._key = key
+                self._state = 'colon'
+
+            elif self._state == 'colon':
+                if char != ':':
+                    raise ValueError('Expected ":" after %r' % self._key)
+                self._pos += 1
+                self._state = 'value'
+
+            elif self._state == 'value':
+                if self._key == 'data' and char == '[':
+                    self._pos += 1
+                    self._state = 'item'
+                    continue
+
+                value, complete = self._value(final)
+                if not complete:
+                    return items
+                self.envelope[self._key] = value
+                self._state = 'key'
+
+            elif self._state == 'item':
+                if char == ']':
+                    self._pos += 1
+                    self._state = 'key'
+                    continue
+                elif char == ',':
+                    self._pos += 1
+                    continue
+
+                item, complete = self._value(final)
+                if not complete:
+                    return items
+                items.append(item)
+
+            else:
+                raise ValueError('Unexpected data after the end of the list: %r' % self._buffer[self._pos:][:100])
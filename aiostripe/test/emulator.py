@@ -0,0 +1,965 @@
+"""In-process emulator of the Stripe API endpoints covered by `aiostripe.resource`.
+
+    async with StripeEmulator(latency=0.005) as emulator:
+        charge = await aiostripe.Charge.create(amount=100, currency='usd', card=DUMMY_CARD)
+
+Entering the context starts an aiohttp server on a free local port and points `aiostripe.api_base` and
+`aiostripe.upload_api_base` at it. State lives in memory, separately per `Stripe-Account`. Requests are answered in the
+shapes the bindings expect: list objects paged with `has_more`/`starting_after`/`ending_before`, `expand[]`, events for
+every write, and error bodies for 400, 401, 402, 404 and 429.
+"""
+import asyncio
+import collections
+import fnmatch
+import json
+import random
+import re
+import string
+import time
+import urllib.parse
+
+from aiohttp import web
+
+import aiostripe
+
+# collection path: (object name, id prefix)
+COLLECTIONS = collections.OrderedDict([
+    ('accounts', ('account', 'acct')),
+    ('application_fees', ('application_fee', 'fee')),
+    ('balance/history', ('balance_transaction', 'txn')),
+    ('bitcoin/receivers', ('bitcoin_receiver', 'btcrcv')),
+    ('charges', ('charge', 'ch')),
+    ('coupons', ('coupon', 'co')),
+    ('customers', ('customer', 'cus')),
+    ('disputes', ('dispute', 'dp')),
+    ('events', ('event', 'evt')),
+    ('files', ('file_upload', 'file')),
+    ('invoiceitems', ('invoiceitem', 'ii')),
+    ('invoices', ('invoice', 'in')),
+    ('orders', ('order', 'or')),
+    ('plans', ('plan', 'plan')),
+    ('products', ('product', 'prod')),
+    ('recipients', ('recipient', 'rp')),
+    ('refunds', ('refund', 're')),
+    ('skus', ('sku', 'sku')),
+    ('tokens', ('token', 'tok')),
+    ('transfers', ('transfer', 'tr')),
+])
+
+# objects only ever created as a side effect of other calls
+READ_ONLY = {'application_fees', 'balance/history', 'events'}
+
+# objects that are not announced through events
+SILENT = {'balance/history', 'events', 'tokens'}
+
+REQUIRED_PARAMS = {
+    'charges': ('amount', 'currency'),
+    'coupons': ('duration',),
+    'invoiceitems': ('customer', 'amount', 'currency'),
+    'invoices': ('customer',),
+    'plans': ('id', 'amount', 'currency', 'interval', 'name'),
+    'products': ('name',),
+    'recipients': ('name', 'type'),
+    'skus': ('product', 'price', 'currency'),
+    'transfers': ('amount', 'currency'),
+}
+
+NUMERIC_PARAMS = {'account_balance', 'amount', 'amount_off', 'application_fee', 'duration_in_months', 'exp_month',
+                  'exp_year', 'gt', 'gte', 'interval_count', 'limit', 'lt', 'lte', 'percent_off', 'price', 'quantity',
+                  'trial_period_days'}
+
+DECLINED_CARDS = {'4000000000000002': 'generic_decline', '4000000000009995': 'insufficient_funds'}
+
+_KEY_RE = re.compile(r'\[([^\]]*)\]')
+
+
+def _random_id(prefix):
+    return '%s_%s' % (prefix, ''.join(random.choice(string.ascii_letters + string.digits) for i in range(14)))
+
+
+def _coerce(name, value):
+    if name in NUMERIC_PARAMS and re.match(r'^-?\d+$', value):
+        return int(value)
+
+    if value == 'true':
+        return True
+    elif value == 'false':
+        return False
+
+    return value
+
+
+def decode_params(pairs):
+    """Decodes Stripe's bracketed form encoding (`a[b]=1`, `a[]=1`, `a[][b]=1`) into nested dicts and lists."""
+
+    result = {}
+
+    for key, value in pairs:
+        bracket = key.find('[')
+        path = [key] if bracket < 0 else [key[:bracket]] + _KEY_RE.findall(key[bracket:])
+
+        if isinstance(value, str) and path[0] != 'metadata':
+            value = _coerce([name for name in path if name][-1], value)
+
+        _insert(result, path, value)
+
+    return result
+
+
+def _has_path(node, path):
+    for name in path:
+        if not isinstance(node, dict) or name not in node:
+            return False
+        node = node[name]
+
+    return True
+
+
+def _insert(node, path, value):
+    name, rest = path[0], path[1:]
+
+    if name == '':
+        if not rest:
+            node.append(value)
+            return
+
+        # `a[][b]` starts a new dict once the current one already has `b`
+        if not node or not isinstance(node[-1], dict) or _has_path(node[-1], [p for p in rest if p]):
+            node.append({})
+
+        _insert(node[-1], rest, value)
+    elif not rest:
+        node[name] = value
+    else:
+        if name not in node:
+            node[name] = [] if rest[0] == '' else {}
+
+        _insert(node[name], rest, value)
+
+
+class EmulatorError(Exception):
+    def __init__(self, status, body):
+        super().__init__(status, body)
+        self.status = status
+        self.body = body
+
+
+def _invalid_request(message, param=None, status=400):
+    error = {'type': 'invalid_request_error', 'message': message}
+    if param is not None:
+        error['param'] = param
+
+    return EmulatorError(status, {'error': error})
+
+
+def _not_found(object_name, id):
+    return _invalid_request('No such %s: %s' % (object_name, id), 'id', 404)
+
+
+class StripeEmulator(object):
+    def __init__(self, host='127.0.0.1', port=0, latency=0, jitter=0, rate_limit=None, compress=False,
+                 ssl_context=None):
+        """`latency` (seconds, or a callable returning seconds) plus up to `jitter` random seconds is added to every
+        response. With `rate_limit` set, requests beyond that many per second get 429 responses. With `compress` set,
+        responses are compressed as the client's Accept-Encoding allows. With a server side `ssl_context`, it is
+        served over HTTPS."""
+
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.compress = compress
+
+        self.url = None
+        self.request_count = 0
+        self.request_log = collections.deque(maxlen=1000)
+
+        self._accounts = {}
+        self._sequence = 0
+        self._injected = collections.deque()
+        self._tokens = rate_limit or 0
+        self._tokens_updated = None
+        self._runner = None
+        self._saved_config = None
+
+    async def __aenter__(self):
+        await self.start()
+
+        self._saved_config = (aiostripe.api_base, aiostripe.upload_api_base)
+        aiostripe.api_base = aiostripe.upload_api_base = self.url
+
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        aiostripe.api_base, aiostripe.upload_api_base = self._saved_config
+
+        await self.stop()
+
+    async def start(self):
+        app = web.Application(client_max_size=1 << 30)
+        app.router.add_route('*', '/v1/{path:.*}', self._handle)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+
+        site = web.TCPSite(self._runner, self.host, self.port, ssl_context=self.ssl_context)
+        await site.start()
+
+        host, port = self._runner.addresses[0][:2]
+        self.url = '%s://%s:%d' % ('https' if self.ssl_context is not None else 'http', host, port)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def reset(self):
+        self._accounts.clear()
+        self._injected.clear()
+        self.request_count = 0
+        self.request_log.clear()
+
+    def inject_error(self, status, count=1, path=None):
+        """Answers the next `count` requests (whose path starts with `path`, if given) with a `status` error."""
+
+        for i in range(count):
+            self._injected.append((status, path))
+
+    def objects(self, collection, account=None):
+        return list(self._collection(account, collection).values())
+
+    def add(self, collection, values, account=None):
+        """Stores an object directly, without going through the API or emitting an event."""
+
+        obj = self._new_object(collection, values)
+        self._collection(account, collection)[obj['id']] = obj
+
+        return obj
+
+    # state
+
+    def _collection(self, account, collection):
+        return self._accounts.setdefault(account, {}).setdefault(collection, collections.OrderedDict())
+
+    def _new_object(self, collection, values):
+        object_name, prefix = COLLECTIONS[collection]
+
+        self._sequence += 1
+        obj = {
+            'id': _random_id(prefix),
+            'object': object_name,
+            'created': int(time.time()),
+            'livemode': False,
+            'metadata': {},
+        }
+        obj.update(values)
+        obj['_seq'] = self._sequence
+
+        return obj
+
+    def _find(self, account, id):
+        for collection in COLLECTIONS:
+            obj = self._collection(account, collection).get(id)
+            if obj is not None:
+                return obj
+
+        return None
+
+    def _get(self, account, collection, id):
+        obj = self._collection(account, collection).get(id)
+        if obj is None:
+            raise _not_found(COLLECTIONS[collection][0], id)
+
+        return obj
+
+    def _emit(self, account, type, obj, previous_attributes=None):
+        data = {'object': self._public(obj)}
+        if previous_attributes is not None:
+            data['previous_attributes'] = previous_attributes
+
+        event = self._new_object('events', {'type': type, 'data': data, 'pending_webhooks': 0, 'request': None})
+        del event['metadata']
+        self._collection(account, 'events')[event['id']] = event
+
+    @staticmethod
+    def _public(obj):
+        return {k: v for k, v in obj.items() if k != '_seq'}
+
+    def _list_object(self, url, items, has_more=False):
+        return {'object': 'list', 'url': url, 'has_more': has_more, 'data': items}
+
+    # request handling
+
+    async def _handle(self, request):
+        self.request_count += 1
+        self.request_log.append((request.method, request.path))
+
+        delay = self.latency() if callable(self.latency) else self.latency
+        if self.jitter:
+            delay += random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+
+        try:
+            self._check_auth(request)
+            self._check_injected(request)
+            self._check_rate_limit()
+
+            params = decode_params(list(request.query.items()))
+            if request.method == 'POST':
+                if request.content_type.startswith('multipart/'):
+                    params.update(await self._read_multipart(request))
+                else:
+                    params.update(decode_params(urllib.parse.parse_qsl((await request.read()).decode('utf-8'),
+                                                                       keep_blank_values=True)))
+
+            account = request.headers.get('Stripe-Account')
+            status, body = 200, self._route(request.method, request.match_info['path'].strip('/'), params, account)
+        except EmulatorError as e:
+            status, body = e.status, e.body
+
+        response = web.Response(status=status, text=json.dumps(body), content_type='application/json',
+                                headers={'Request-Id': _random_id('req')})
+        if self.compress:
+            response.enable_compression()
+
+        return response
+
+    @staticmethod
+    def _check_auth(request):
+        auth = request.headers.get('Authorization', '')
+        if not auth.startswith('Bearer ') or len(auth) <= len('Bearer '):
+            raise EmulatorError(401, {'error': {'type': 'invalid_request_error',
+                                                'message': 'You did not provide an API key.'}})
+
+    def _check_injected(self, request):
+        for i, (status, path) in enumerate(self._injected):
+            if path is None or request.path.startswith(path):
+                del self._injected[i]
+                raise self._error_for_status(status)
+
+    def _check_rate_limit(self):
+        if not self.rate_limit:
+            return
+
+        now = time.monotonic()
+        if self._tokens_updated is not None:
+            self._tokens = min(self.rate_limit, self._tokens + (now - self._tokens_updated) * self.rate_limit)
+        self._tokens_updated = now
+
+        if self._tokens < 1:
+            raise self._error_for_status(429)
+
+        self._tokens -= 1
+
+    @staticmethod
+    def _error_for_status(status):
+        if status == 402:
+            return EmulatorError(402, {'error': {'type': 'card_error', 'code': 'card_declined',
+                                                 'decline_code': 'generic_decline', 'param': '',
+                                                 'message': 'Your card was declined.'}})
+        elif status == 429:
+            return EmulatorError(429, {'error': {'type': 'rate_limit_error',
+                                                 'message': 'Too many requests hit the API too quickly.'}})
+        elif status == 404:
+            return _invalid_request('No such object', 'id', 404)
+        elif status == 400:
+            return _invalid_request('Invalid request (injected by the emulator)')
+
+        return EmulatorError(status, {'error': {'type': 'api_error', 'message': 'Emulated server error.'}})
+
+    @staticmethod
+    async def _read_multipart(request):
+        params = {}
+        reader = await request.multipart()
+
+        while True:
+            part = await reader.next()
+            if part is None:
+                break
+
+            if part.filename is None:
+                params[part.name] = (await part.read()).decode('utf-8')
+                continue
+
+            size = 0
+            while True:
+                chunk = await part.read_chunk()
+                if not chunk:
+                    break
+                size += len(chunk)
+
+            params[part.name] = {'filename': part.filename, 'size': size}
+
+        return params
+
+    def _route(self, method, path, params, account):
+        expand = params.pop('expand', [])
+
+        if path == 'balance' and method == 'GET':
+            return self._balance(account)
+
+        if path == 'account' and method == 'GET':
+            return {'id': account or 'acct_emulator', 'object': 'account', 'email': 'emulator@example.com',
+                    'charges_enabled': True, 'transfers_enabled': True, 'details_submitted': True}
+
+        for collection in COLLECTIONS:
+            if path == collection or path.startswith(collection + '/'):
+                rest = [urllib.parse.unquote(p) for p in path[len(collection) + 1:].split('/') if p]
+                break
+        else:
+            raise self._unrecognized(method, path)
+
+        if collection == 'invoices' and rest == ['upcoming'] and method == 'GET':
+            raise _invalid_request('No upcoming invoices for customer: %s' % params.get('customer'), 'customer', 404)
+
+        if not rest:
+            if method == 'GET':
+                return self._list(account, collection, params, expand)
+            elif method == 'POST' and collection not in READ_ONLY:
+                return self._expand(account, self._public(self._create(account, collection, params)), expand)
+        elif len(rest) == 1:
+            if method == 'GET':
+                return self._expand(account, self._public(self._get(account, collection, rest[0])), expand)
+            elif method == 'POST' and collection not in READ_ONLY:
+                return self._expand(account, self._public(self._update(account, collection, rest[0], params)), expand)
+            elif method == 'DELETE' and collection not in READ_ONLY:
+                return self._delete(account, collection, rest[0])
+        else:
+            action = getattr(self, '_action_%s_%s' % (collection.replace('/', '_'), rest[1]), None)
+            if action is not None:
+                result = action(method, account, self._get(account, collection, rest[0]), params, rest[2:])
+                if result is not None:
+                    return self._expand(account, result, expand)
+
+        raise self._unrecognized(method, path)
+
+    @staticmethod
+    def _unrecognized(method, path):
+        return _invalid_request('Unrecognized request URL (%s: /v1/%s).' % (method, path), status=404)
+
+    def _expand(self, account, obj, expand):
+        for field in expand:
+            target = obj
+            parts = field.split('.')
+
+            if target.get('object') == 'list' and parts[0] == 'data':
+                for item in target['data']:
+                    self._expand(account, item, ['.'.join(parts[1:])])
+                continue
+
+            for part in parts[:-1]:
+                target = target.get(part)
+                if not isinstance(target, dict):
+                    break
+            else:
+                value = target.get(parts[-1])
+                if isinstance(value, str):
+                    found = self._find(account, value)
+                    if found is not None:
+                        target[parts[-1]] = self._public(found)
+
+        return obj
+
+    def _list(self, account, collection, params, expand, source=None, url=None):
+        limit = min(max(int(params.pop('limit', 10)), 1), 100)
+        starting_after = params.pop('starting_after', None)
+        ending_before = params.pop('ending_before', None)
+        created = params.pop('created', None)
+        params.pop('include', None)
+
+        if source is None:
+            source = self._collection(account, collection).values()
+
+        items = sorted(source, key=lambda o: (o['created'], o['_seq']), reverse=True)
+
+        if isinstance(created, dict):
+            bounds = {'gt': lambda v, b: v > b, 'gte': lambda v, b: v >= b,
+                      'lt': lambda v, b: v < b, 'lte': lambda v, b: v <= b}
+            for op, bound in created.items():
+                if op in bounds:
+                    items = [o for o in items if bounds[op](o['created'], int(bound))]
+        elif created is not None:
+            items = [o for o in items if o['created'] == int(created)]
+
+        for key, value in params.items():
+            if isinstance(value, (dict, list)):
+                continue
+
+            if key == 'type' and '*' in str(value):
+                items = [o for o in items if fnmatch.fnmatchcase(o.get(key) or '', value)]
+            else:
+                items = [o for o in items if o.get(key) == value or str(o.get(key)) == str(value)]
+
+        ids = [o['id'] for o in items]
+
+        if starting_after is not None:
+            if starting_after not in ids:
+                raise _invalid_request('No such object: %s' % starting_after, 'starting_after')
+            page = items[ids.index(starting_after) + 1:]
+            has_more = len(page) > limit
+            page = page[:limit]
+        elif ending_before is not None:
+            if ending_before not in ids:
+                raise _invalid_request('No such object: %s' % ending_before, 'ending_before')
+            page = items[:ids.index(ending_before)]
+            has_more = len(page) > limit
+            page = page[-limit:]
+        else:
+            has_more = len(items) > limit
+            page = items[:limit]
+
+        data = [self._public(o) for o in page]
+        result = self._list_object(url or '/v1/%s' % collection, data, has_more)
+
+        return self._expand(account, result, expand)
+
+    def _create(self, account, collection, params):
+        for name in REQUIRED_PARAMS.get(collection, ()):
+            if params.get(name) in (None, ''):
+                raise _invalid_request('Missing required param: %s.' % name, name)
+
+        builder = getattr(self, '_build_%s' % collection.replace('/', '_'), None)
+        values = builder(account, params) if builder is not None else dict(params)
+
+        if collection == 'plans':
+            if params['id'] in self._collection(account, collection):
+                raise _invalid_request('Plan already exists.', 'id')
+
+        obj = self._new_object(collection, values)
+        self._collection(account, collection)[obj['id']] = obj
+
+        if collection not in SILENT:
+            self._emit(account, '%s.%s' % (obj['object'], 'succeeded' if collection == 'charges' else 'created'), obj)
+
+        return obj
+
+    def _update(self, account, collection, id, params):
+        obj = self._get(account, collection, id)
+        previous = {}
+
+        card = params.pop('card', None) or params.pop('source', None) if collection == 'customers' else None
+        if card is not None:
+            card = self._card(card, {'customer': id})
+            card.pop('_number', None)
+
+            previous['default_source'] = obj['default_source']
+            obj['sources']['data'] = [card]
+            obj['default_source'] = card['id']
+
+        for key, value in params.items():
+            previous[key] = obj.get(key)
+
+            if key == 'metadata' and isinstance(value, dict):
+                metadata = dict(obj.get('metadata') or {})
+                for k, v in value.items():
+                    if v == '':
+                        metadata.pop(k, None)
+                    else:
+                        metadata[k] = v
+                obj['metadata'] = metadata
+            elif value == '':
+                obj[key] = None
+            else:
+                obj[key] = value
+
+        if collection not in SILENT:
+            self._emit(account, '%s.updated' % obj['object'], obj, previous)
+
+        return obj
+
+    def _delete(self, account, collection, id):
+        obj = self._get(account, collection, id)
+        del self._collection(account, collection)[id]
+
+        if collection not in SILENT:
+            self._emit(account, '%s.deleted' % obj['object'], obj)
+
+        return {'id': id, 'object': obj['object'], 'deleted': True}
+
+    def _balance(self, account):
+        available = collections.defaultdict(int)
+        for txn in self._collection(account, 'balance/history').values():
+            available[txn['currency']] += txn['net']
+
+        return {'object': 'balance', 'livemode': False,
+                'available': [{'currency': c, 'amount': a} for c, a in sorted(available.items())],
+                'pending': [{'currency': c, 'amount': 0} for c in sorted(available)]}
+
+    # builders for objects with derived fields
+
+    def _card(self, card, owner=None):
+        if isinstance(card, str):
+            token = self._find_token(card)
+            if token is None:
+                raise _invalid_request('No such token: %s' % card, 'card')
+            return dict(token['card'])
+
+        if not isinstance(card, dict) or 'number' not in card:
+            raise _invalid_request('Missing required param: card[number].', 'card')
+
+        number = str(card['number'])
+        values = {
+            'id': _random_id('card'),
+            'object': 'card',
+            'last4': number[-4:],
+            'brand': 'Visa' if number.startswith('4') else 'Unknown',
+            'exp_month': card.get('exp_month'),
+            'exp_year': card.get('exp_year'),
+            'fingerprint': 'emu%s' % number[-8:],
+            'funding': 'credit',
+            'country': 'US',
+            '_number': number,
+        }
+        values.update(owner or {})
+
+        return values
+
+    def _find_token(self, id):
+        for accounts in self._accounts.values():
+            token = accounts.get('tokens', {}).get(id)
+            if token is not None:
+                return token
+
+        return None
+
+    def _build_tokens(self, account, params):
+        card = self._card(params.get('card'))
+        card.pop('_number', None)
+
+        return {'type': 'card', 'used': False, 'card': card}
+
+    def _build_customers(self, account, params):
+        values = dict(params)
+        values.setdefault('email', None)
+        values.setdefault('description', None)
+        values.setdefault('account_balance', 0)
+        values.setdefault('discount', None)
+        values.setdefault('delinquent', False)
+
+        card = values.pop('card', None) or values.pop('source', None)
+        sources = []
+        values['id'] = _random_id('cus')
+        if card is not None:
+            card = self._card(card, {'customer': values['id']})
+            card.pop('_number', None)
+            sources.append(card)
+
+        values['default_source'] = sources[0]['id'] if sources else None
+        values['sources'] = self._list_object('/v1/customers/%s/sources' % values['id'], sources)
+        values['subscriptions'] = self._list_object('/v1/customers/%s/subscriptions' % values['id'], [])
+
+        return values
+
+    def _build_charges(self, account, params):
+        values = dict(params)
+        values['id'] = _random_id('ch')
+
+        card = values.pop('card', None) or values.pop('source', None)
+        customer = values.get('customer')
+
+        if card is not None:
+            source = self._card(card)
+        elif customer is not None:
+            customer = self._get(account, 'customers', customer)
+            if not customer['sources']['data']:
+                raise EmulatorError(402, {'error': {'type': 'card_error', 'code': 'missing',
+                                                    'message': 'Cannot charge a customer that has no active card',
+                                                    'param': 'card'}})
+            source = dict(customer['sources']['data'][0])
+        else:
+            raise _invalid_request('Must provide source or customer.', 'source')
+
+        number = source.pop('_number', None)
+        if number in DECLINED_CARDS:
+            raise EmulatorError(402, {'error': {'type': 'card_error', 'code': 'card_declined',
+                                                'decline_code': DECLINED_CARDS[number], 'param': '',
+                                                'message': 'Your card was declined.', 'charge': values['id']}})
+
+        captured = values.pop('capture', True) is not False
+        values.update({
+            'source': source,
+            'paid': True,
+            'status': 'succeeded',
+            'captured': captured,
+            'refunded': False,
+            'amount_refunded': 0,
+            'refunds': self._list_object('/v1/charges/%s/refunds' % values['id'], []),
+            'customer': values.get('customer'),
+            'description': values.get('description'),
+            'invoice': values.get('invoice'),
+            'dispute': None,
+            'failure_code': None,
+            'failure_message': None,
+            'fraud_details': {},
+        })
+
+        fee = int(round(values['amount'] * 0.029)) + 30
+        txn = self._new_object('balance/history', {
+            'amount': values['amount'],
+            'currency': values['currency'],
+            'fee': fee,
+            'net': values['amount'] - fee,
+            'type': 'charge',
+            'status': 'pending',
+            'source': values['id'],
+            'description': values.get('description'),
+        })
+        del txn['metadata']
+        self._collection(account, 'balance/history')[txn['id']] = txn
+        values['balance_transaction'] = txn['id']
+
+        return values
+
+    def _build_files(self, account, params):
+        upload = params.get('file')
+        if not isinstance(upload, dict):
+            raise _invalid_request('Missing required param: file.', 'file')
+
+        filename = upload['filename']
+        return {'purpose': params.get('purpose'), 'size': upload['size'],
+                'type': filename.rsplit('.', 1)[-1] if '.' in filename else None,
+                'url': None}
+
+    def _build_plans(self, account, params):
+        values = dict(params)
+        values.setdefault('interval_count', 1)
+        values.setdefault('trial_period_days', None)
+        return values
+
+    def _build_coupons(self, account, params):
+        values = dict(params)
+        if 'id' not in values:
+            values['id'] = _random_id('co')
+        values.update({'valid': True, 'times_redeemed': 0})
+        return values
+
+    def _build_invoices(self, account, params):
+        self._get(account, 'customers', params['customer'])
+
+        values = dict(params)
+        values.update({'paid': False, 'closed': False, 'attempted': False, 'attempt_count': 0, 'charge': None,
+                       'amount_due': 0, 'total': 0, 'subtotal': 0, 'currency': 'usd', 'subscription': None,
+                       'date': int(time.time())})
+
+        items = [ii for ii in self._collection(account, 'invoiceitems').values()
+                 if ii['customer'] == params['customer'] and ii.get('invoice') is None]
+        for ii in items:
+            values['total'] += ii['amount']
+            values['currency'] = ii['currency']
+
+        values['amount_due'] = values['subtotal'] = values['total']
+        values['lines'] = self._list_object('/v1/invoices/lines', [self._public(ii) for ii in items])
+
+        return values
+
+    def _build_invoiceitems(self, account, params):
+        self._get(account, 'customers', params['customer'])
+
+        values = dict(params)
+        values.setdefault('invoice', None)
+        values.setdefault('description', None)
+        return values
+
+    def _build_transfers(self, account, params):
+        values = dict(params)
+        values.update({'status': 'paid', 'reversed': False, 'amount_reversed': 0,
+                       'reversals': self._list_object('/v1/transfers/reversals', [])})
+        return values
+
+    # actions
+
+    def _action_charges_refund(self, method, account, charge, params, rest):
+        if method != 'POST' or rest:
+            return None
+
+        self._refund(account, charge, params)
+
+        return self._public(charge)
+
+    def _action_charges_capture(self, method, account, charge, params, rest):
+        if method != 'POST' or rest:
+            return None
+
+        if charge['captured']:
+            raise _invalid_request('Charge %s has already been captured.' % charge['id'])
+
+        charge['captured'] = True
+        self._emit(account, 'charge.captured', charge)
+
+        return self._public(charge)
+
+    def _action_charges_refunds(self, method, account, charge, params, rest):
+        if rest:
+            if method == 'GET':
+                for refund in charge['refunds']['data']:
+                    if refund['id'] == rest[0]:
+                        return refund
+                raise _not_found('refund', rest[0])
+            return None
+
+        if method == 'GET':
+            return self._list(account, 'refunds', params, [], source=[
+                self._collection(account, 'refunds')[r['id']] for r in charge['refunds']['data']],
+                url=charge['refunds']['url'])
+        elif method == 'POST':
+            return self._refund(account, charge, params)
+
+        return None
+
+    def _refund(self, account, charge, params):
+        amount = params.get('amount', charge['amount'] - charge['amount_refunded'])
+        if amount <= 0 or charge['amount_refunded'] + amount > charge['amount']:
+            raise _invalid_request('Charge %s has already been refunded.' % charge['id'], 'amount')
+
+        refund = self._new_object('refunds', {'amount': amount, 'currency': charge['currency'],
+                                              'charge': charge['id'], 'reason': params.get('reason'),
+                                              'status': 'succeeded', 'balance_transaction': None})
+        self._collection(account, 'refunds')[refund['id']] = refund
+
+        charge['amount_refunded'] += amount
+        charge['refunded'] = charge['amount_refunded'] == charge['amount']
+        charge['refunds']['data'].insert(0, self._public(refund))
+        self._emit(account, 'charge.refunded', charge)
+
+        return self._public(refund)
+
+    def _action_customers_sources(self, method, account, customer, params, rest):
+        sources = customer['sources']
+
+        if rest:
+            for i, source in enumerate(sources['data']):
+                if source['id'] != rest[0]:
+                    continue
+
+                if method == 'GET':
+                    return source
+                elif method == 'DELETE':
+                    del sources['data'][i]
+                    if customer['default_source'] == source['id']:
+                        customer['default_source'] = sources['data'][0]['id'] if sources['data'] else None
+                    self._emit(account, 'customer.source.deleted', source)
+                    return {'id': source['id'], 'deleted': True}
+                elif method == 'POST':
+                    source.update(params)
+                    self._emit(account, 'customer.source.updated', source)
+                    return source
+
+            raise _not_found('source', rest[0])
+
+        if method == 'GET':
+            return self._list_object(sources['url'], sources['data'][:int(params.get('limit', 10))])
+        elif method == 'POST':
+            card = self._card(params.get('source') or params.get('card'), {'customer': customer['id']})
+            card.pop('_number', None)
+            sources['data'].append(card)
+            if customer['default_source'] is None:
+                customer['default_source'] = card['id']
+            self._emit(account, 'customer.source.created', card)
+            return card
+
+        return None
+
+    def _action_customers_subscriptions(self, method, account, customer, params, rest):
+        subscriptions = customer['subscriptions']
+
+        if rest:
+            for i, subscription in enumerate(subscriptions['data']):
+                if subscription['id'] != rest[0]:
+                    continue
+
+                if method == 'GET':
+                    return subscription
+                elif method == 'POST':
+                    previous = {k: subscription.get(k) for k in params}
+                    if 'plan' in params:
+                        params['plan'] = self._public(self._get(account, 'plans', params['plan']))
+                    subscription.update(params)
+                    self._emit(account, 'customer.subscription.updated', subscription, previous)
+                    return subscription
+                elif method == 'DELETE':
+                    del subscriptions['data'][i]
+                    subscription.update({'status': 'canceled', 'canceled_at': int(time.time())})
+                    self._emit(account, 'customer.subscription.deleted', subscription)
+                    return subscription
+
+            raise _not_found('subscription', rest[0])
+
+        if method == 'GET':
+            return self._list_object(subscriptions['url'], subscriptions['data'][:int(params.get('limit', 10))])
+        elif method == 'POST':
+            if 'plan' not in params:
+                raise _invalid_request('Missing required param: plan.', 'plan')
+
+            now = int(time.time())
+            subscription = {
+                'id': _random_id('sub'),
+                'object': 'subscription',
+                'customer': customer['id'],
+                'plan': self._public(self._get(account, 'plans', params['plan'])),
+                'quantity': params.get('quantity', 1),
+                'status': 'active',
+                'start': now,
+                'current_period_start': now,
+                'current_period_end': now + 30 * 24 * 3600,
+                'cancel_at_period_end': False,
+                'canceled_at': None,
+                'metadata': params.get('metadata', {}),
+            }
+            subscriptions['data'].append(subscription)
+            self._emit(account, 'customer.subscription.created', subscription)
+            return subscription
+
+        return None
+
+    def _action_disputes_close(self, method, account, dispute, params, rest):
+        if method != 'POST' or rest:
+            return None
+
+        dispute['status'] = 'lost'
+        self._emit(account, 'charge.dispute.closed', dispute)
+
+        return self._public(dispute)
+
+    def _action_invoices_pay(self, method, account, invoice, params, rest):
+        if method != 'POST' or rest:
+            return None
+
+        if invoice['paid']:
+            raise _invalid_request('Invoice is already paid')
+
+        if invoice['amount_due'] > 0:
+            charge = self._create(account, 'charges', {'amount': invoice['amount_due'],
+                                                       'currency': invoice['currency'],
+                                                       'customer': invoice['customer'],
+                                                       'invoice': invoice['id']})
+            invoice['charge'] = charge['id']
+
+        invoice.update({'paid': True, 'closed': True, 'attempted': True, 'attempt_count': 1})
+        self._emit(account, 'invoice.payment_succeeded', invoice)
+
+        return self._public(invoice)
+
+    def _action_orders_pay(self, method, account, order, params, rest):
+        if method != 'POST' or rest:
+            return None
+
+        order['status'] = 'paid'
+        self._emit(account, 'order.payment_succeeded', order)
+
+        return self._public(order)
+
+    def _action_application_fees_refund(self, method, account, fee, params, rest):
+        if method != 'POST' or rest:
+            return None
+
+        fee['amount_refunded'] = fee.get('amount_refunded', 0) + params.get('amount', fee['amount'])
+        fee['refunded'] = fee['amount_refunded'] >= fee['amount']
+        self._emit(account, 'application_fee.refunded', fee)
+
+        return self._public(fee)
+
+
+__all__ = ['StripeEmulator', 'decode_params']
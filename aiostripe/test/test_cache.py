@@ -0,0 +1,375 @@
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+import aiostripe
+import aiostripe.cache
+from aiostripe.cache import PersistentCache, RetrieveCache
+from aiostripe.test.emulator import StripeEmulator
+from aiostripe.test.helper import StripeTestCase, DUMMY_CARD, DUMMY_CHARGE, DUMMY_PLAN
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class RetrieveCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = RetrieveCache(ttl=10, max_size=4, clock=self.clock)
+
+    def test_ttl(self):
+        key = ('sk', None, 'plan_1', '')
+
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, {'id': 'plan_1'})
+        self.assertEqual(self.cache.get(key), {'id': 'plan_1'})
+
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get(key))
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.stats, {'hits': 1, 'misses': 2, 'expired': 1, 'evictions': 0,
+                                            'invalidations': 0, 'negative_hits': 0, 'early_refreshes': 0,
+                                            'collapsed': 0})
+
+    def test_lru(self):
+        self.cache.max_size = 2
+
+        for id in ('a', 'b'):
+            self.cache.put(('sk', None, id, ''), {'id': id})
+
+        self.cache.get(('sk', None, 'a', ''))
+        self.cache.put(('sk', None, 'c', ''), {'id': 'c'})
+
+        self.assertIsNone(self.cache.get(('sk', None, 'b', '')))
+        self.assertIsNotNone(self.cache.get(('sk', None, 'a', '')))
+        self.assertEqual(self.cache.stats['evictions'], 1)
+
+    def test_invalidate(self):
+        self.cache.put(('sk', None, 'a', ''), {'id': 'a'})
+        self.cache.put(('sk', None, 'a', '{"expand": ["customer"]}'), {'id': 'a'})
+        self.cache.put(('sk_other', None, 'a', ''), {'id': 'a'})
+        self.cache.put(('sk', 'acct_1', 'a', ''), {'id': 'a'})
+
+        self.cache.invalidate(None, 'a')
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.stats['invalidations'], 3)
+
+    def test_negative(self):
+        key = ('sk', None, 'plan_missing', '')
+        self.cache.negative_ttl = 2
+        self.cache.put_missing(key, aiostripe.error.InvalidRequestError('No such plan', 'id', http_status=404))
+
+        self.assertRaises(aiostripe.error.InvalidRequestError, self.cache.get, key)
+        self.clock.now = 2
+        self.assertIsNone(self.cache.get(key))
+        self.assertEqual(self.cache.stats['negative_hits'], 1)
+
+    def test_early_refresh(self):
+        key = ('sk', None, 'plan_1', '')
+        self.cache.put(key, {'id': 'plan_1'}, cost=1.0)
+        self.clock.now = 9
+
+        # -log(1 - 0.5) * 1s is less than the second left
+        with unittest.mock.patch('random.random', return_value=0.5):
+            self.assertIsNotNone(self.cache.get(key))
+
+        with unittest.mock.patch('random.random', return_value=0.9):
+            self.assertIsNone(self.cache.get(key))
+
+        self.cache.beta = 0
+        with unittest.mock.patch('random.random', return_value=0.9):
+            self.assertIsNotNone(self.cache.get(key))
+
+        self.assertEqual(self.cache.stats['early_refreshes'], 1)
+
+    def test_copies(self):
+        values = {'id': 'a', 'metadata': {'n': '1'}, 'items': [{'x': 1}]}
+        self.cache.put(('sk', None, 'a', ''), values)
+
+        values['metadata']['n'] = '2'
+        values['items'][0]['x'] = 2
+        self.assertEqual(self.cache.get(('sk', None, 'a', '')), {'id': 'a', 'metadata': {'n': '1'},
+                                                                 'items': [{'x': 1}]})
+
+
+class CachedRetrieveTests(StripeTestCase):
+    def tearDown(self):
+        super().tearDown()
+
+        aiostripe.cache.disable()
+
+    def gets(self, emulator, path):
+        return sum(1 for method, logged in emulator.request_log if method == 'GET' and logged == path)
+
+    async def test_read_through(self):
+        aiostripe.cache.enable(aiostripe.Plan, ttl=60)
+
+        async with StripeEmulator() as emulator:
+            await aiostripe.Plan.create(**DUMMY_PLAN)
+
+            first = await aiostripe.Plan.retrieve(DUMMY_PLAN['id'])
+            second = await aiostripe.Plan.retrieve(DUMMY_PLAN['id'])
+
+            self.assertEqual(self.gets(emulator, '/v1/plans/%s' % DUMMY_PLAN['id']), 1)
+            self.assertEqual(first, second)
+            self.assertIsNot(first, second)
+            self.assertIsInstance(second, aiostripe.Plan)
+            self.assertEqual(second.api_key, aiostripe.api_key)
+
+            second.name = 'Changed locally'
+            third = await aiostripe.Plan.retrieve(DUMMY_PLAN['id'])
+            self.assertEqual(third.name, DUMMY_PLAN['name'])
+
+            # other retrieve parameters are cached separately
+            await aiostripe.Plan.retrieve(DUMMY_PLAN['id'], expand=['product'])
+            self.assertEqual(self.gets(emulator, '/v1/plans/%s' % DUMMY_PLAN['id']), 2)
+
+            stats = aiostripe.cache.stats()['Plan']
+            self.assertEqual((stats['hits'], stats['misses'], stats['size']), (2, 2, 2))
+
+    async def test_save_and_delete(self):
+        aiostripe.cache.enable(aiostripe.Customer)
+
+        async with StripeEmulator() as emulator:
+            customer = await aiostripe.Customer.create(description='before')
+            path = '/v1/customers/%s' % customer.id
+
+            cached = await aiostripe.Customer.retrieve(customer.id)
+            cached.description = 'after'
+            await cached.save()
+
+            self.assertEqual((await aiostripe.Customer.retrieve(customer.id)).description, 'after')
+            self.assertEqual(self.gets(emulator, path), 1)
+
+            await cached.delete()
+            await self.assertRaisesAsync(aiostripe.error.InvalidRequestError, aiostripe.Customer.retrieve,
+                                         customer.id)
+            self.assertEqual(self.gets(emulator, path), 2)
+
+    async def test_action(self):
+        aiostripe.cache.enable(aiostripe.Charge)
+
+        async with StripeEmulator() as emulator:
+            charge = await aiostripe.Charge.create(**DUMMY_CHARGE)
+
+            self.assertFalse((await aiostripe.Charge.retrieve(charge.id)).refunded)
+            await charge.refund()
+            self.assertTrue((await aiostripe.Charge.retrieve(charge.id)).refunded)
+
+            self.assertEqual(self.gets(emulator, '/v1/charges/%s' % charge.id), 1)
+
+    async def test_collapsing(self):
+        aiostripe.cache.enable(aiostripe.Plan)
+
+        async with StripeEmulator(latency=0.02) as emulator:
+            await aiostripe.Plan.create(**DUMMY_PLAN)
+
+            plans = await asyncio.gather(*[aiostripe.Plan.retrieve(DUMMY_PLAN['id']) for _ in range(5)])
+
+            self.assertEqual(self.gets(emulator, '/v1/plans/%s' % DUMMY_PLAN['id']), 1)
+            self.assertEqual(aiostripe.cache.stats()['Plan']['collapsed'], 4)
+
+            plans[0].metadata['changed'] = 'yes'
+            self.assertEqual([len(plan.metadata) for plan in plans], [1, 0, 0, 0, 0])
+
+    async def test_negative(self):
+        aiostripe.cache.enable(aiostripe.Plan, negative_ttl=60)
+
+        async with StripeEmulator() as emulator:
+            for _ in range(2):
+                await self.assertRaisesAsync(aiostripe.error.InvalidRequestError, aiostripe.Plan.retrieve, 'missing')
+
+            self.assertEqual(self.gets(emulator, '/v1/plans/missing'), 1)
+
+            await aiostripe.Plan.create(**dict(DUMMY_PLAN, id='missing'))
+            self.assertEqual((await aiostripe.Plan.retrieve('missing')).id, 'missing')
+
+    async def test_disabled(self):
+        async with StripeEmulator() as emulator:
+            await aiostripe.Plan.create(**DUMMY_PLAN)
+
+            await aiostripe.Plan.retrieve(DUMMY_PLAN['id'])
+            await aiostripe.Plan.retrieve(DUMMY_PLAN['id'])
+
+            self.assertEqual(self.gets(emulator, '/v1/plans/%s' % DUMMY_PLAN['id']), 2)
+
+
+class CacheUpdaterTests(StripeTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.customers = aiostripe.cache.enable(aiostripe.Customer)
+        self.updater = aiostripe.cache.CacheUpdater()
+
+    def tearDown(self):
+        super().tearDown()
+
+        aiostripe.cache.disable()
+
+    def event(self, type, obj, created=100, id='evt_1'):
+        return {'id': id, 'object': 'event', 'type': type, 'created': created, 'data': {'object': obj}}
+
+    def cached(self, id):
+        return self.customers.get((aiostripe.api_key, None, id, ''))
+
+    def test_apply(self):
+        self.updater.apply(self.event('customer.updated', {'id': 'cus_1', 'object': 'customer', 'email': 'new'}))
+        self.assertEqual(self.cached('cus_1')['email'], 'new')
+
+        # an older event must not overwrite a newer one
+        self.updater.apply(self.event('customer.updated', {'id': 'cus_1', 'object': 'customer', 'email': 'old'}, 99))
+        self.assertIsNone(self.cached('cus_1'))
+        self.assertEqual(self.updater.stats['out_of_order'], 1)
+
+        self.updater.apply(self.event('customer.updated', {'id': 'cus_1', 'object': 'customer', 'email': 'new'}))
+        self.updater.apply(self.event('customer.deleted', {'id': 'cus_1', 'object': 'customer'}, 101))
+        self.assertIsNone(self.cached('cus_1'))
+
+    def test_same_second(self):
+        self.updater.apply(self.event('customer.updated', {'id': 'cus_1', 'object': 'customer', 'description': 'new'},
+                                      id='evt_2'))
+        self.assertEqual(self.cached('cus_1')['description'], 'new')
+
+        # which of two events from the same second is newer cannot be told
+        self.updater.apply(self.event('customer.updated', {'id': 'cus_1', 'object': 'customer', 'description': 'old'},
+                                      id='evt_1'))
+        self.assertIsNone(self.cached('cus_1'))
+        self.assertEqual(self.updater.stats['out_of_order'], 1)
+
+        self.updater.apply(self.event('customer.updated', {'id': 'cus_1', 'object': 'customer', 'description': 'new'},
+                                      101, id='evt_3'))
+        self.assertEqual(self.cached('cus_1')['description'], 'new')
+
+    def test_embedded(self):
+        self.customers.put((aiostripe.api_key, None, 'cus_1', ''), {'id': 'cus_1', 'object': 'customer'})
+
+        self.updater.apply(self.event('customer.subscription.updated',
+                                      {'id': 'sub_1', 'object': 'subscription', 'customer': 'cus_1'}))
+        self.assertIsNone(self.cached('cus_1'))
+
+    def test_uncached_types(self):
+        self.updater.apply(self.event('charge.succeeded', {'id': 'ch_1', 'object': 'charge'}))
+        self.assertEqual(len(self.customers), 0)
+
+    async def test_poll(self):
+        async with StripeEmulator() as emulator:
+            customer = await aiostripe.Customer.create(description='before')
+            await self.updater.poll()
+
+            self.assertEqual((await aiostripe.Customer.retrieve(customer.id)).description, 'before')
+
+            # changed behind the cache's back
+            requestor = aiostripe.api_requestor.APIRequestor()
+            await requestor.request('post', '/v1/customers/%s' % customer.id, {'description': 'after'})
+            self.assertEqual((await aiostripe.Customer.retrieve(customer.id)).description, 'before')
+
+            await self.updater.poll()
+            self.assertEqual((await aiostripe.Customer.retrieve(customer.id)).description, 'after')
+
+            path = '/v1/customers/%s' % customer.id
+            self.assertEqual(sum(1 for method, logged in emulator.request_log if logged == path and method == 'GET'),
+                             1)
+            self.assertEqual(self.updater.stats['updates'], 1)
+
+
+class PersistentCacheTests(StripeTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'cache.sqlite3')
+
+    def tearDown(self):
+        super().tearDown()
+
+        aiostripe.cache.disable_persistent()
+        aiostripe.cache.disable()
+        self.directory.cleanup()
+
+    def test_policy(self):
+        cache = PersistentCache(self.path)
+
+        self.assertFalse(cache.put(None, {'id': 'in_1', 'object': 'invoice', 'paid': False}))
+        self.assertFalse(cache.put(None, {'id': 'cus_1', 'object': 'customer'}))
+        self.assertTrue(cache.put(None, {'id': 'in_1', 'object': 'invoice', 'paid': True}))
+        self.assertTrue(cache.put('acct_1', {'id': 'txn_1', 'object': 'balance_transaction', 'amount': 100}))
+
+        cache.close()
+        cache = PersistentCache(self.path)
+
+        self.assertEqual(cache.get(None, 'invoice', 'in_1'), {'id': 'in_1', 'object': 'invoice', 'paid': True})
+        self.assertEqual(cache.get('acct_1', 'balance_transaction', 'txn_1')['amount'], 100)
+        self.assertIsNone(cache.get(None, 'balance_transaction', 'txn_1'))
+        self.assertEqual(len(cache), 2)
+
+        cache.close()
+
+    async def test_retrieve(self):
+        async with StripeEmulator() as emulator:
+            await aiostripe.Customer.create(description='with an event')
+            event_id = (await aiostripe.Event.list(limit=1)).data[0].id
+            path = '/v1/events/%s' % event_id
+
+            aiostripe.cache.enable_persistent(self.path)
+            first = await aiostripe.Event.retrieve(event_id)
+
+            # a new process starts with an empty memory
+            aiostripe.cache.enable_persistent(self.path)
+            second = await aiostripe.Event.retrieve(event_id)
+
+            self.assertEqual(first, second)
+            self.assertIsInstance(second.data.object, aiostripe.Customer)
+            self.assertEqual(sum(1 for method, logged in emulator.request_log if logged == path), 1)
+            self.assertEqual(aiostripe.cache.persistent.stats['hits'], 1)
+
+            # the memory tier is looked up first
+            aiostripe.cache.enable(aiostripe.Event)
+            await aiostripe.Event.retrieve(event_id)
+            await aiostripe.Event.retrieve(event_id)
+            self.assertEqual(aiostripe.cache.persistent.stats['hits'], 2)
+
+    async def test_queries_off_the_loop(self):
+        cache = aiostripe.cache.enable_persistent(self.path)
+        get, put = cache._get, cache._put
+        threads = []
+
+        def spy(method):
+            def call(*args):
+                threads.append(threading.current_thread())
+                return method(*args)
+            return call
+
+        cache._get, cache._put = spy(get), spy(put)
+
+        async with StripeEmulator():
+            await aiostripe.Customer.create(description='with an event')
+            event_id = (await aiostripe.Event.list(limit=1)).data[0].id
+
+            await aiostripe.Event.retrieve(event_id)
+
+        # the write after the miss is queued, and the lookups made later wait for it
+        self.assertEqual(cache.get(None, 'event', event_id)['id'], event_id)
+        self.assertEqual(len(threads), 3)
+        self.assertNotIn(threading.current_thread(), threads)
+
+    async def test_written(self):
+        aiostripe.cache.enable_persistent(self.path)
+
+        async with StripeEmulator():
+            customer = await aiostripe.Customer.create(card=DUMMY_CARD)
+            await aiostripe.InvoiceItem.create(customer=customer.id, amount=100, currency='usd')
+            invoice = await aiostripe.Invoice.create(customer=customer.id)
+
+            await aiostripe.Invoice.retrieve(invoice.id)
+            self.assertIsNone(aiostripe.cache.persistent.get(None, 'invoice', invoice.id))
+
+            await invoice.pay()
+            self.assertTrue(aiostripe.cache.persistent.get(None, 'invoice', invoice.id)['paid'])
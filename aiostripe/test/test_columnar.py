@@ -0,0 +1,107 @@
+import unittest
+import unittest.mock
+from array import array
+
+import aiostripe
+from aiostripe.columnar import Column, iter_batches, _BatchBuilder
+from aiostripe.http_client import _StreamedRequest
+from aiostripe.test.emulator import StripeEmulator
+from aiostripe.test.helper import StripeTestCase, DUMMY_CARD, DUMMY_CHARGE
+
+
+class BatchBuilderTests(unittest.TestCase):
+    def test_kinds(self):
+        builder = _BatchBuilder(['amount', 'created', 'paid', 'currency', 'customer', 'metadata.order'], {})
+        builder.append({'amount': 100, 'created': 1485820800, 'paid': True, 'currency': 'usd',
+                        'customer': {'id': 'cus_1', 'object': 'customer'}, 'metadata': {'order': 'o1'}})
+        builder.append({'amount': 200, 'created': 1485820801, 'paid': False, 'currency': 'u' + 'sd',
+                        'customer': 'cus_2', 'metadata': {}})
+
+        batch = builder.build()
+
+        self.assertEqual(len(batch), 2)
+        self.assertEqual(list(batch), ['amount', 'created', 'paid', 'currency', 'customer', 'metadata.order'])
+        self.assertEqual(batch.kinds, {'amount': 'int', 'created': 'timestamp', 'paid': 'bool', 'currency': 'category',
+                                       'customer': 'category', 'metadata.order': 'category'})
+        self.assertEqual(batch['amount'], array('q', [100, 200]))
+        self.assertEqual(batch['paid'], array('b', [1, 0]))
+        self.assertEqual(batch['customer'], ['cus_1', 'cus_2'])
+        self.assertEqual(batch['metadata.order'], ['o1', None])
+        self.assertIs(batch['currency'][0], batch['currency'][1])
+
+    def test_nulls(self):
+        builder = _BatchBuilder(['amount', 'canceled_at', 'missing'], {'canceled_at': 'timestamp'})
+        builder.append({'amount': 1, 'canceled_at': None})
+        builder.append({'amount': None, 'canceled_at': 1485820800})
+        builder.append({'amount': 3, 'canceled_at': None})
+
+        batch = builder.build()
+
+        self.assertEqual(batch['amount'], array('q', [1, 0, 3]))
+        self.assertEqual(batch['canceled_at'], array('q', [0, 1485820800, 0]))
+        self.assertEqual(batch.nulls, {'amount': array('b', [0, 1, 0]), 'canceled_at': array('b', [1, 0, 1])})
+        self.assertEqual(batch['missing'], [None, None, None])
+
+    def test_late_kind(self):
+        builder = _BatchBuilder(['customer'], {})
+        builder.append({'customer': None})
+        builder.append({'customer': 'cus_1'})
+
+        self.assertEqual(builder.build()['customer'], [None, 'cus_1'])
+
+    def test_unknown_kind(self):
+        self.assertRaises(ValueError, Column, 'decimal')
+
+
+class IterBatchesTests(StripeTestCase):
+    async def test_iter_batches(self):
+        async with StripeEmulator():
+            customer = await aiostripe.Customer.create(card=DUMMY_CARD)
+            charges = []
+            for i in range(5):
+                charge = await aiostripe.Charge.create(**dict(DUMMY_CHARGE, amount=100 + i))
+                charges.append(charge)
+            charges.append(await aiostripe.Charge.create(amount=500, currency='eur', customer=customer.id))
+
+            with unittest.mock.patch('aiostripe.resource.convert_to_stripe_object') as convert:
+                batches = []
+                async for batch in iter_batches(aiostripe.Charge, ['id', 'amount', 'currency', 'customer'],
+                                                batch_size=4, limit=3):
+                    batches.append(batch)
+
+                self.assertFalse(convert.called)
+
+            self.assertEqual([len(batch) for batch in batches], [4, 2])
+            self.assertEqual(batches[0].kinds['amount'], 'int')
+            self.assertIsInstance(batches[1]['amount'], array)
+
+            ids = batches[0]['id'] + batches[1]['id']
+            amounts = list(batches[0]['amount']) + list(batches[1]['amount'])
+            customers = batches[0]['customer'] + batches[1]['customer']
+            self.assertEqual(sorted(ids), sorted(charge.id for charge in charges))
+            self.assertEqual(sorted(amounts), [100, 101, 102, 103, 104, 500])
+            self.assertEqual(customers.count(customer.id), 1)
+            self.assertEqual(customers.count(None), 5)
+
+    async def test_close_early(self):
+        async with StripeEmulator():
+            for i in range(5):
+                await aiostripe.Charge.create(**DUMMY_CHARGE)
+
+            exit = _StreamedRequest.__aexit__
+            released = []
+
+            async def spy(self, *args):
+                released.append(args[0])
+                return await exit(self, *args)
+
+            with unittest.mock.patch.object(_StreamedRequest, '__aexit__', spy):
+                batches = iter_batches(aiostripe.Charge, ['id'], batch_size=2, limit=5)
+                async for batch in batches:
+                    break
+
+                self.assertEqual(released, [])
+
+                await batches.close()
+
+            self.assertEqual(released, [GeneratorExit])
@@ -0,0 +1,140 @@
+import tempfile
+import unittest
+
+import aiostripe
+import aiostripe.error
+from aiostripe.test.emulator import StripeEmulator, decode_params
+from aiostripe.test.helper import StripeTestCase, DUMMY_CARD, DUMMY_CHARGE, DUMMY_PLAN
+
+
+class DecodeParamsTests(unittest.TestCase):
+    def test_decode_nested(self):
+        pairs = [('amount', '100'), ('card[number]', '4242424242424242'), ('card[exp_month]', '12'),
+                 ('metadata[order_id]', '42'), ('expand[]', 'customer'), ('expand[]', 'invoice'),
+                 ('items[][sku]', 'a'), ('items[][quantity]', '1'), ('items[][sku]', 'b'), ('capture', 'false')]
+
+        self.assertEqual(decode_params(pairs), {
+            'amount': 100,
+            'card': {'number': '4242424242424242', 'exp_month': 12},
+            'metadata': {'order_id': '42'},
+            'expand': ['customer', 'invoice'],
+            'items': [{'sku': 'a', 'quantity': 1}, {'sku': 'b'}],
+            'capture': False,
+        })
+
+
+class EmulatorTests(StripeTestCase):
+    async def test_charge_lifecycle(self):
+        async with StripeEmulator():
+            charge = await aiostripe.Charge.create(**DUMMY_CHARGE)
+            self.assertIsInstance(charge, aiostripe.Charge)
+            self.assertEqual(charge.amount, 100)
+            self.assertFalse(charge.refunded)
+
+            await charge.refund()
+            self.assertTrue(charge.refunded)
+
+            charge2 = await aiostripe.Charge.retrieve(charge.id)
+            self.assertEqual(charge2.created, charge.created)
+            self.assertTrue(charge2.refunded)
+
+            charge2.description = 'updated'
+            await charge2.save()
+            self.assertEqual((await aiostripe.Charge.retrieve(charge.id)).description, 'updated')
+
+    async def test_customer_crud(self):
+        async with StripeEmulator():
+            customer = await aiostripe.Customer.create(card=DUMMY_CARD, email='foo@example.com',
+                                                       metadata={'order_id': '42'})
+            self.assertEqual(customer.sources.data[0].last4, '4242')
+
+            customer = await aiostripe.Customer.retrieve(customer.id)
+            self.assertEqual(customer.metadata.order_id, '42')
+
+            await customer.delete()
+            self.assertTrue(customer.deleted)
+
+            await self.assertRaisesAsync(aiostripe.error.InvalidRequestError, aiostripe.Customer.retrieve,
+                                         customer.id)
+
+    async def test_auto_paging(self):
+        async with StripeEmulator() as emulator:
+            for i in range(25):
+                emulator.add('customers', {'email': 'c%d@example.com' % i})
+
+            page = await aiostripe.Customer.list(limit=10)
+            self.assertEqual(len(page.data), 10)
+            self.assertTrue(page.has_more)
+
+            seen = []
+            async for customer in aiostripe.Customer.auto_paging_iter(limit=10):
+                seen.append(customer.id)
+
+            self.assertEqual(len(seen), 25)
+            self.assertEqual(len(set(seen)), 25)
+            self.assertEqual(emulator.request_count, 1 + 3)
+
+    async def test_expand(self):
+        async with StripeEmulator():
+            customer = await aiostripe.Customer.create(card=DUMMY_CARD)
+            await aiostripe.Charge.create(amount=100, currency='usd', customer=customer.id)
+
+            charges = await aiostripe.Charge.list(expand=['data.customer'])
+            self.assertIsInstance(charges.data[0].customer, aiostripe.Customer)
+            self.assertEqual(charges.data[0].customer.id, customer.id)
+
+    async def test_events(self):
+        async with StripeEmulator():
+            customer = await aiostripe.Customer.create(email='foo@example.com')
+            customer.email = 'bar@example.com'
+            await customer.save()
+
+            events = await aiostripe.Event.list()
+            self.assertEqual([e.type for e in events.data], ['customer.updated', 'customer.created'])
+            self.assertEqual(events.data[0].data.object.email, 'bar@example.com')
+            self.assertEqual(events.data[0].data.previous_attributes.email, 'foo@example.com')
+
+    async def test_file_upload(self):
+        async with StripeEmulator():
+            with tempfile.NamedTemporaryFile(suffix='.pdf') as f:
+                f.write(b'%PDF' + b'\0' * 1000)
+                f.flush()
+                f.seek(0)
+
+                upload = await aiostripe.FileUpload.create(purpose='dispute_evidence', file=f)
+
+            self.assertIsInstance(upload, aiostripe.FileUpload)
+            self.assertEqual(upload.size, 1004)
+            self.assertEqual(upload.type, 'pdf')
+
+    async def test_errors(self):
+        async with StripeEmulator(latency=0.001) as emulator:
+            await self.assertRaisesAsync(aiostripe.error.InvalidRequestError, aiostripe.Charge.create, currency='usd',
+                                         card=DUMMY_CARD)
+
+            declined = dict(DUMMY_CARD, number='4000000000000002')
+            with self.assertRaises(aiostripe.error.CardError) as cm:
+                await aiostripe.Charge.create(amount=100, currency='usd', card=declined)
+            self.assertEqual(cm.exception.code, 'card_declined')
+            self.assertEqual(cm.exception.http_status, 402)
+
+            emulator.inject_error(429)
+            await self.assertRaisesAsync(aiostripe.error.RateLimitError, aiostripe.Plan.create, **DUMMY_PLAN)
+            await aiostripe.Plan.create(**DUMMY_PLAN)
+
+    async def test_rate_limit(self):
+        async with StripeEmulator(rate_limit=2):
+            await aiostripe.Balance.retrieve()
+            await aiostripe.Balance.retrieve()
+            await self.assertRaisesAsync(aiostripe.error.RateLimitError, aiostripe.Balance.retrieve)
+
+    async def test_accounts_are_isolated(self):
+        async with StripeEmulator():
+            await aiostripe.Customer.create(stripe_account='acct_1')
+
+            self.assertEqual(len((await aiostripe.Customer.list(stripe_account='acct_1')).data), 1)
+            self.assertEqual(len((await aiostripe.Customer.list()).data), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
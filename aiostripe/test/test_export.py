@@ -0,0 +1,175 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+
+import aiostripe
+from aiostripe.export import Exporter, partition, resource_class, timestamp
+from aiostripe.test.emulator import StripeEmulator
+from aiostripe.test.helper import StripeTestCase
+
+
+class HelperTests(unittest.TestCase):
+    def test_resource_class(self):
+        self.assertIs(resource_class('charges'), aiostripe.Charge)
+        self.assertIs(resource_class('charge'), aiostripe.Charge)
+        self.assertIs(resource_class('invoiceitems'), aiostripe.InvoiceItem)
+        self.assertRaises(ValueError, resource_class, 'balance')
+
+    def test_timestamp(self):
+        self.assertEqual(timestamp('1485820800'), 1485820800)
+        self.assertEqual(timestamp('2017-01-31'), 1485820800)
+        self.assertEqual(timestamp('2017-01-31T00:01:00'), 1485820860)
+        self.assertRaises(ValueError, timestamp, 'yesterday')
+
+    def test_partition(self):
+        self.assertEqual(partition(0, 10, 3), [(0, 4), (4, 8), (8, 10)])
+        self.assertEqual(partition(0, 2, 4), [(0, 1), (1, 2)])
+
+
+class ExporterTests(StripeTestCase):
+    def setUp(self):
+        super().setUp()
+
+        fd, self.path = tempfile.mkstemp(suffix='.ndjson')
+        os.close(fd)
+
+    def tearDown(self):
+        for path in (self.path, self.path + '.checkpoint'):
+            if os.path.exists(path):
+                os.unlink(path)
+
+        super().tearDown()
+
+    async def populate(self, count=5):
+        ids = []
+        for i in range(count):
+            customer = await aiostripe.Customer.create(description='customer %d' % i, metadata={'n': str(i)})
+            ids.append(customer.id)
+
+        return ids
+
+    def read_lines(self, compressed=False):
+        with (gzip.open if compressed else open)(self.path, 'rb') as f:
+            return f.read().decode('utf-8').splitlines()
+
+    async def test_ndjson(self):
+        async with StripeEmulator():
+            ids = await self.populate()
+
+            reports = []
+            stats = await Exporter(aiostripe.Customer, self.path, page_size=2).run(reports.append, interval=60)
+
+            exported = [json.loads(line) for line in self.read_lines()]
+            self.assertEqual(sorted(obj['id'] for obj in exported), sorted(ids))
+            self.assertEqual(stats['items'], 5)
+            self.assertEqual(stats['bytes'], os.path.getsize(self.path))
+            self.assertEqual(reports, [stats])
+            self.assertFalse(os.path.exists(self.path + '.checkpoint'))
+
+    async def test_csv_gzip_partitioned(self):
+        async with StripeEmulator():
+            ids = await self.populate()
+
+            now = int(time.time())
+            exporter = Exporter(aiostripe.Customer, self.path, format='csv', fields=['id', 'metadata.n'],
+                                compress=True, created_gte=now - 60, created_lt=now + 60, partitions=4, page_size=2)
+            await exporter.run()
+
+            rows = list(csv.reader(io.StringIO('\n'.join(self.read_lines(compressed=True)))))
+            self.assertEqual(rows[0], ['id', 'metadata.n'])
+            self.assertEqual(sorted(rows[1:]), sorted([id, str(i)] for i, id in enumerate(ids)))
+
+    async def test_created_filter(self):
+        async with StripeEmulator():
+            await self.populate()
+
+            await Exporter(aiostripe.Customer, self.path, created_lt=int(time.time()) - 60).run()
+
+            self.assertEqual(self.read_lines(), [])
+
+    async def test_resume(self):
+        async with StripeEmulator():
+            ids = await self.populate()
+
+            exporter = Exporter(aiostripe.Customer, self.path, page_size=2)
+            write = exporter._write
+            pages = []
+
+            def crash(objects, partition, last_id, done=False):
+                if pages:
+                    # a page half written when the process dies
+                    exporter._file.write(b'{"id": "cus_')
+                    raise RuntimeError('crash')
+
+                pages.append(objects)
+                write(objects, partition, last_id, done)
+
+            exporter._write = crash
+            await self.assertRaisesAsync(RuntimeError, exporter.run)
+
+            self.assertTrue(os.path.exists(self.path + '.checkpoint'))
+
+            stats = await Exporter(aiostripe.Customer, self.path, page_size=2).run()
+
+            exported = [json.loads(line)['id'] for line in self.read_lines()]
+            self.assertEqual(sorted(exported), sorted(ids))
+            self.assertEqual(stats['items'], 3)
+
+            with open(self.path + '.checkpoint', 'w') as f:
+                json.dump({'query': {}}, f)
+            exporter = Exporter(aiostripe.Customer, self.path, page_size=2)
+            await self.assertRaisesAsync(ValueError, exporter.run)
+
+    async def test_partition_failure(self):
+        async with StripeEmulator(latency=0.01) as emulator:
+            for i in range(10):
+                emulator.add('customers', {'created': 1000 + i})
+
+            loop = asyncio.get_event_loop()
+            problems = []
+            loop.set_exception_handler(lambda loop, context: problems.append(context))
+
+            exporter = Exporter(aiostripe.Customer, self.path, created_gte=1000, created_lt=1010, partitions=2,
+                                page_size=1)
+            write = exporter._write
+            export = exporter._export
+            writes = []
+            running = []
+
+            def fail(objects, partition, last_id, done=False):
+                writes.append(partition['gte'])
+                if partition['gte'] == 1000 and writes.count(1000) == 2:
+                    raise RuntimeError('disk full')
+
+                write(objects, partition, last_id, done)
+
+            async def track(partition):
+                running.append(partition['gte'])
+                try:
+                    await export(partition)
+                finally:
+                    running.remove(partition['gte'])
+
+            exporter._write = fail
+            exporter._export = track
+
+            try:
+                await self.assertRaisesAsync(RuntimeError, exporter.run)
+
+                # the other partition stopped along with the failed one
+                self.assertEqual(running, [])
+                written = len(writes)
+
+                await asyncio.sleep(0.1)
+            finally:
+                loop.set_exception_handler(None)
+
+            self.assertEqual(len(writes), written)
+            self.assertEqual(problems, [])
+            self.assertTrue(exporter._file.closed)
@@ -1,11 +1,18 @@
+import asyncio
+import gc
+import os
+import ssl
 import unittest
 import warnings
+import zlib
 
 import aiostripe
 import aiostripe.api_requestor
 import aiostripe.error
 import aiostripe.http_client
-from aiostripe.test.helper import Mock, AsyncMock, StripeUnitTestCase, deasyncify
+import aiostripe.instrumentation
+from aiostripe.test.emulator import StripeEmulator
+from aiostripe.test.helper import Mock, AsyncMock, StripeTestCase, StripeUnitTestCase, deasyncify
 
 VALID_API_METHODS = ('get', 'post', 'delete')
 
@@ -33,6 +40,28 @@ class HttpClientTests(StripeUnitTestCase):
     def test_new_default_http_client_asyncio(self):
         self.check_default((), aiostripe.http_client.AsyncioClient)
 
+    def test_default_http_client_is_shared(self):
+        client = aiostripe.http_client.default_http_client(verify_ssl_certs=True)
+
+        self.assertIs(aiostripe.http_client.default_http_client(verify_ssl_certs=True), client)
+        self.assertIsNot(aiostripe.http_client.default_http_client(verify_ssl_certs=False), client)
+
+
+class SSLContextTests(unittest.TestCase):
+    def test_verifying_context(self):
+        context = aiostripe.http_client.new_ssl_context(verify_ssl_certs=True)
+
+        self.assertEqual(context.verify_mode, ssl.CERT_REQUIRED)
+        self.assertTrue(context.check_hostname)
+        self.assertGreater(context.cert_store_stats()['x509_ca'], 0)
+
+    def test_non_verifying_context(self):
+        context = aiostripe.http_client.new_ssl_context(verify_ssl_certs=False)
+
+        self.assertEqual(context.verify_mode, ssl.CERT_NONE)
+        self.assertFalse(context.check_hostname)
+        self.assertEqual(context.cert_store_stats()['x509_ca'], 0)
+
 
 class ClientTestBase:
     request_client = NotImplemented
@@ -92,20 +121,6 @@ class RequestsVerify(object):
         return other and other.endswith('stripe/data/ca-certificates.crt')
 
 
-class ContextManagerMock(Mock):
-    def __enter__(self, *args, **kwargs):
-        def default(*args, **kwargs):
-            return type(self)(*args, **kwargs)
-
-        return self.__dict__.get('__enter__', default)(*args, **kwargs)
-
-    def __exit__(self, *args, **kwargs):
-        def default(*args, **kwargs):
-            return None
-
-        return self.__dict__.get('__exit__', default)(*args, **kwargs)
-
-
 class AsyncContextManagerMock(Mock):
     async def __aenter__(self, *args, **kwargs):
         async def default(*args, **kwargs):
@@ -134,11 +149,9 @@ class AsyncioClientTests(StripeUnitTestCase, ClientTestBase):
 
         mock_session = mock._mock_session = Mock(name='session')
         mock_session.request = Mock(return_value=mock_response_ctx)
+        mock_session.closed = False
 
-        mock_session_ctx = mock._mock_session_ctx = ContextManagerMock(name='ClientSession(...)')
-        mock_session_ctx.__enter__ = Mock(return_value=mock_session)
-
-        mock.ClientSession = Mock(name='ClientSession', return_value=mock_session_ctx)
+        mock.ClientSession = Mock(name='ClientSession', return_value=mock_session)
 
     def mock_error(self, mock):
         mock.exceptions.RequestException = Exception
@@ -148,19 +161,207 @@ class AsyncioClientTests(StripeUnitTestCase, ClientTestBase):
 
         mock_session = mock._mock_session = Mock(name='session')
         mock_session.request = Mock(return_value=mock_response_ctx)
+        mock_session.closed = False
+
+        mock.ClientSession = Mock(name='ClientSession', return_value=mock_session)
 
-        mock_session_ctx = mock._mock_session_ctx = ContextManagerMock(name='ClientSession(...)')
-        mock_session_ctx.__enter__ = Mock(return_value=mock_session)
+    @deasyncify
+    async def test_session_is_shared(self):
+        self.mock_response(self.request_mock, '{}', 200)
 
-        mock.ClientSession = Mock(name='ClientSession', return_value=mock_session_ctx)
+        client = self.request_client(verify_ssl_certs=True)
+        await client.request('get', self.valid_url, {}, None)
+        await client.request('post', self.valid_url, {}, '')
+
+        self.assertEqual(self.request_mock.ClientSession.call_count, 1)
+        self.request_mock.TCPConnector.assert_called_once_with(ssl=client.ssl_context, keepalive_timeout=15.0,
+                                                              resolver=client._resolver, use_dns_cache=False)
+        self.assertEqual(self.request_mock._mock_session.request.call_count, 2)
+        self.assertEqual(client.stats()['sessions'], 1)
+        self.assertEqual(client.stats()['handshakes'], 0)
 
     def check_call(self, mock, meth, url, post_data, headers):
-        args, kwargs = mock.ClientSession.call_args
-        self.assertEqual(HeadersMatcher(kwargs['headers']), headers)
-        mock._mock_session.request.assert_called_with(MethMatcher(meth), url, data=DataMatcher(post_data))
+        headers = dict(headers, **{'Accept-Encoding': aiostripe.http_client.ACCEPT_ENCODING})
+        mock._mock_session.request.assert_called_with(MethMatcher(meth), url, data=DataMatcher(post_data),
+                                                      headers=HeadersMatcher(headers))
         mock._mock_response.read.assert_called_with()
 
 
+class WarmupTests(StripeTestCase):
+    async def test_warmup(self):
+        timings = []
+        client = aiostripe.http_client.AsyncioClient()
+
+        async with StripeEmulator():
+            self.assertEqual(await client.warmup(3), 3)
+
+            aiostripe.instrumentation.add_callback(timings.append)
+            try:
+                requestor = aiostripe.api_requestor.APIRequestor(client=client)
+                await asyncio.gather(*[requestor.request('get', '/v1/charges') for _ in range(3)])
+            finally:
+                aiostripe.instrumentation.remove_callback(timings.append)
+
+        await client.close()
+
+        self.assertEqual(len(timings), 3)
+        for timing in timings:
+            self.assertNotIn('connect', timing.phases)
+
+    async def test_warmup_failure(self):
+        client = aiostripe.http_client.AsyncioClient()
+
+        async with StripeEmulator() as emulator:
+            url = emulator.url
+
+        original, aiostripe.api_base = aiostripe.api_base, url
+        try:
+            self.assertEqual(await client.warmup(2), 0)
+        finally:
+            aiostripe.api_base = original
+            await client.close()
+
+    async def test_keep_alive_manager(self):
+        client = Mock(aiostripe.http_client.AsyncioClient)
+        client.warmup = AsyncMock(return_value=2)
+
+        async with aiostripe.http_client.KeepAliveManager(client, min_idle=2, interval=0.01, upload=True) as manager:
+            self.assertTrue(manager.running)
+            await asyncio.sleep(0.05)
+
+        self.assertFalse(manager.running)
+        self.assertGreaterEqual(client.warmup.call_count, 3)
+        client.warmup.assert_called_with(2, True)
+
+
+class SessionTests(unittest.TestCase):
+    def setUp(self):
+        self.client = aiostripe.http_client.AsyncioClient()
+        self.loops = []
+
+    def tearDown(self):
+        for loop in self.loops:
+            if not loop.is_closed():
+                loop.close()
+
+        asyncio.set_event_loop(asyncio.new_event_loop())
+
+    def run_in(self, loop, coro):
+        asyncio.set_event_loop(loop)
+
+        return loop.run_until_complete(coro)
+
+    def new_loop(self):
+        loop = asyncio.new_event_loop()
+        self.loops.append(loop)
+
+        return loop
+
+    async def get_session(self):
+        return self.client._get_session()
+
+    def check_loop_change(self, close_first):
+        first_loop, second_loop = self.new_loop(), self.new_loop()
+
+        first = self.run_in(first_loop, self.get_session())
+        if close_first:
+            first_loop.close()
+
+        second = self.run_in(second_loop, self.get_session())
+        self.assertIsNot(second, first)
+        self.assertIs(self.run_in(second_loop, self.get_session()), second)
+
+        if not close_first:
+            # the session of the first loop is closed the next time that loop runs
+            self.run_in(first_loop, asyncio.sleep(0.01))
+
+        self.assertTrue(first.closed)
+
+        self.run_in(second_loop, self.client.close())
+        self.assertTrue(second.closed)
+
+    def test_loop_change(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.check_loop_change(close_first=True)
+            self.check_loop_change(close_first=False)
+            gc.collect()
+
+        self.assertEqual([str(w.message) for w in caught if 'Unclosed' in str(w.message)], [])
+
+
+class TLSResumptionTests(StripeTestCase):
+    cert_path = os.path.join(os.path.dirname(__file__), 'localhost.pem')
+
+    @unittest.skipIf(not hasattr(ssl.SSLObject, 'session'), 'TLS session resumption needs Python 3.6')
+    async def test_resumption(self):
+        server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_context.load_cert_chain(self.cert_path)
+        client = aiostripe.http_client.AsyncioClient(ca_bundle_path=self.cert_path)
+
+        headers = {'Authorization': 'Bearer %s' % aiostripe.api_key, 'Connection': 'close'}
+
+        async with StripeEmulator(ssl_context=server_context) as emulator:
+            try:
+                for _ in range(3):
+                    # a connection per request, each of them with a TLS handshake
+                    rbody, rcode, rheaders = await client.request('get', emulator.url + '/v1/charges', headers)
+                    self.assertEqual(rcode, 200)
+
+                stats = client.stats()
+            finally:
+                await client.close()
+
+        self.assertEqual(stats['handshakes'], 3)
+        self.assertEqual(stats['resumed_handshakes'], 2)
+
+
+class CompressionTests(StripeTestCase):
+    def test_decoders(self):
+        data = b'{"object": "list", "data": []}' * 100
+
+        compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+        gzipped = compressor.compress(data) + compressor.flush()
+        raw = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        raw_deflated = raw.compress(data) + raw.flush()
+
+        for encoding, body in (('gzip', gzipped), ('deflate', zlib.compress(data)), ('Deflate', raw_deflated)):
+            decoder = aiostripe.http_client.new_decoder(encoding)
+            decoded = b''.join(decoder.decompress(body[i:i + 100]) for i in range(0, len(body), 100))
+            self.assertEqual(decoded + decoder.flush(), data)
+
+        self.assertIsNone(aiostripe.http_client.new_decoder('identity'))
+
+    async def test_compressed_response(self):
+        timings = []
+        client = aiostripe.http_client.AsyncioClient()
+
+        async with StripeEmulator(compress=True) as emulator:
+            for i in range(20):
+                emulator.add('charges', {'amount': 100 + i, 'currency': 'usd', 'description': 'charge %d' % i})
+
+            aiostripe.instrumentation.add_callback(timings.append)
+            try:
+                requestor = aiostripe.api_requestor.APIRequestor(client=client)
+                response, _ = await requestor.request('get', '/v1/charges', {'limit': 20})
+                await asyncio.sleep(0)
+            finally:
+                aiostripe.instrumentation.remove_callback(timings.append)
+
+        await client.close()
+
+        self.assertEqual(len(response['data']), 20)
+
+        timing, = timings
+        self.assertIn(timing.content_encoding, ('gzip', 'deflate'))
+        self.assertLess(timing.bytes_received, timing.bytes_decoded)
+        self.assertIn('decompress', timing.phases)
+
+        stats = client.stats()
+        self.assertEqual((stats['bytes_received'], stats['bytes_decoded']),
+                         (timing.bytes_received, timing.bytes_decoded))
+
+
 class HeadersMatcher(object):
     def __init__(self, expected):
         self.expected = expected
@@ -0,0 +1,97 @@
+import aiostripe
+from aiostripe.identity import IdentityMap
+from aiostripe.test.emulator import StripeEmulator
+from aiostripe.test.helper import StripeTestCase, DUMMY_CARD
+
+
+class IdentityMapTests(StripeTestCase):
+    async def create_charges(self, customers=2, charges=3):
+        ids = []
+        for i in range(customers):
+            customer = await aiostripe.Customer.create(card=DUMMY_CARD)
+            ids.append(customer.id)
+
+            for j in range(charges):
+                await aiostripe.Charge.create(amount=100 + j, currency='usd', customer=customer.id)
+
+        return ids
+
+    async def test_list(self):
+        async with StripeEmulator():
+            await self.create_charges()
+
+            page = await aiostripe.Charge.list(expand=['data.customer'], identity_map=True)
+            customers = [charge.customer for charge in page]
+
+            self.assertEqual(len(set(map(id, customers))), 2)
+            self.assertEqual(len(set(c.id for c in customers)), 2)
+
+            page = await aiostripe.Charge.list(expand=['data.customer'])
+            self.assertEqual(len(set(map(id, [charge.customer for charge in page]))), 6)
+
+    async def test_read_only(self):
+        async with StripeEmulator():
+            await self.create_charges(customers=1, charges=1)
+
+            page = await aiostripe.Charge.list(expand=['data.customer'], identity_map=True)
+            charge = page.data[0]
+
+            with self.assertRaises(TypeError):
+                charge.customer.description = 'changed'
+            with self.assertRaises(TypeError):
+                del charge.customer['email']
+            await self.assertRaisesAsync(TypeError, charge.customer.delete)
+
+            # a retrieved copy can be changed
+            customer = await aiostripe.Customer.retrieve(charge.customer.id)
+            customer.description = 'changed'
+            await customer.save()
+
+            # the listed objects themselves are not shared
+            charge.metadata = {'note': 'changed'}
+            await charge.save()
+            self.assertEqual(charge.metadata.note, 'changed')
+
+    async def test_paging_session(self):
+        async with StripeEmulator():
+            ids = await self.create_charges()
+
+            for stream in (False, True):
+                identity_map = IdentityMap()
+                customers = {}
+
+                async for charge in aiostripe.Charge.auto_paging_iter(limit=2, expand=['data.customer'],
+                                                                      identity_map=identity_map, stream=stream):
+                    customers.setdefault(charge.customer.id, set()).add(id(charge.customer))
+
+                self.assertEqual(sorted(customers), sorted(ids))
+                self.assertEqual([len(instances) for instances in customers.values()], [1, 1])
+                # each customer was converted once, then shared with its two other charges
+                self.assertGreaterEqual(identity_map.stats['shared'], 4)
+
+    async def test_bounded(self):
+        async with StripeEmulator():
+            await self.create_charges(charges=2)
+
+            sizes = []
+            for _ in range(2):
+                identity_map = IdentityMap()
+                charges = []
+
+                for stream in (False, True):
+                    async for charge in aiostripe.Charge.auto_paging_iter(limit=2, expand=['data.customer'],
+                                                                          identity_map=identity_map, stream=stream):
+                        charges.append(charge)
+
+                sizes.append((len(charges), len(identity_map)))
+                self.assertNotIn(charges[0], identity_map._objects.values())
+                charges[0].metadata = {'note': 'changed'}
+
+                # twice as many charges of the same customers
+                for customer in {charge.customer.id for charge in charges}:
+                    await aiostripe.Charge.create(amount=100, currency='usd', customer=customer)
+                    await aiostripe.Charge.create(amount=200, currency='usd', customer=customer)
+
+            self.assertEqual([count for count, size in sizes], [8, 16])
+            # the map holds the customers and their cards, however many charges were listed
+            self.assertEqual(sizes[0][1], sizes[1][1])
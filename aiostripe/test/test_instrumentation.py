@@ -0,0 +1,91 @@
+import asyncio
+import unittest
+
+import aiostripe
+import aiostripe.error
+from aiostripe import api_requestor, instrumentation
+from aiostripe.test.emulator import StripeEmulator
+from aiostripe.test.helper import StripeTestCase, DUMMY_CHARGE
+
+
+class NormalizePathTests(unittest.TestCase):
+    def test_normalize_path(self):
+        self.assertEqual(instrumentation.normalize_path('/v1/customers/cus_123/sources/card_456'),
+                         '/v1/customers/{id}/sources/{id}')
+        self.assertEqual(instrumentation.normalize_path('/v1/charges/ch_123/dispute/close'),
+                         '/v1/charges/{id}/dispute/close')
+        self.assertEqual(instrumentation.normalize_path('/v1/invoices/upcoming'), '/v1/invoices/upcoming')
+        self.assertEqual(instrumentation.normalize_path('/v1/plans/gold'), '/v1/plans/{id}')
+
+
+class RequestTimingTests(StripeTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.timings = []
+        instrumentation.add_callback(self.timings.append)
+
+    def tearDown(self):
+        instrumentation.remove_callback(self.timings.append)
+
+        super().tearDown()
+
+    async def test_successful_request(self):
+        async with StripeEmulator():
+            charge = await aiostripe.Charge.create(**DUMMY_CHARGE)
+            await aiostripe.Charge.retrieve(charge.id)
+
+        self.assertEqual(len(self.timings), 2)
+
+        create, retrieve = self.timings
+        self.assertEqual((create.method, create.path_template, create.status), ('POST', '/v1/charges', 200))
+        self.assertEqual((retrieve.method, retrieve.path, retrieve.path_template),
+                         ('GET', '/v1/charges/%s' % charge.id, '/v1/charges/{id}'))
+        self.assertTrue(retrieve.request_id.startswith('req_'))
+        self.assertEqual(retrieve.retries, 0)
+        self.assertIsNone(retrieve.error)
+
+        # the second request reuses the connection of the first
+        self.assertIn('connect', create.phases)
+        self.assertNotIn('connect', retrieve.phases)
+        for phase in ('encode', 'wait', 'read', 'decode', 'convert'):
+            self.assertIn(phase, retrieve.phases)
+        self.assertLessEqual(sum(retrieve.phases.values()), retrieve.duration)
+
+    async def test_failed_request(self):
+        async with StripeEmulator():
+            await self.assertRaisesAsync(aiostripe.error.InvalidRequestError, aiostripe.Customer.retrieve,
+                                         'cus_missing')
+
+        timing, = self.timings
+        self.assertEqual(timing.status, 404)
+        self.assertEqual(timing.error, 'InvalidRequestError')
+        self.assertIn('decode', timing.phases)
+        self.assertNotIn('convert', timing.phases)
+
+    async def test_unconverted_request(self):
+        async with StripeEmulator():
+            response, _ = await api_requestor.APIRequestor().request('get', '/v1/charges', {'limit': 1})
+            self.assertEqual(response['object'], 'list')
+
+            # finished once the event loop is done with the step the response was returned in
+            self.assertEqual(self.timings, [])
+            await asyncio.sleep(0)
+
+        timing, = self.timings
+        self.assertEqual(timing.path, '/v1/charges')
+        self.assertIn('decode', timing.phases)
+        self.assertNotIn('convert', timing.phases)
+
+    async def test_failing_callback(self):
+        def fail(timing):
+            raise ValueError(timing)
+
+        instrumentation.add_callback(fail)
+        try:
+            async with StripeEmulator():
+                await aiostripe.Charge.create(**DUMMY_CHARGE)
+        finally:
+            instrumentation.remove_callback(fail)
+
+        self.assertEqual(len(self.timings), 1)
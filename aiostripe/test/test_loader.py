@@ -0,0 +1,102 @@
+import asyncio
+import unittest
+
+import aiostripe
+import aiostripe.loader
+from aiostripe.loader import Loader
+from aiostripe.test.emulator import StripeEmulator
+from aiostripe.test.helper import StripeTestCase, DUMMY_CARD
+
+
+class FakeResource(dict):
+    retrieved = []
+    running = 0
+    most_running = 0
+
+    @classmethod
+    async def retrieve(cls, id, api_key=None, stripe_account=None):
+        cls.retrieved.append(id)
+        cls.running += 1
+        cls.most_running = max(cls.most_running, cls.running)
+
+        try:
+            await asyncio.sleep(0.01)
+        finally:
+            cls.running -= 1
+
+        if id == 'missing':
+            raise aiostripe.error.InvalidRequestError('No such object: %s' % id, 'id', http_status=404)
+
+        return cls(id=id)
+
+
+class LoaderTests(StripeTestCase):
+    def setUp(self):
+        super().setUp()
+
+        FakeResource.retrieved = []
+        FakeResource.most_running = 0
+
+    async def test_deduplication(self):
+        loader = Loader(max_concurrency=2)
+
+        objects = await asyncio.gather(*[loader.load(FakeResource, id) for id in ['a', 'b', 'a', 'c', 'b', 'd']])
+
+        self.assertEqual([o['id'] for o in objects], ['a', 'b', 'a', 'c', 'b', 'd'])
+        self.assertIs(objects[0], objects[2])
+        self.assertEqual(sorted(FakeResource.retrieved), ['a', 'b', 'c', 'd'])
+        self.assertEqual(FakeResource.most_running, 2)
+
+        # memoised for the rest of the scope
+        self.assertIs(await loader.load(FakeResource, 'a'), objects[0])
+        self.assertEqual(len(FakeResource.retrieved), 4)
+        self.assertEqual(loader.stats, {'loads': 7, 'deduplicated': 3, 'retrieves': 4})
+
+    async def test_errors(self):
+        loader = Loader()
+
+        for _ in range(2):
+            await self.assertRaisesAsync(aiostripe.error.InvalidRequestError, loader.load, FakeResource, 'missing')
+
+        self.assertEqual(FakeResource.retrieved, ['missing', 'missing'])
+
+    async def test_prime_and_clear(self):
+        loader = Loader()
+        loader.prime(FakeResource(id='a'))
+
+        self.assertEqual(await loader.load(FakeResource, 'a'), {'id': 'a'})
+        self.assertEqual(FakeResource.retrieved, [])
+
+        loader.clear(FakeResource, 'a')
+        await loader.load(FakeResource, 'a')
+        self.assertEqual(FakeResource.retrieved, ['a'])
+
+    @unittest.skipIf(aiostripe.loader.contextvars is None, 'contextvars needs Python 3.7')
+    async def test_current(self):
+        self.assertIsNone(aiostripe.loader.current())
+
+        async with Loader() as loader:
+            self.assertIs(aiostripe.loader.current(), loader)
+
+        self.assertIsNone(aiostripe.loader.current())
+
+    async def test_resolve(self):
+        async with StripeEmulator() as emulator:
+            customer = await aiostripe.Customer.create(card=DUMMY_CARD)
+            for i in range(3):
+                await aiostripe.Charge.create(amount=100 + i, currency='usd', customer=customer.id)
+
+            async with Loader() as loader:
+                charges = await aiostripe.Charge.list()
+                customers = await asyncio.gather(*[loader.resolve(charge, 'customer', aiostripe.Customer)
+                                                   for charge in charges])
+
+            self.assertEqual([c.id for c in customers], [customer.id] * 3)
+            self.assertEqual(sum(1 for method, path in emulator.request_log
+                                 if path == '/v1/customers/%s' % customer.id), 1)
+
+            loader = Loader()
+            expanded = await aiostripe.Charge.list(expand=['data.customer'])
+            self.assertIsInstance(await loader.resolve(expanded.data[0], 'customer', aiostripe.Customer),
+                                  aiostripe.Customer)
+            self.assertIs(await loader.load(aiostripe.Customer, customer.id), expanded.data[0].customer)
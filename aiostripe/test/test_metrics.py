@@ -0,0 +1,133 @@
+import json
+import unittest
+
+import aiostripe
+import aiostripe.error
+from aiostripe import instrumentation, metrics
+from aiostripe.test.emulator import StripeEmulator
+from aiostripe.test.helper import StripeTestCase, DUMMY_CHARGE
+
+
+def make_timing(path, status=200, error=None, duration=0.01, phases=None):
+    timing = instrumentation.RequestTiming('get', path)
+    timing.status = status
+    timing.error = error
+    timing.duration = duration
+    timing.phases = phases or {}
+
+    return timing
+
+
+class LegacyClient(object):
+    """A client written against the original `request(method, url, headers, post_data=None)` signature."""
+
+    name = 'legacy'
+
+    async def request(self, method, url, headers, post_data=None):
+        return json.dumps({'id': 'ch_legacy', 'object': 'charge'}), 200, {'request-id': 'req_legacy'}
+
+
+class MetricsRegistryTests(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.registry = metrics.MetricsRegistry()
+
+    def test_record(self):
+        self.registry.record(make_timing('/v1/customers/cus_1', duration=0.002, phases={'wait': 0.001}))
+        self.registry.record(make_timing('/v1/customers/cus_2', duration=0.2))
+        self.registry.record(make_timing('/v1/charges', status=402, error='CardError'))
+
+        snapshot = self.registry.snapshot()
+
+        customers = (('endpoint', '/v1/customers/{id}'), ('method', 'GET'), ('status', '2xx'), ('error', ''))
+        declined = (('endpoint', '/v1/charges'), ('method', 'GET'), ('status', '4xx'), ('error', 'CardError'))
+        self.assertEqual(snapshot.counters[(metrics.REQUESTS, customers)], 2)
+        self.assertEqual(snapshot.counters[(metrics.REQUESTS, declined)], 1)
+
+        histogram = snapshot.histograms[(metrics.DURATION, customers)]
+        self.assertEqual(histogram.count, 2)
+        self.assertAlmostEqual(histogram.sum, 0.202)
+        self.assertEqual(histogram.quantile(0.5), 0.002)
+        self.assertEqual(histogram.quantile(1), 0.256)
+
+        phase = (('endpoint', '/v1/customers/{id}'), ('method', 'GET'), ('phase', 'wait'))
+        self.assertEqual(snapshot.histograms[(metrics.PHASE_DURATION, phase)].count, 1)
+
+    def test_merge(self):
+        other = metrics.MetricsRegistry()
+
+        self.registry.record(make_timing('/v1/charges'))
+        other.record(make_timing('/v1/charges'))
+        other.record(make_timing('/v1/plans'))
+
+        mine = self.registry.snapshot()
+        merged = mine.merge(other.snapshot())
+
+        charges = (('endpoint', '/v1/charges'), ('method', 'GET'), ('status', '2xx'), ('error', ''))
+        self.assertEqual(merged.counters[(metrics.REQUESTS, charges)], 2)
+        self.assertEqual(merged.histograms[(metrics.DURATION, charges)].count, 2)
+        self.assertEqual(len(merged.counters), 2)
+
+        # merging leaves the inputs alone
+        self.assertEqual(mine.histograms[(metrics.DURATION, charges)].count, 1)
+
+        self.assertEqual(metrics.Snapshot.from_dict(merged.to_dict()).to_prometheus(), merged.to_prometheus())
+
+    def test_prometheus(self):
+        self.registry.record(make_timing('/v1/charges', duration=0.003))
+        text = self.registry.snapshot().to_prometheus()
+
+        self.assertIn('# TYPE aiostripe_requests_total counter\n', text)
+        self.assertIn('aiostripe_requests_total{endpoint="/v1/charges",method="GET",status="2xx",error=""} 1\n', text)
+        self.assertIn('# TYPE aiostripe_request_duration_seconds histogram\n', text)
+        self.assertIn('aiostripe_request_duration_seconds_bucket{endpoint="/v1/charges",method="GET",status="2xx",'
+                      'error="",le="0.002"} 0\n', text)
+        self.assertIn('aiostripe_request_duration_seconds_bucket{endpoint="/v1/charges",method="GET",status="2xx",'
+                      'error="",le="+Inf"} 1\n', text)
+        self.assertIn('aiostripe_request_duration_seconds_count{endpoint="/v1/charges",method="GET",status="2xx",'
+                      'error=""} 1\n', text)
+
+
+class EnableTests(StripeTestCase):
+    def tearDown(self):
+        metrics.disable()
+        metrics.registry = None
+        aiostripe.default_http_client = None
+
+        super().tearDown()
+
+    async def test_enable(self):
+        registry = metrics.enable()
+        self.assertIs(metrics.enable(), registry)
+        self.assertEqual(instrumentation.callbacks.count(registry.record), 1)
+
+        async with StripeEmulator() as emulator:
+            await aiostripe.Charge.create(**DUMMY_CHARGE)
+
+            emulator.inject_error(402)
+            await self.assertRaisesAsync(aiostripe.error.CardError, aiostripe.Charge.create, **DUMMY_CHARGE)
+
+            metrics.disable()
+            await aiostripe.Charge.create(**DUMMY_CHARGE)
+
+        counters = dict((dict(labels)['error'], value) for (name, labels), value in registry.snapshot().counters.items()
+                        if name == metrics.REQUESTS)
+        self.assertEqual(counters, {'': 1, 'CardError': 1})
+
+    async def test_client_without_timing(self):
+        registry = metrics.enable()
+        timings = []
+        instrumentation.add_callback(timings.append)
+        aiostripe.default_http_client = LegacyClient()
+
+        try:
+            charge = await aiostripe.Charge.retrieve('ch_legacy')
+        finally:
+            instrumentation.remove_callback(timings.append)
+
+        self.assertEqual(charge.id, 'ch_legacy')
+        self.assertEqual(sum(value for (name, labels), value in registry.snapshot().counters.items()
+                             if name == metrics.REQUESTS), 1)
+        self.assertEqual(timings[0].request_id, 'req_legacy')
+        self.assertIn('wait', timings[0].phases)
@@ -0,0 +1,302 @@
+import asyncio
+import os
+import tempfile
+import threading
+
+import aiostripe
+from aiostripe.mirror import MemoryStore, Range, SqliteStore, SyncEngine
+from aiostripe.test.emulator import StripeEmulator
+from aiostripe.test.helper import StripeTestCase, DUMMY_PLAN, deasyncify
+
+
+def subscription(id, plan, status, period_end, **values):
+    values.update({'id': id, 'object': 'subscription', 'plan': {'id': plan, 'object': 'plan'}, 'status': status,
+                   'current_period_end': period_end})
+
+    return values
+
+
+class MemoryStoreTests(StripeTestCase):
+    def make_store(self):
+        return MemoryStore()
+
+    def setUp(self):
+        super().setUp()
+
+        self.store = self.make_store()
+        deasyncify(self.populate)()
+
+    async def populate(self):
+        await self.store.add_index('subscription', 'plan')
+        await self.store.add_index('subscription', 'status')
+        await self.store.add_index('subscription', 'current_period_end', sorted=True)
+
+        await self.store.put(subscription('sub_1', 'gold', 'active', 300))
+        await self.store.put(subscription('sub_2', 'gold', 'canceled', 100))
+        await self.store.put(subscription('sub_3', 'silver', 'active', 200))
+        await self.store.put(subscription('sub_4', 'gold', 'active', 400, metadata={'order_id': 'o1'}))
+
+    def tearDown(self):
+        deasyncify(self.store.close)()
+
+        super().tearDown()
+
+    async def ids(self, *args, **kwargs):
+        return [values['id'] for values in await self.store.find('subscription', *args, **kwargs)]
+
+    async def test_equality(self):
+        self.assertEqual(await self.ids({'plan': 'gold', 'status': 'active'}, order_by='id'), ['sub_1', 'sub_4'])
+        self.assertEqual(await self.ids({'plan.id': 'silver'}), ['sub_3'])
+        self.assertEqual(await self.ids({'status': 'past_due'}), [])
+
+    async def test_range(self):
+        self.assertEqual(await self.ids({'current_period_end': Range(200, 400)}, order_by='current_period_end'),
+                         ['sub_3', 'sub_1'])
+        self.assertEqual(await self.ids({'current_period_end': Range(low=200), 'status': 'active'},
+                                        order_by='current_period_end', descending=True, limit=2), ['sub_4', 'sub_1'])
+        await self.assertRaisesAsync(ValueError, self.store.find, 'subscription', {'status': Range('a', 'b')})
+
+    async def test_unindexed_fields(self):
+        self.assertEqual(await self.ids({'metadata.order_id': 'o1'}), ['sub_4'])
+        self.assertEqual(await self.ids({'status': 'active', 'metadata.order_id': 'o1'}), ['sub_4'])
+
+    async def test_incremental_maintenance(self):
+        await self.store.put(subscription('sub_1', 'gold', 'canceled', 300))
+        await self.store.delete('subscription', 'sub_4')
+
+        self.assertEqual(await self.ids({'status': 'canceled'}, order_by='id'), ['sub_1', 'sub_2'])
+        self.assertEqual(await self.ids({'status': 'active'}), ['sub_3'])
+        self.assertEqual(await self.ids({'current_period_end': Range(350)}), [])
+
+    async def test_index_existing_objects(self):
+        await self.store.add_index('subscription', 'metadata.order_id')
+
+        self.assertEqual(await self.ids({'metadata.order_id': 'o1'}), ['sub_4'])
+
+
+class SqliteStoreTests(MemoryStoreTests):
+    def make_store(self):
+        fd, self.path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+
+        return SqliteStore(self.path)
+
+    def tearDown(self):
+        super().tearDown()
+
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.unlink(self.path + suffix)
+
+    async def test_indexes_persist(self):
+        await self.store.commit()
+        await self.store.close()
+
+        self.store = SqliteStore(self.path)
+        await self.store.put(subscription('sub_5', 'gold', 'active', 500))
+
+        self.assertEqual(await self.ids({'current_period_end': Range(400)}, order_by='id'), ['sub_4', 'sub_5'])
+
+    async def test_queries_off_the_loop(self):
+        threads = set()
+        db = self.store._db
+
+        class Connection(object):
+            def __getattr__(self, name):
+                threads.add(threading.current_thread())
+                return getattr(db, name)
+
+        self.store._db = Connection()
+        try:
+            await self.store.put(subscription('sub_5', 'gold', 'active', 500))
+            self.assertEqual(await self.store.count('subscription'), 5)
+        finally:
+            self.store._db = db
+
+        self.assertEqual(len(threads), 1)
+        self.assertNotIn(threading.current_thread(), threads)
+
+
+class SyncEngineTests(StripeTestCase):
+    def setUp(self):
+        super().setUp()
+
+        fd, self.path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+
+    def tearDown(self):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.unlink(self.path + suffix)
+
+        super().tearDown()
+
+    def lists(self, emulator, path):
+        return sum(1 for method, logged in emulator.request_log if method == 'GET' and logged == path)
+
+    async def populate(self):
+        plan = await aiostripe.Plan.create(**DUMMY_PLAN)
+
+        customers = []
+        for i in range(5):
+            customer = await aiostripe.Customer.create(description='customer %d' % i)
+            await customer.subscriptions.create(plan=plan.id)
+            customers.append(customer)
+
+        return customers
+
+    async def test_backfill(self):
+        async with StripeEmulator() as emulator:
+            customers = await self.populate()
+
+            store = MemoryStore()
+            engine = SyncEngine(store, objects=('customer', 'subscription'), page_size=2)
+            await engine.backfill()
+
+            self.assertTrue(await engine.backfilled())
+            self.assertEqual(await store.count('customer'), 5)
+            self.assertEqual(await store.count('subscription'), 5)
+            self.assertEqual((await store.get('customer', customers[0].id))['description'], 'customer 0')
+            # 5 customers, 2 per page
+            self.assertEqual(self.lists(emulator, '/v1/customers'), 3)
+
+    async def test_sync_events(self):
+        async with StripeEmulator():
+            customers = await self.populate()
+
+            store = MemoryStore()
+            engine = SyncEngine(store, objects=('customer', 'subscription'), page_size=2)
+            await engine.backfill()
+
+            customers[0].description = 'changed'
+            await customers[0].save()
+            await customers[1].delete()
+            created = await aiostripe.Customer.create(description='new')
+            subscription = (await aiostripe.Customer.retrieve(customers[2].id)).subscriptions.data[0]
+            await subscription.delete()
+
+            await engine.sync_events()
+
+            self.assertEqual((await store.get('customer', customers[0].id))['description'], 'changed')
+            self.assertIsNone(await store.get('customer', customers[1].id))
+            self.assertEqual((await store.get('customer', created.id))['description'], 'new')
+            self.assertEqual((await store.get('subscription', subscription.id))['status'], 'canceled')
+            self.assertEqual(engine.stats['deleted'], 1)
+
+            # nothing happened since
+            events = engine.stats['events']
+            await engine.sync_events()
+            self.assertEqual(engine.stats['events'], events)
+
+    async def test_sync_events_without_earlier_events(self):
+        async with StripeEmulator():
+            store = MemoryStore()
+            engine = SyncEngine(store, objects=('customer',))
+            await engine.backfill()
+
+            self.assertEqual(await store.get_checkpoint('events.cursor'), '')
+
+            first = await aiostripe.Customer.create(description='first')
+            second = await aiostripe.Customer.create(description='second')
+            second.description = 'changed'
+            await second.save()
+
+            await engine.sync_events()
+
+            self.assertEqual((await store.get('customer', first.id))['description'], 'first')
+            self.assertEqual((await store.get('customer', second.id))['description'], 'changed')
+            self.assertNotEqual(await store.get_checkpoint('events.cursor'), '')
+
+    async def test_restart(self):
+        async with StripeEmulator() as emulator:
+            customers = await self.populate()
+
+            store = SqliteStore(self.path)
+            await SyncEngine(store, objects=('customer',)).backfill()
+            await store.close()
+
+            customers[0].description = 'changed'
+            await customers[0].save()
+
+            store = SqliteStore(self.path)
+            engine = SyncEngine(store, objects=('customer',))
+            await engine.backfill()
+            await engine.sync_events()
+
+            self.assertEqual(self.lists(emulator, '/v1/customers'), 1)
+            self.assertEqual(await store.count('customer'), 5)
+            self.assertEqual((await store.get('customer', customers[0].id))['description'], 'changed')
+            await store.close()
+
+    async def test_resume_backfill(self):
+        async with StripeEmulator():
+            await self.populate()
+
+            ids = []
+            async for customer in aiostripe.Customer.auto_paging_iter(limit=2):
+                ids.append(customer.id)
+
+            # as if an engine had stopped after checkpointing the first page
+            store = MemoryStore()
+            await store.set_checkpoint('events.cursor', '')
+            await store.set_checkpoint('backfill.customer', ids[1])
+
+            engine = SyncEngine(store, objects=('customer',), page_size=2)
+            await engine.backfill()
+
+            self.assertEqual(sorted(values['id'] for values in await store.objects('customer')), sorted(ids[2:]))
+            self.assertEqual(engine.stats['backfilled'], 3)
+
+    async def test_query(self):
+        async with StripeEmulator():
+            customers = await self.populate()
+            customers[0].email = 'someone@example.com'
+            await customers[0].save()
+
+            store = MemoryStore()
+            await store.add_index('customer', 'email')
+            await store.add_index('subscription', 'customer')
+
+            engine = SyncEngine(store, objects=('customer', 'subscription'))
+            await engine.backfill()
+
+            found = await engine.query('customer', {'email': 'someone@example.com'})
+            self.assertEqual([customer.id for customer in found], [customers[0].id])
+            self.assertIsInstance(found[0], aiostripe.Customer)
+
+            subscriptions = await engine.query('subscription', {'customer': customers[1].id})
+            self.assertEqual(len(subscriptions), 1)
+            self.assertIsInstance(subscriptions[0], aiostripe.Subscription)
+
+            customers[1].email = 'someone@example.com'
+            await customers[1].save()
+            await engine.sync_events()
+
+            found = await engine.query('customer', {'email': 'someone@example.com'}, order_by='description')
+            self.assertEqual([customer.id for customer in found], [customers[0].id, customers[1].id])
+            self.assertEqual((await engine.get('customer', customers[1].id)).email, 'someone@example.com')
+
+    async def test_start(self):
+        async with StripeEmulator():
+            customers = await self.populate()
+            store = MemoryStore()
+
+            async with SyncEngine(store, objects=('customer',), interval=0.01) as engine:
+                self.assertTrue(engine.running)
+
+                customers[0].description = 'changed'
+                await customers[0].save()
+
+                for _ in range(100):
+                    values = await store.get('customer', customers[0].id)
+                    if values is not None and values['description'] == 'changed':
+                        break
+                    await asyncio.sleep(0.01)
+
+            self.assertFalse(engine.running)
+            self.assertEqual(await store.count('customer'), 5)
+            self.assertEqual((await store.get('customer', customers[0].id))['description'], 'changed')
+
+    def test_objects_must_be_listable(self):
+        self.assertRaises(ValueError, SyncEngine, MemoryStore(), objects=('card',))
+        self.assertRaises(ValueError, SyncEngine, MemoryStore(), objects=('unknown',))
@@ -1,4 +1,5 @@
 import re
+import tempfile
 
 from aiostripe.multipart_data_generator import MultipartDataGenerator
 from aiostripe.test.helper import StripeTestCase
@@ -27,3 +28,57 @@ class MultipartDataGeneratorTests(StripeTestCase):
             test_file.seek(0)
             file_contents = test_file.read()
             self.assertNotEqual(-1, http_body.find(file_contents))
+
+    async def test_stream_matches_post_data(self):
+        with tempfile.TemporaryFile() as test_file:
+            test_file.write(bytes(range(256)) * 1000)
+
+            def build():
+                test_file.seek(0)
+                generator = MultipartDataGenerator(chunk_size=4096)
+                generator.boundary = 'boundary'
+                generator.add_params({'purpose': 'dispute_evidence', 'file': test_file})
+                return generator
+
+            post_data = build().get_post_data()
+
+            chunks = []
+            async for chunk in build().stream():
+                self.assertLessEqual(len(chunk), 4096 + 256)
+                chunks.append(chunk)
+
+            self.assertEqual(b''.join(chunks), post_data)
+
+    async def test_stream_maps_regular_files(self):
+        with tempfile.TemporaryFile() as test_file:
+            test_file.write(b'\x00\xff' * 10000)
+            test_file.seek(0)
+
+            generator = MultipartDataGenerator(chunk_size=4096)
+            generator.add_params({'file': test_file})
+            stream = generator.stream()
+
+            chunks = []
+            async for chunk in stream:
+                chunks.append(chunk)
+
+            self.assertTrue(any(isinstance(chunk, memoryview) for chunk in chunks))
+            self.assertEqual(stream.size, sum(len(chunk) for chunk in chunks))
+            self.assertNotEqual(-1, b''.join(chunks).find(b'\x00\xff' * 10000))
+
+    async def test_stream_without_mmap(self):
+        with tempfile.TemporaryFile() as test_file:
+            test_file.write(b'\x00\xff' * 10000)
+            test_file.seek(0)
+
+            generator = MultipartDataGenerator(chunk_size=4096, mmap_files=False)
+            generator.add_params({'file': test_file})
+            stream = generator.stream()
+
+            chunks = []
+            async for chunk in stream:
+                chunks.append(chunk)
+
+            self.assertIsNone(stream.size)
+            self.assertFalse(any(isinstance(chunk, memoryview) for chunk in chunks))
+            self.assertNotEqual(-1, b''.join(chunks).find(b'\x00\xff' * 10000))
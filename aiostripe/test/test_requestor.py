@@ -1,4 +1,8 @@
+import concurrent.futures
 import datetime
+import json
+import tempfile
+import threading
 import unittest
 import urllib.parse
 from unittest.mock import ANY
@@ -7,6 +11,7 @@ import aiostripe
 import aiostripe.api_requestor
 import aiostripe.error
 import aiostripe.http_client
+import aiostripe.resource
 from aiostripe.test.helper import StripeUnitTestCase, Mock, AsyncMock
 
 VALID_API_METHODS = ('get', 'post', 'delete')
@@ -384,10 +389,109 @@ class DefaultClientTests(StripeUnitTestCase):
 
         hc.request.assert_called_with('get', 'https://api.stripe.com/v1/charges?limit=3', ANY, None)
 
+    async def test_upload_through_buffering_client(self):
+        bodies = []
+
+        class BufferingClient(object):
+            name = 'buffering'
+
+            async def request(self, method, url, headers, post_data=None):
+                bodies.append(post_data)
+                return json.dumps({'id': 'file_1', 'object': 'file_upload'}), 200, {}
+
+        with tempfile.TemporaryFile() as f:
+            f.write(b'evidence')
+            f.seek(0)
+
+            requestor = aiostripe.api_requestor.APIRequestor(client=BufferingClient())
+            resp, _ = await requestor.request('post', '/v1/files', {'purpose': 'dispute_evidence', 'file': f},
+                                              {'Content-Type': 'multipart/form-data'})
+
+        self.assertEqual(resp['id'], 'file_1')
+        self.assertIsInstance(bodies[0], bytes)
+        self.assertIn(b'evidence', bodies[0])
+
+    def test_streaming_uploads(self):
+        self.assertTrue(aiostripe.http_client.AsyncioClient.supports_streaming_uploads)
+        self.assertFalse(aiostripe.http_client.HTTPClient.supports_streaming_uploads)
+
     def tearDown(self):
         aiostripe.api_key = None
         aiostripe.default_http_client = None
 
 
+class OffloadTests(StripeUnitTestCase):
+    RESTORE_ATTRIBUTES = StripeUnitTestCase.RESTORE_ATTRIBUTES + ('offload_threshold', 'offload_executor',
+                                                                  'default_http_client')
+
+    PAGE = {'object': 'list', 'url': '/v1/charges', 'has_more': False,
+            'data': [{'id': 'ch_%d' % i, 'object': 'charge', 'metadata': {'n': str(i)}} for i in range(3)]}
+
+    def setUp(self):
+        super().setUp()
+
+        self.client = Mock(aiostripe.http_client.HTTPClient)
+        self.client.name = 'mockclient'
+        self.client.request = AsyncMock(return_value=(json.dumps(self.PAGE).encode('utf-8'), 200, {}))
+        self.requestor = aiostripe.api_requestor.APIRequestor(client=self.client)
+
+        aiostripe.default_http_client = self.client
+        aiostripe.offload_threshold = 100
+
+    def tearDown(self):
+        executor = aiostripe.offload_executor
+
+        super().tearDown()
+
+        if executor is not None:
+            executor.shutdown()
+
+    async def test_thread_pool(self):
+        aiostripe.offload_executor = concurrent.futures.ThreadPoolExecutor(1)
+        threads = []
+
+        original = aiostripe.api_requestor._decode_body
+
+        def decode_body(rbody):
+            threads.append(threading.current_thread())
+            return original(rbody)
+
+        with unittest.mock.patch('aiostripe.api_requestor._decode_body', decode_body):
+            resp, _ = await self.requestor.request('get', '/v1/charges')
+            page = await aiostripe.Charge.list()
+
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.current_thread(), threads)
+        # the same plain JSON as without offloading
+        self.assertEqual(resp, self.PAGE)
+        self.assertNotIsInstance(resp, aiostripe.resource.StripeObject)
+        self.assertIsInstance(page, aiostripe.resource.ListObject)
+        self.assertEqual([type(c) for c in page.data], [aiostripe.Charge] * 3)
+        self.assertEqual(page.data[2].metadata.n, '2')
+
+    async def test_process_pool(self):
+        aiostripe.offload_executor = concurrent.futures.ProcessPoolExecutor(1)
+
+        resp, _ = await self.requestor.request('get', '/v1/charges')
+
+        self.assertEqual(resp, self.PAGE)
+        self.assertNotIsInstance(resp, aiostripe.resource.StripeObject)
+
+    async def test_below_threshold(self):
+        aiostripe.offload_threshold = 10 ** 6
+
+        resp, _ = await self.requestor.request('get', '/v1/charges')
+
+        self.assertNotIsInstance(resp, aiostripe.resource.StripeObject)
+
+    async def test_errors(self):
+        self.client.request = AsyncMock(return_value=(b'{"data": [' + b' ' * 200, 200, {}))
+        await self.assertRaisesAsync(aiostripe.error.APIError, self.requestor.request, 'get', '/v1/charges')
+
+        body = json.dumps({'error': {'message': 'x' * 200}})
+        self.client.request = AsyncMock(return_value=(body, 400, {}))
+        await self.assertRaisesAsync(aiostripe.error.InvalidRequestError, self.requestor.request, 'get', '/v1/charges')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,92 @@
+import asyncio
+
+from aiostripe.resolver import CachingResolver
+from aiostripe.test.helper import StripeTestCase
+
+
+class FakeResolver(object):
+    def __init__(self):
+        self.calls = 0
+        self.delay = 0
+        self.error = None
+
+    async def resolve(self, host, port=0, family=0):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+
+        if self.error is not None:
+            raise self.error
+
+        return [{'hostname': host, 'host': '10.0.0.%d' % self.calls, 'port': port, 'family': family, 'proto': 0,
+                 'flags': 0}]
+
+    async def close(self):
+        pass
+
+
+class CachingResolverTests(StripeTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.upstream = FakeResolver()
+
+    async def resolve(self, resolver, host='api.stripe.com'):
+        return (await resolver.resolve(host, 443))[0]['host']
+
+    async def test_cache_and_expiry(self):
+        resolver = CachingResolver(ttl=0.05, refresh_ahead=1, resolver=self.upstream)
+
+        results = await asyncio.gather(*[self.resolve(resolver) for _ in range(3)])
+        self.assertEqual(results, ['10.0.0.1'] * 3)
+        self.assertEqual(self.upstream.calls, 1)
+
+        await asyncio.sleep(0.06)
+        self.assertEqual(await self.resolve(resolver), '10.0.0.2')
+        self.assertEqual(self.upstream.calls, 2)
+        self.assertEqual(resolver.stats['misses'], 4)
+
+    async def test_refresh_ahead(self):
+        resolver = CachingResolver(ttl=0.1, refresh_ahead=0.5, resolver=self.upstream)
+
+        self.assertEqual(await self.resolve(resolver), '10.0.0.1')
+        await asyncio.sleep(0.06)
+
+        # served from the cache while the entry is refreshed
+        self.assertEqual(await self.resolve(resolver), '10.0.0.1')
+        await asyncio.sleep(0.01)
+        self.assertEqual(await self.resolve(resolver), '10.0.0.2')
+        self.assertEqual(self.upstream.calls, 2)
+        self.assertEqual(resolver.stats['refreshes'], 1)
+
+    async def test_last_known_good(self):
+        resolver = CachingResolver(ttl=0.01, timeout=0.02, resolver=self.upstream)
+        self.assertEqual(await self.resolve(resolver), '10.0.0.1')
+        await asyncio.sleep(0.02)
+
+        self.upstream.error = OSError('resolver down')
+        self.assertEqual(await self.resolve(resolver), '10.0.0.1')
+
+        self.upstream.error = None
+        self.upstream.delay = 0.1
+        self.assertEqual(await self.resolve(resolver), '10.0.0.1')
+        self.assertEqual(resolver.stats['stale'], 2)
+
+        await resolver.close()
+
+    async def test_failure_without_cache(self):
+        resolver = CachingResolver(resolver=self.upstream)
+        self.upstream.error = OSError('resolver down')
+
+        await self.assertRaisesAsync(OSError, resolver.resolve, 'api.stripe.com', 443)
+        self.assertEqual(resolver.stats['failures'], 1)
+
+    async def test_max_hosts(self):
+        resolver = CachingResolver(max_hosts=2, resolver=self.upstream)
+
+        await self.resolve(resolver, 'a')
+        await self.resolve(resolver, 'b')
+        await self.resolve(resolver, 'a')
+        await self.resolve(resolver, 'c')
+
+        self.assertEqual(self.upstream.calls, 3)
+        self.assertEqual(sorted(host for host, port, family in resolver._cache), ['a', 'c'])
@@ -0,0 +1,170 @@
+import json
+import unittest
+import unittest.mock
+
+import aiostripe
+import aiostripe.error
+from aiostripe.http_client import _StreamedRequest
+from aiostripe.streaming import ListParser
+from aiostripe.test.emulator import StripeEmulator
+from aiostripe.test.helper import StripeTestCase, DUMMY_CHARGE
+
+PAGE = {
+    'object': 'list',
+    'url': '/v1/charges',
+    'data': [
+        {'id': 'ch_1', 'object': 'charge', 'amount': 100, 'metadata': {'note': 'café "quoted" \\ [1, 2]'}},
+        {'id': 'ch_2', 'object': 'charge', 'amount': 200, 'refunds': {'object': 'list', 'data': []}},
+        {'id': 'ch_3', 'object': 'charge', 'amount': 1.5e3, 'captured': False, 'dispute': None},
+    ],
+    'has_more': True,
+    'total_count': 123,
+}
+
+
+class ListParserTests(unittest.TestCase):
+    def parse(self, body, chunk_size):
+        parser = ListParser()
+        batches = []
+
+        for i in range(0, len(body), chunk_size):
+            batches.append(parser.feed(body[i:i + chunk_size]))
+        batches.append(parser.close())
+
+        return parser, batches
+
+    def test_chunk_sizes(self):
+        for indent in (None, 2):
+            body = json.dumps(PAGE, indent=indent).encode('utf-8')
+
+            for chunk_size in (1, 3, 64, len(body)):
+                parser, batches = self.parse(body, chunk_size)
+
+                self.assertEqual([item for batch in batches for item in batch], PAGE['data'])
+                self.assertEqual(parser.envelope, dict((k, v) for k, v in PAGE.items() if k != 'data'))
+
+    def test_split_everywhere(self):
+        bodies = [
+            json.dumps(PAGE).encode('utf-8'),
+            b'{"data": [2.5, 3, -1e-3, 2.5E+2, true, null, {"fee": 2.5}], "fee": 2.5, "total": 1E3, "has_more": false}',
+        ]
+
+        for body in bodies:
+            expected = json.loads(body.decode('utf-8'))
+            data = expected.pop('data')
+
+            for offset in range(len(body) + 1):
+                parser = ListParser()
+                items = parser.feed(body[:offset]) + parser.feed(body[offset:]) + parser.close()
+
+                self.assertEqual(items, data, offset)
+                self.assertEqual(parser.envelope, expected, offset)
+
+    def test_items_are_returned_when_complete(self):
+        parser = ListParser()
+
+        self.assertEqual(parser.feed('{"object": "list", "data": [{"id": "ch_1"}, {"id": "ch'), [{'id': 'ch_1'}])
+        self.assertEqual(parser.feed('_2"}], "has_more": fal'), [{'id': 'ch_2'}])
+        self.assertEqual(parser.feed('se, "total_count": 1'), [])
+        self.assertEqual(parser.envelope, {'object': 'list', 'has_more': False})
+        self.assertEqual(parser.feed('2}'), [])
+        self.assertEqual(parser.close(), [])
+        self.assertEqual(parser.envelope['total_count'], 12)
+
+    def test_invalid(self):
+        parser = ListParser()
+        parser.feed(b'{"object": "list", "data": [{"id": "ch_1"}')
+        self.assertRaises(ValueError, parser.close)
+
+        self.assertRaises(ValueError, ListParser().feed, b'[1, 2]')
+
+
+class PlainClient(object):
+    """A client that does not inherit from `HTTPClient`, so has no `supports_streaming`."""
+
+    name = 'plain'
+
+    async def request(self, method, url, headers, post_data=None):
+        return json.dumps(dict(PAGE, has_more=False)), 200, {}
+
+
+class StreamingPaginationTests(StripeTestCase):
+    def tearDown(self):
+        aiostripe.default_http_client = None
+
+        super().tearDown()
+
+    async def test_auto_paging_iter(self):
+        for compress in (False, True):
+            async with StripeEmulator(compress=compress) as emulator:
+                for i in range(25):
+                    emulator.add('charges', {'amount': 100 + i, 'currency': 'usd'})
+
+                streamed = []
+                async for charge in aiostripe.Charge.auto_paging_iter(limit=10, stream=True):
+                    self.assertIsInstance(charge, aiostripe.Charge)
+                    streamed.append(charge.id)
+
+                self.assertEqual(len(streamed), 25)
+                self.assertEqual(len(emulator.request_log), 3)
+
+                buffered = []
+                async for charge in aiostripe.Charge.auto_paging_iter(limit=10):
+                    buffered.append(charge.id)
+
+                self.assertEqual(streamed, buffered)
+
+    async def test_list_object(self):
+        async with StripeEmulator() as emulator:
+            for i in range(5):
+                emulator.add('charges', {'amount': 100 + i, 'currency': 'usd'})
+
+            page = await aiostripe.Charge.list(limit=2)
+
+            ids = []
+            async for charge in page.auto_paging_iter(stream=True):
+                ids.append(charge.id)
+
+            self.assertEqual(ids[:2], [c.id for c in page.data])
+            self.assertEqual(len(set(ids)), 5)
+
+    async def test_error(self):
+        async with StripeEmulator() as emulator:
+            await aiostripe.Charge.create(**DUMMY_CHARGE)
+            emulator.inject_error(429)
+
+            with self.assertRaises(aiostripe.error.RateLimitError):
+                async for charge in aiostripe.Charge.auto_paging_iter(stream=True):
+                    pass
+
+    async def test_client_without_streaming(self):
+        aiostripe.default_http_client = PlainClient()
+
+        ids = []
+        async for charge in aiostripe.Charge.auto_paging_iter(stream=True):
+            ids.append(charge.id)
+
+        self.assertEqual(ids, ['ch_1', 'ch_2', 'ch_3'])
+
+    async def test_close_early(self):
+        async with StripeEmulator():
+            for i in range(5):
+                await aiostripe.Charge.create(**DUMMY_CHARGE)
+
+            exit = _StreamedRequest.__aexit__
+            released = []
+
+            async def spy(self, *args):
+                released.append(args[0])
+                return await exit(self, *args)
+
+            with unittest.mock.patch.object(_StreamedRequest, '__aexit__', spy):
+                charges = aiostripe.Charge.auto_paging_iter(limit=3, stream=True)
+                async for charge in charges:
+                    break
+
+                self.assertEqual(released, [])
+
+                await charges.close()
+
+            self.assertEqual(released, [GeneratorExit])
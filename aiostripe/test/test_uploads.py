@@ -0,0 +1,95 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest.mock import ANY
+
+import aiostripe
+from aiostripe.test.helper import StripeApiTestCase, AsyncMock
+from aiostripe.uploads import ByteBudget, upload_many
+from coroutils.async_test import AsyncTestCase
+
+
+class ByteBudgetTests(AsyncTestCase):
+    async def test_acquire_clamps_to_capacity(self):
+        budget = ByteBudget(100)
+
+        self.assertEqual(await budget.acquire(60), 60)
+        self.assertEqual(budget.available, 40)
+
+        budget.release(60)
+        self.assertEqual(await budget.acquire(500), 100)
+        self.assertEqual(budget.available, 0)
+
+    async def test_waiters_are_served_in_order(self):
+        budget = ByteBudget(100)
+        order = []
+
+        async def take(name, nbytes, hold):
+            charged = await budget.acquire(nbytes)
+            order.append(name)
+            await asyncio.sleep(hold)
+            budget.release(charged)
+
+        # gather() on Python < 3.7 starts coroutines in arbitrary order, tasks start in the order they are created
+        tasks = []
+        for name, nbytes, hold in (('a', 60, 0.01), ('b', 500, 0), ('c', 10, 0)):
+            tasks.append(asyncio.ensure_future(take(name, nbytes, hold)))
+        await asyncio.gather(*tasks)
+
+        # 'c' would fit next to 'a', but it must not overtake 'b'
+        self.assertEqual(order, ['a', 'b', 'c'])
+        self.assertEqual(budget.available, 100)
+
+    def test_invalid_capacity(self):
+        self.assertRaises(ValueError, ByteBudget, 0)
+
+
+class UploadManyTests(StripeApiTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.files = []
+        for i in range(3):
+            f = tempfile.NamedTemporaryFile(delete=False)
+            f.write(b'x' * (i + 1) * 10)
+            f.close()
+            self.files.append(f.name)
+
+    def tearDown(self):
+        for name in self.files:
+            os.unlink(name)
+
+        super().tearDown()
+
+    async def test_upload_many(self):
+        self.mock_response({'object': 'file_upload', 'id': 'file_foo'})
+
+        results = await upload_many(self.files, 'dispute_evidence', client=object(), max_in_flight_bytes=25)
+
+        self.assertEqual([r.source for r in results], self.files)
+        self.assertEqual([r.size for r in results], [10, 20, 30])
+
+        for result in results:
+            self.assertIsNone(result.error)
+            self.assertIsInstance(result.file_upload, aiostripe.FileUpload)
+            self.assertGreaterEqual(result.upload_time, 0)
+            self.assertGreaterEqual(result.wait_time, 0)
+
+        self.assertEqual(self.requestor_mock.request.call_count, 3)
+        self.requestor_mock.request.assert_called_with('post', '/v1/files',
+                                                       {'purpose': 'dispute_evidence', 'file': ANY},
+                                                       {'Content-Type': 'multipart/form-data'})
+
+    async def test_upload_many_errors(self):
+        self.requestor_mock.request = AsyncMock(side_effect=aiostripe.error.InvalidRequestError('bad file', 'file'))
+
+        results = await upload_many(self.files[:1] + ['/nonexistent/file'], 'dispute_evidence', client=object())
+
+        self.assertIsInstance(results[0].error, aiostripe.error.InvalidRequestError)
+        self.assertIsInstance(results[1].error, OSError)
+        self.assertIsNone(results[1].size)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import asyncio
+import unittest
+
+import aiostripe
+from aiostripe.test.helper import StripeTestCase
+from aiostripe.util import BackgroundTask, field, plain
+
+
+class FieldTests(unittest.TestCase):
+    def test_paths(self):
+        obj = {'amount': 100, 'metadata': {'order_id': 'o1'}, 'customer': {'id': 'cus_1', 'object': 'customer'},
+               'refunds': {'object': 'list', 'data': []}}
+
+        self.assertEqual(field(obj, 'amount'), 100)
+        self.assertEqual(field(obj, 'metadata.order_id'), 'o1')
+        self.assertEqual(field(obj, 'customer'), 'cus_1')
+        self.assertEqual(field(obj, 'customer.object'), 'customer')
+        self.assertEqual(field(obj, 'refunds'), {'object': 'list', 'data': []})
+        self.assertIsNone(field(obj, 'metadata.missing'))
+        self.assertIsNone(field(obj, 'amount.value'))
+
+    def test_stripe_object(self):
+        charge = aiostripe.Charge.construct_from({'id': 'ch_1', 'customer': {'id': 'cus_1', 'object': 'customer'}},
+                                                 'sk_test')
+
+        self.assertEqual(field(charge, 'customer'), 'cus_1')
+
+
+class PlainTests(unittest.TestCase):
+    def test_plain(self):
+        charge = aiostripe.Charge.construct_from({'id': 'ch_1', 'refunds': {'object': 'list', 'data': [{'id': 're_1'}]},
+                                                  'metadata': {}}, 'sk_test')
+
+        values = plain(charge)
+
+        self.assertEqual(values, {'id': 'ch_1', 'refunds': {'object': 'list', 'data': [{'id': 're_1'}]},
+                                  'metadata': {}})
+        self.assertIs(type(values), dict)
+        self.assertIs(type(values['refunds']), dict)
+        self.assertIs(type(values['refunds']['data'][0]), dict)
+
+
+class Ticker(BackgroundTask):
+    def __init__(self):
+        self.ticks = 0
+
+    async def _prepare(self):
+        self.ticks += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(0.01)
+            self.ticks += 1
+
+
+class BackgroundTaskTests(StripeTestCase):
+    async def test_lifecycle(self):
+        ticker = Ticker()
+        self.assertFalse(ticker.running)
+
+        async with ticker:
+            self.assertTrue(ticker.running)
+            self.assertEqual(ticker.ticks, 1)
+
+            # starting again keeps the running task
+            await ticker.start()
+            self.assertEqual(ticker.ticks, 1)
+            await asyncio.sleep(0.05)
+
+        self.assertFalse(ticker.running)
+        ticks = ticker.ticks
+        self.assertGreater(ticks, 2)
+
+        await asyncio.sleep(0.03)
+        self.assertEqual(ticker.ticks, ticks)
+        await ticker.stop()
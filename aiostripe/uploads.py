@@ -0,0 +1,145 @@
+import asyncio
+import collections
+import os
+import time
+
+import aiostripe
+from aiostripe import api_requestor, error, http_client
+from aiostripe.resource import FileUpload, convert_to_stripe_object
+
+DEFAULT_MAX_IN_FLIGHT_BYTES = 64 * 1024 * 1024
+
+
+class ByteBudget(object):
+    """A FIFO semaphore counted in bytes.
+
+    Requests larger than the whole budget are clamped to it, so a single big file still goes through, alone."""
+
+    def __init__(self, capacity, loop=None):
+        if capacity < 1:
+            raise ValueError('capacity must be a positive number of bytes')
+
+        self.capacity = capacity
+        self.available = capacity
+
+        self._loop = loop
+        self._waiters = collections.deque()
+
+    async def acquire(self, nbytes):
+        nbytes = min(nbytes, self.capacity)
+
+        if not self._waiters and self.available >= nbytes:
+            self.available -= nbytes
+            return nbytes
+
+        loop = self._loop or asyncio.get_event_loop()
+        waiter = loop.create_future()
+        self._waiters.append((nbytes, waiter))
+
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(nbytes)
+            else:
+                self._waiters.remove((nbytes, waiter))
+                self._wake()
+
+            raise
+
+        return nbytes
+
+    def release(self, nbytes):
+        self.available += nbytes
+        self._wake()
+
+    def _wake(self):
+        while self._waiters:
+            nbytes, waiter = self._waiters[0]
+
+            if waiter.done():
+                self._waiters.popleft()
+                continue
+
+            if self.available < nbytes:
+                break
+
+            self._waiters.popleft()
+            self.available -= nbytes
+            waiter.set_result(None)
+
+
+class UploadResult(object):
+    def __init__(self, source, size):
+        self.source = source
+        self.size = size
+        self.file_upload = None
+        self.error = None
+        self.wait_time = None
+        self.upload_time = None
+
+    def __repr__(self):
+        return '<UploadResult %r size=%r wait_time=%r upload_time=%r error=%r>' % (
+            self.source, self.size, self.wait_time, self.upload_time, self.error)
+
+
+def _source_size(source):
+    try:
+        if isinstance(source, str):
+            return os.path.getsize(source)
+
+        return os.fstat(source.fileno()).st_size - source.tell()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+async def upload_many(files, purpose, api_key=None, stripe_account=None, client=None, concurrency=8,
+                      max_in_flight_bytes=DEFAULT_MAX_IN_FLIGHT_BYTES):
+    """Uploads many files concurrently to `upload_api_base` and returns one UploadResult per file, in order.
+
+    `files` are paths or binary file objects. At most `concurrency` uploads run at once and the sizes of the files
+    being sent never add up to more than `max_in_flight_bytes`; files of unknown size take the whole budget. Paths are
+    only opened once their upload starts. A failed upload sets `error` on its result instead of aborting the rest."""
+
+    if client is None:
+        client = aiostripe.default_http_client or \
+                 http_client.default_http_client(verify_ssl_certs=aiostripe.verify_ssl_certs)
+
+    budget = ByteBudget(max_in_flight_bytes)
+    slots = asyncio.Semaphore(concurrency)
+
+    async def upload(source):
+        size = _source_size(source)
+        result = UploadResult(source, size)
+
+        queued = time.perf_counter()
+        async with slots:
+            charged = await budget.acquire(max_in_flight_bytes if size is None else size)
+
+            try:
+                started = time.perf_counter()
+                result.wait_time = started - queued
+
+                if isinstance(source, str):
+                    with open(source, 'rb') as f:
+                        result.file_upload = await _upload(f)
+                else:
+                    result.file_upload = await _upload(source)
+            except (error.StripeError, OSError) as e:
+                result.error = e
+            finally:
+                result.upload_time = time.perf_counter() - started
+                budget.release(charged)
+
+        return result
+
+    async def _upload(f):
+        requestor = api_requestor.APIRequestor(api_key, client=client, api_base=FileUpload.api_base(),
+                                               account=stripe_account)
+        headers = {'Content-Type': 'multipart/form-data'}
+        response, my_api_key = await requestor.request('post', FileUpload.class_url(), {'purpose': purpose, 'file': f},
+                                                       headers)
+
+        return convert_to_stripe_object(response, my_api_key, stripe_account)
+
+    return await asyncio.gather(*[upload(source) for source in files])
@@ -0,0 +1,69 @@
+"""Helpers shared by the modules working on the values of Stripe objects as the API returned them, and by those
+running a task in the background."""
+import asyncio
+
+
+def field(obj, path):
+    """The value at the dotted `path` of `obj`, e.g. `metadata.order_id`, an expanded object standing for its id; None
+    if there is no such value."""
+
+    value = obj
+    for name in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(name)
+
+    if isinstance(value, dict) and 'id' in value:
+        return value['id']
+
+    return value
+
+
+def plain(value):
+    """A copy of `value` made of plain dicts and lists, which no Stripe object shares."""
+
+    if isinstance(value, dict):
+        return dict((k, plain(v)) for k, v in value.items())
+    elif isinstance(value, list):
+        return [plain(v) for v in value]
+
+    return value
+
+
+class BackgroundTask(object):
+    """Base of the objects running `_run` as a task between `start` and `stop`, or for the duration of an
+    `async with` block. `start` awaits `_prepare` first, so what it raises reaches the caller."""
+
+    _task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if not self.running:
+            await self._prepare()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            task, self._task = self._task, None
+            task.cancel()
+
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _prepare(self):
+        pass
+
+    async def _run(self):
+        raise NotImplementedError('BackgroundTask subclasses must implement `_run`')
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
@@ -0,0 +1,64 @@
+import json
+import os
+import platform
+import subprocess
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL)
+        commit = commit.decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+    }
+
+
+def save_baseline(name, results):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+
+    with open(os.path.join(BASELINE_DIR, '%s.json' % name), 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def load_baseline(name):
+    with open(os.path.join(BASELINE_DIR, '%s.json' % name)) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, section, skip=(), higher_is_better=()):
+    """Prints the relative change of every metric in `results[section]` against `baseline`, signed so that + is an
+    improvement."""
+
+    env = baseline['environment']
+    print()
+    print('change vs baseline %s on %s %s (+ is better)' % (env.get('commit') or '?', env.get('implementation'),
+                                                           env.get('python')))
+
+    for name, metrics in sorted(results[section].items()):
+        old = baseline[section].get(name)
+        if old is None:
+            print('  %-30s (not in baseline)' % name)
+            continue
+
+        changes = []
+        for metric, value in sorted(metrics.items()):
+            before = old.get(metric)
+            if metric in skip or not before or value is None:
+                continue
+
+            delta = (value - before) / before * 100
+            if metric not in higher_is_better:
+                delta = -delta
+
+            changes.append('%s %+.1f%%' % (metric, delta))
+
+        print('  %-30s %s' % (name, ', '.join(changes)))
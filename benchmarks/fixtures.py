@@ -0,0 +1,184 @@
+"""Deterministic payload fixtures shaped like real API traffic, in several sizes and nesting depths."""
+
+SIZES = ('small', 'medium', 'large')
+
+
+def _id(prefix, i):
+    return '%s_%014d' % (prefix, i)
+
+
+def card(i, owner=None):
+    values = {
+        'id': _id('card', i),
+        'object': 'card',
+        'brand': 'Visa',
+        'country': 'US',
+        'exp_month': 1 + i % 12,
+        'exp_year': 2030,
+        'fingerprint': 'Xt5EWLLDS7FJjR1c',
+        'funding': 'credit',
+        'last4': '4242',
+        'metadata': {},
+        'name': None,
+        'address_city': None,
+        'address_country': None,
+        'address_line1': None,
+        'address_zip': '94107',
+        'cvc_check': 'pass',
+    }
+    values.update(owner or {})
+
+    return values
+
+
+def customer(i, sources=1, subscriptions=0):
+    cid = _id('cus', i)
+
+    return {
+        'id': cid,
+        'object': 'customer',
+        'account_balance': 0,
+        'created': 1450000000 + i,
+        'currency': 'usd',
+        'default_source': _id('card', i) if sources else None,
+        'delinquent': False,
+        'description': 'Customer %d' % i,
+        'discount': None,
+        'email': 'customer%d@example.com' % i,
+        'livemode': False,
+        'metadata': {'internal_id': str(i), 'segment': 'abc'[i % 3]},
+        'sources': {
+            'object': 'list',
+            'data': [card(i * 10 + n, {'customer': cid}) for n in range(sources)],
+            'has_more': False,
+            'total_count': sources,
+            'url': '/v1/customers/%s/sources' % cid,
+        },
+        'subscriptions': {
+            'object': 'list',
+            'data': [subscription(i * 10 + n, cid) for n in range(subscriptions)],
+            'has_more': False,
+            'total_count': subscriptions,
+            'url': '/v1/customers/%s/subscriptions' % cid,
+        },
+    }
+
+
+def plan(i):
+    return {
+        'id': 'plan-%d' % i,
+        'object': 'plan',
+        'amount': 2000,
+        'created': 1440000000 + i,
+        'currency': 'usd',
+        'interval': 'month',
+        'interval_count': 1,
+        'livemode': False,
+        'metadata': {},
+        'name': 'Plan %d' % i,
+        'statement_descriptor': None,
+        'trial_period_days': None,
+    }
+
+
+def subscription(i, customer_id):
+    return {
+        'id': _id('sub', i),
+        'object': 'subscription',
+        'cancel_at_period_end': False,
+        'canceled_at': None,
+        'current_period_end': 1452592000,
+        'current_period_start': 1450000000,
+        'customer': customer_id,
+        'metadata': {},
+        'plan': plan(i % 5),
+        'quantity': 1,
+        'start': 1450000000,
+        'status': 'active',
+        'tax_percent': None,
+    }
+
+
+def charge(i, expand_customer=False, refunds=0):
+    chid = _id('ch', i)
+    cust = customer(i % 5) if expand_customer else _id('cus', i % 5)
+
+    return {
+        'id': chid,
+        'object': 'charge',
+        'amount': 1000 + i,
+        'amount_refunded': 0,
+        'balance_transaction': _id('txn', i),
+        'captured': True,
+        'created': 1450000000 + i,
+        'currency': 'usd',
+        'customer': cust,
+        'description': 'Charge for order %d' % i,
+        'dispute': None,
+        'failure_code': None,
+        'failure_message': None,
+        'fraud_details': {},
+        'invoice': None,
+        'livemode': False,
+        'metadata': {'order_id': str(100000 + i)},
+        'paid': True,
+        'receipt_email': None,
+        'refunded': False,
+        'refunds': {
+            'object': 'list',
+            'data': [{'id': _id('re', i * 10 + n), 'object': 'refund', 'amount': 100, 'charge': chid,
+                      'created': 1450000100 + i, 'currency': 'usd', 'metadata': {}} for n in range(refunds)],
+            'has_more': False,
+            'total_count': refunds,
+            'url': '/v1/charges/%s/refunds' % chid,
+        },
+        'source': card(i),
+        'status': 'succeeded',
+    }
+
+
+def charge_list(n, expand_customer=False):
+    return {
+        'object': 'list',
+        'data': [charge(i, expand_customer=expand_customer, refunds=i % 3) for i in range(n)],
+        'has_more': True,
+        'url': '/v1/charges',
+    }
+
+
+def responses():
+    """Decoded response payloads keyed by size."""
+
+    return {
+        'small': plan(1),
+        'medium': customer(1, sources=3, subscriptions=2),
+        'large': charge_list(100, expand_customer=True),
+    }
+
+
+def request_params():
+    """Request parameter dicts keyed by size, as passed to create() or save()."""
+
+    return {
+        'small': {'amount': 1000, 'currency': 'usd', 'customer': _id('cus', 1), 'description': 'order 1'},
+        'medium': {
+            'amount': 1000,
+            'currency': 'usd',
+            'card': {'number': '4242424242424242', 'exp_month': 12, 'exp_year': 2030, 'cvc': '123'},
+            'metadata': dict(('key%d' % i, 'value%d' % i) for i in range(10)),
+            'expand': ['customer', 'balance_transaction'],
+        },
+        'large': {
+            'legal_entity': {
+                'additional_owners': [
+                    {'first_name': 'Owner%d' % i, 'last_name': 'Test',
+                     'dob': {'day': 1, 'month': 1 + i, 'year': 1980},
+                     'address': {'line1': '%d Main St' % i, 'city': 'SF', 'postal_code': '94107'}}
+                    for i in range(4)],
+                'address': {'line1': '1 Market St', 'city': 'SF', 'state': 'CA', 'postal_code': '94107'},
+                'dob': {'day': 1, 'month': 1, 'year': 1980},
+            },
+            'metadata': dict(('key%d' % i, 'value%d' % i) for i in range(50)),
+            'items': [{'type': 'sku', 'parent': 'sku_%d' % i, 'quantity': i} for i in range(20)],
+        },
+    }
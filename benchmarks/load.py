@@ -0,0 +1,239 @@
+"""End-to-end load benchmarks of the public API against a local Stripe emulator.
+
+    python -m benchmarks.load [--requests 500] [--concurrency 20] [--latency 0.002] [--save NAME] [--compare NAME]
+
+The emulator runs in a child process, so CPU time and allocation figures only cover the bindings. Each workload reports
+throughput, p50/p95/p99 latency, CPU milliseconds per request and net allocated memory blocks per request (measured
+with the cyclic GC paused, so it approximates the per-request garbage plus whatever is retained). --save writes the
+results to benchmarks/baselines/NAME.json; --compare prints the relative change of every metric against such a file.
+"""
+import argparse
+import asyncio
+import gc
+import multiprocessing
+import sys
+import time
+
+import aiostripe
+from benchmarks.common import compare, environment, load_baseline, save_baseline
+
+DUMMY_CARD = {'number': '4242424242424242', 'exp_month': 12, 'exp_year': 2030}
+
+# metrics where a bigger number is better; everything else is a cost
+HIGHER_IS_BETTER = {'throughput'}
+
+
+def _serve_emulator(conn, latency):
+    from aiostripe.test.emulator import StripeEmulator
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    emulator = StripeEmulator(latency=latency)
+    loop.run_until_complete(emulator.start())
+    conn.send(emulator.url)
+
+    try:
+        loop.run_forever()
+    finally:
+        loop.run_until_complete(emulator.stop())
+
+
+def start_emulator(latency):
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_serve_emulator, args=(child, latency), daemon=True)
+    process.start()
+
+    return process, parent.recv()
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+
+    k = (len(sorted_values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+class Workload(object):
+    name = None
+
+    async def setup(self, requests):
+        pass
+
+    async def run(self, i):
+        """Performs one operation and returns how many API requests it made."""
+
+        raise NotImplementedError
+
+    def operations(self, requests):
+        return requests
+
+
+class CreateChargeBurst(Workload):
+    name = 'create_charge_burst'
+
+    async def run(self, i):
+        await aiostripe.Charge.create(amount=1000 + i, currency='usd', card=DUMMY_CARD,
+                                      description='benchmark charge %d' % i, metadata={'order_id': str(i)})
+        return 1
+
+
+class CustomerRetrieveFanout(Workload):
+    name = 'customer_retrieve_fanout'
+
+    async def setup(self, requests):
+        self.ids = []
+        for i in range(min(requests, 50)):
+            customer = await aiostripe.Customer.create(email='fanout%d@example.com' % i, card=DUMMY_CARD)
+            self.ids.append(customer.id)
+
+    async def run(self, i):
+        await aiostripe.Customer.retrieve(self.ids[i % len(self.ids)])
+        return 1
+
+
+class AutoPagingExport(Workload):
+    name = 'auto_paging_export'
+    page_size = 100
+
+    async def setup(self, requests):
+        for i in range(requests):
+            await aiostripe.Charge.create(amount=500, currency='usd', card=DUMMY_CARD, metadata={'n': str(i)})
+
+    def operations(self, requests):
+        return 1
+
+    stream = False
+
+    async def run(self, i):
+        count = 0
+        async for charge in aiostripe.Charge.auto_paging_iter(limit=self.page_size, stream=self.stream):
+            count += 1
+
+        return max(-(-count // self.page_size), 1)
+
+
+class AutoPagingExportStream(AutoPagingExport):
+    name = 'auto_paging_export_stream'
+    stream = True
+
+
+class SaveModified(Workload):
+    name = 'save_modified'
+
+    async def setup(self, requests):
+        self.customers = []
+        for i in range(min(requests, 50)):
+            self.customers.append(await aiostripe.Customer.create(email='save%d@example.com' % i))
+
+    async def run(self, i):
+        customer = self.customers[i % len(self.customers)]
+        customer.metadata['counter'] = str(i)
+        customer.description = 'saved %d' % i
+        await customer.save()
+        return 1
+
+
+WORKLOADS = [CreateChargeBurst, CustomerRetrieveFanout, AutoPagingExport, AutoPagingExportStream, SaveModified]
+
+
+async def run_workload(workload, requests, concurrency):
+    await workload.setup(requests)
+
+    operations = workload.operations(requests)
+    slots = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with slots:
+            started = time.perf_counter()
+            made = await workload.run(i)
+            latencies.append(time.perf_counter() - started)
+
+        return made
+
+    gc.collect()
+    gc.disable()
+    try:
+        blocks_before = sys.getallocatedblocks()
+        cpu_before = time.process_time()
+        wall_before = time.perf_counter()
+
+        total_requests = sum(await asyncio.gather(*[one(i) for i in range(operations)]))
+
+        wall = time.perf_counter() - wall_before
+        cpu = time.process_time() - cpu_before
+        blocks = sys.getallocatedblocks() - blocks_before
+    finally:
+        gc.enable()
+
+    latencies.sort()
+    ms = 1000.0
+
+    return {
+        'operations': operations,
+        'requests': total_requests,
+        'seconds': wall,
+        'throughput': total_requests / wall,
+        'p50_ms': percentile(latencies, 50) * ms,
+        'p95_ms': percentile(latencies, 95) * ms,
+        'p99_ms': percentile(latencies, 99) * ms,
+        'cpu_ms_per_request': cpu * ms / total_requests,
+        'blocks_per_request': blocks / total_requests,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.002, help='emulated server latency in seconds')
+    parser.add_argument('--workload', action='append', choices=[w.name for w in WORKLOADS])
+    parser.add_argument('--save', metavar='NAME')
+    parser.add_argument('--compare', metavar='NAME')
+    args = parser.parse_args()
+
+    process, url = start_emulator(args.latency)
+    aiostripe.api_base = aiostripe.upload_api_base = url
+    aiostripe.api_key = 'sk_test_benchmark'
+
+    results = {
+        'environment': environment(),
+        'parameters': {'requests': args.requests, 'concurrency': args.concurrency, 'latency': args.latency},
+        'workloads': {},
+    }
+
+    loop = asyncio.get_event_loop()
+    try:
+        print('%-26s %10s %9s %9s %9s %11s %12s' % ('workload', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'cpu ms/req',
+                                                    'blocks/req'))
+
+        for workload_class in WORKLOADS:
+            if args.workload and workload_class.name not in args.workload:
+                continue
+
+            metrics = loop.run_until_complete(run_workload(workload_class(), args.requests, args.concurrency))
+            results['workloads'][workload_class.name] = metrics
+
+            print('%-26s %10.1f %9.2f %9.2f %9.2f %11.3f %12.1f' % (
+                workload_class.name, metrics['throughput'], metrics['p50_ms'], metrics['p95_ms'], metrics['p99_ms'],
+                metrics['cpu_ms_per_request'], metrics['blocks_per_request']))
+    finally:
+        loop.run_until_complete(aiostripe.http_client.close_default_http_clients())
+        process.terminate()
+        process.join()
+
+    if args.save:
+        save_baseline(args.save, results)
+
+    if args.compare:
+        compare(results, load_baseline(args.compare), 'workloads', skip=('operations', 'requests', 'seconds'),
+                higher_is_better=HIGHER_IS_BETTER)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""Event loop lag under a mixed workload, with big responses decoded on the loop or offloaded to an executor.
+
+    python -m benchmarks.looplag [--seconds 5] [--fetchers 4] [--threshold 65536] [--save NAME] [--compare NAME]
+
+A few tasks keep listing pages of 100 charges, with large metadata, while other tasks retrieve a single customer and a
+probe measures how late its 1ms sleeps wake up. Each mode reports the probe's lag and the latency of the small
+requests: `inline` decodes everything on the loop, `thread` and `process` set `aiostripe.offload_threshold` with a
+thread or process pool as `aiostripe.offload_executor`.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import time
+
+import aiostripe
+from benchmarks.common import compare, environment, load_baseline, save_baseline
+from benchmarks.load import DUMMY_CARD, percentile, start_emulator
+
+MODES = ('inline', 'thread', 'process')
+
+PROBE_INTERVAL = 0.001
+
+
+def new_executor(mode):
+    if mode == 'thread':
+        return concurrent.futures.ThreadPoolExecutor(4)
+    elif mode == 'process':
+        return concurrent.futures.ProcessPoolExecutor(2)
+
+    return None
+
+
+async def setup(charges):
+    metadata = dict(('key%d' % i, 'value %d ' % i * 8) for i in range(20))
+    for i in range(charges):
+        await aiostripe.Charge.create(amount=500 + i, currency='usd', card=DUMMY_CARD, metadata=metadata)
+
+    customer = await aiostripe.Customer.create(email='looplag@example.com')
+
+    return customer.id
+
+
+async def run_mode(customer_id, seconds, fetchers, small):
+    deadline = time.perf_counter() + seconds
+    lags = []
+    latencies = []
+    pages = [0]
+
+    async def probe():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            await asyncio.sleep(PROBE_INTERVAL)
+            lags.append(time.perf_counter() - started - PROBE_INTERVAL)
+
+    async def fetch_pages():
+        while time.perf_counter() < deadline:
+            await aiostripe.Charge.list(limit=100)
+            pages[0] += 1
+
+    async def retrieve():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            await aiostripe.Customer.retrieve(customer_id)
+            latencies.append(time.perf_counter() - started)
+
+    tasks = [probe()] + [fetch_pages() for _ in range(fetchers)] + [retrieve() for _ in range(small)]
+    await asyncio.gather(*tasks)
+
+    lags.sort()
+    latencies.sort()
+    ms = 1000.0
+
+    return {
+        'pages_per_second': pages[0] / seconds,
+        'small_per_second': len(latencies) / seconds,
+        'lag_p50_ms': percentile(lags, 50) * ms,
+        'lag_p99_ms': percentile(lags, 99) * ms,
+        'lag_max_ms': lags[-1] * ms,
+        'small_p50_ms': percentile(latencies, 50) * ms,
+        'small_p99_ms': percentile(latencies, 99) * ms,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=5.0, help='duration of each mode')
+    parser.add_argument('--fetchers', type=int, default=4, help='tasks listing big pages')
+    parser.add_argument('--small', type=int, default=4, help='tasks retrieving a customer')
+    parser.add_argument('--threshold', type=int, default=64 * 1024, help='offload_threshold of the offloading modes')
+    parser.add_argument('--mode', action='append', choices=MODES)
+    parser.add_argument('--save', metavar='NAME')
+    parser.add_argument('--compare', metavar='NAME')
+    args = parser.parse_args()
+
+    process, url = start_emulator(0.0)
+    aiostripe.api_base = aiostripe.upload_api_base = url
+    aiostripe.api_key = 'sk_test_benchmark'
+
+    results = {
+        'environment': environment(),
+        'parameters': {'seconds': args.seconds, 'fetchers': args.fetchers, 'small': args.small,
+                       'threshold': args.threshold},
+        'modes': {},
+    }
+
+    loop = asyncio.get_event_loop()
+    try:
+        customer_id = loop.run_until_complete(setup(100))
+
+        print('%-8s %9s %9s %11s %11s %11s %12s %12s' % ('mode', 'pages/s', 'small/s', 'lag p50 ms', 'lag p99 ms',
+                                                         'lag max ms', 'small p50 ms', 'small p99 ms'))
+
+        for mode in MODES:
+            if args.mode and mode not in args.mode:
+                continue
+
+            executor = new_executor(mode)
+            aiostripe.offload_threshold = args.threshold if executor is not None else None
+            aiostripe.offload_executor = executor
+
+            try:
+                metrics = loop.run_until_complete(run_mode(customer_id, args.seconds, args.fetchers, args.small))
+            finally:
+                aiostripe.offload_threshold = aiostripe.offload_executor = None
+                if executor is not None:
+                    executor.shutdown()
+
+            results['modes'][mode] = metrics
+
+            print('%-8s %9.1f %9.1f %11.2f %11.2f %11.2f %12.2f %12.2f' % (
+                mode, metrics['pages_per_second'], metrics['small_per_second'], metrics['lag_p50_ms'],
+                metrics['lag_p99_ms'], metrics['lag_max_ms'], metrics['small_p50_ms'], metrics['small_p99_ms']))
+    finally:
+        loop.run_until_complete(aiostripe.http_client.close_default_http_clients())
+        process.terminate()
+        process.join()
+
+    if args.save:
+        save_baseline(args.save, results)
+
+    if args.compare:
+        compare(results, load_baseline(args.compare), 'modes',
+                higher_is_better={'pages_per_second', 'small_per_second'})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""Micro-benchmarks of the CPU hot paths of the bindings, with no network involved.
+
+    python -m benchmarks.micro [--filter SUBSTRING] [--repeat 5] [--save NAME] [--compare NAME]
+
+Every benchmark runs over the fixtures in benchmarks/fixtures.py, which are deterministic, so numbers are comparable
+across runs, machines and Python versions. Each is timed with timeit: the loop count is calibrated to take at least
+0.2s, the measurement repeated, and the minimum and median time per call reported, plus the time per item for
+benchmarks that process a known number of items.
+"""
+import argparse
+import asyncio
+import builtins
+import io
+import json
+import os
+import tempfile
+import timeit
+import urllib.parse
+
+from aiostripe import api_requestor
+from aiostripe.multipart_data_generator import MultipartDataGenerator
+from aiostripe.resource import convert_to_stripe_object, _compute_diff
+from benchmarks import fixtures
+from benchmarks.common import compare, environment, load_baseline, save_baseline
+from coroutils import afilter, aiter, async_generator
+from uniondict import uniondict
+
+
+class Benchmark(object):
+    def __init__(self, name, func, items=1):
+        self.name = name
+        self.func = func
+        self.items = items
+
+
+def encode_benchmarks():
+    for size, params in sorted(fixtures.request_params().items()):
+        def encode(params=params):
+            return urllib.parse.urlencode(list(api_requestor._api_encode(params)))
+
+        yield Benchmark('api_encode+urlencode[%s]' % size, encode, len(list(api_requestor._api_encode(params))))
+
+
+def interpret_benchmarks():
+    requestor = api_requestor.APIRequestor(key='sk_test_benchmark', client=object())
+
+    for size, payload in sorted(fixtures.responses().items()):
+        body = json.dumps(payload).encode('utf-8')
+
+        def interpret(body=body):
+            return requestor.interpret_response(body, 200, {})
+
+        yield Benchmark('interpret_response[%s, %dKiB]' % (size, len(body) // 1024), interpret)
+
+
+def _count_objects(value):
+    if isinstance(value, dict):
+        return ('object' in value) + sum(_count_objects(v) for v in value.values())
+    elif isinstance(value, list):
+        return sum(_count_objects(v) for v in value)
+
+    return 0
+
+
+def convert_benchmarks():
+    for size, payload in sorted(fixtures.responses().items()):
+        def convert(payload=payload):
+            return convert_to_stripe_object(payload, 'sk_test_benchmark', None)
+
+        yield Benchmark('convert_to_stripe_object[%s]' % size, convert, _count_objects(payload))
+
+
+def serialize_benchmarks():
+    for size, payload in sorted(fixtures.responses().items()):
+        obj = convert_to_stripe_object(payload, 'sk_test_benchmark', None)
+        target = obj.data[0] if obj.get('object') == 'list' else obj
+
+        target.metadata['changed'] = 'yes'
+        target.description = 'changed'
+
+        yield Benchmark('StripeObject.serialize[%s]' % size, lambda target=target: target.serialize(None))
+
+    previous = dict(('key%d' % i, 'value%d' % i) for i in range(50))
+    current = dict(previous)
+    for i in range(0, 50, 5):
+        del current['key%d' % i]
+    current['new'] = 'value'
+
+    yield Benchmark('_compute_diff[50 keys]', lambda: _compute_diff(current, previous), len(previous))
+
+
+def multipart_benchmarks(tmpdir):
+    for label, size in (('16KiB', 16 << 10), ('1MiB', 1 << 20), ('16MiB', 16 << 20)):
+        data = os.urandom(size)
+
+        def buffered(data=data):
+            f = io.BytesIO(data)
+            f.name = 'evidence.pdf'
+
+            generator = MultipartDataGenerator()
+            generator.add_params({'purpose': 'dispute_evidence', 'file': f})
+            return generator.get_post_data()
+
+        yield Benchmark('multipart.get_post_data[%s]' % label, buffered)
+
+        path = os.path.join(tmpdir, 'upload-%s' % label)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        def streamed(path=path):
+            async def consume():
+                with open(path, 'rb') as f:
+                    generator = MultipartDataGenerator()
+                    generator.add_params({'purpose': 'dispute_evidence', 'file': f})
+
+                    total = 0
+                    async for chunk in generator.stream():
+                        total += len(chunk)
+                    return total
+
+            return asyncio.get_event_loop().run_until_complete(consume())
+
+        yield Benchmark('multipart.stream(mmap)[%s]' % label, streamed)
+
+
+def uniondict_benchmarks():
+    overlay = {'async_yield': None, 'async_yield_from': None}
+    ns = uniondict(builtins.__dict__, dict(globals()), overlay=overlay)
+
+    yield Benchmark('uniondict.get[overlay]', lambda: ns.get('async_yield'))
+    yield Benchmark('uniondict.get[last target]', lambda: ns.get('json'))
+    yield Benchmark('uniondict.get[first target]', lambda: ns.get('len'))
+    yield Benchmark('uniondict.get[miss]', lambda: ns.get('no_such_name'))
+    yield Benchmark('uniondict.__contains__[first target]', lambda: 'len' in ns)
+
+
+def coroutils_benchmarks():
+    n = 1000
+
+    @async_generator
+    async def numbers():
+        for i in range(n):
+            await async_yield(i)
+
+    async def drain(iterable):
+        async for x in iterable:
+            pass
+
+    loop = asyncio.get_event_loop()
+
+    yield Benchmark('coroutils.async_generator[per item]', lambda: loop.run_until_complete(drain(numbers())), n)
+    yield Benchmark('coroutils.aiter(range)[per item]', lambda: loop.run_until_complete(drain(aiter(range(n)))), n)
+    yield Benchmark('coroutils.afilter[per item]',
+                    lambda: loop.run_until_complete(drain(afilter(None, range(n)))), n)
+
+
+def measure(benchmark, repeat):
+    timer = timeit.Timer(benchmark.func)
+    number, _ = timer.autorange()
+    number = max(number, 1)
+
+    # autorange targets 0.2s; keep the repeats at that scale too
+    timings = sorted(t / number for t in timer.repeat(repeat=repeat, number=number))
+
+    best = timings[0]
+    median = timings[len(timings) // 2]
+
+    return {
+        'loops': number,
+        'best_us': best * 1e6,
+        'median_us': median * 1e6,
+        'best_ns_per_item': best * 1e9 / benchmark.items,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filter', help='only run benchmarks whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', metavar='NAME')
+    parser.add_argument('--compare', metavar='NAME')
+    args = parser.parse_args()
+
+    results = {'environment': environment(), 'parameters': {'repeat': args.repeat}, 'benchmarks': {}}
+
+    with tempfile.TemporaryDirectory(prefix='aiostripe-micro-') as tmpdir:
+        groups = [encode_benchmarks(), interpret_benchmarks(), convert_benchmarks(), serialize_benchmarks(),
+                  multipart_benchmarks(tmpdir), uniondict_benchmarks(), coroutils_benchmarks()]
+
+        print('%-44s %12s %12s %14s' % ('benchmark', 'best us', 'median us', 'ns/item'))
+        for group in groups:
+            for benchmark in group:
+                if args.filter and args.filter not in benchmark.name:
+                    continue
+
+                metrics = measure(benchmark, args.repeat)
+                results['benchmarks'][benchmark.name] = metrics
+
+                print('%-44s %12.2f %12.2f %14.1f' % (benchmark.name, metrics['best_us'], metrics['median_us'],
+                                                      metrics['best_ns_per_item']))
+
+    if args.save:
+        save_baseline(args.save, results)
+
+    if args.compare:
+        compare(results, load_baseline(args.compare), 'benchmarks', skip=('loops',))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Uploads a large file to a local stand-in for uploads.stripe.com and reports throughput and peak RSS.
+
+    python -m benchmarks.upload [--size-mb 100] [--mode buffered|stream|mmap]
+
+Without --mode every mode runs in its own subprocess, so each peak RSS figure is measured in isolation. Mapped pages
+of the mmap mode count towards RSS, but they are clean page cache the kernel can drop at any time, unlike the heap
+copies of the buffered mode.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+
+from aiostripe.http_client import AsyncioClient
+from aiostripe.multipart_data_generator import MultipartDataGenerator
+
+MODES = ('buffered', 'stream', 'mmap')
+
+
+async def handle_upload(request):
+    received = 0
+    while True:
+        chunk = await request.content.read(1 << 16)
+        if not chunk:
+            break
+        received += len(chunk)
+
+    return web.json_response({'object': 'file_upload', 'id': 'file_bench', 'size': received})
+
+
+async def start_server():
+    app = web.Application(client_max_size=0)
+    app.router.add_post('/v1/files', handle_upload)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+
+    host, port = runner.addresses[0][:2]
+    return runner, 'http://%s:%d' % (host, port)
+
+
+def build_body(mode, f):
+    generator = MultipartDataGenerator(mmap_files=(mode == 'mmap'))
+    generator.add_params({'purpose': 'dispute_evidence', 'file': f})
+
+    headers = {'Content-Type': 'multipart/form-data; boundary=%s' % generator.boundary}
+    if mode == 'buffered':
+        return generator.get_post_data(), headers
+
+    body = generator.stream()
+    if body.size is not None:
+        headers['Content-Length'] = str(body.size)
+
+    return body, headers
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / (1 << 20)
+
+
+async def run_mode(mode, path):
+    runner, base = await start_server()
+    client = AsyncioClient()
+
+    try:
+        with open(path, 'rb') as f:
+            rss_before = peak_rss_mb()
+            started = time.perf_counter()
+
+            body, headers = build_body(mode, f)
+            rbody, rcode, _ = await client.request('post', base + '/v1/files', headers, body)
+
+            elapsed = time.perf_counter() - started
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+    if rcode != 200:
+        raise RuntimeError('upload failed with HTTP %d: %r' % (rcode, rbody))
+
+    size = os.path.getsize(path)
+    return {
+        'mode': mode,
+        'bytes': size,
+        'received': json.loads(rbody.decode('utf-8'))['size'],
+        'seconds': elapsed,
+        'throughput_mb_s': size / elapsed / (1 << 20),
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_rss_growth_mb': peak_rss_mb() - rss_before,
+    }
+
+
+def make_file(size_mb):
+    f = tempfile.NamedTemporaryFile(prefix='aiostripe-upload-', delete=False)
+    with f:
+        block = os.urandom(1 << 20)
+        for i in range(size_mb):
+            f.write(block)
+
+    return f.name
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=100)
+    parser.add_argument('--mode', choices=MODES)
+    parser.add_argument('--file', help='upload this file instead of a generated one')
+    args = parser.parse_args()
+
+    if args.mode:
+        loop = asyncio.get_event_loop()
+        print(json.dumps(loop.run_until_complete(run_mode(args.mode, args.file))))
+        return
+
+    path = args.file or make_file(args.size_mb)
+    try:
+        print('%-10s %10s %12s %14s %16s' % ('mode', 'seconds', 'MB/s', 'peak RSS MB', 'RSS growth MB'))
+        for mode in MODES:
+            out = subprocess.check_output([sys.executable, '-m', 'benchmarks.upload', '--mode', mode, '--file', path])
+            result = json.loads(out.decode('utf-8'))
+
+            print('%-10s %10.3f %12.1f %14.1f %16.1f' % (mode, result['seconds'], result['throughput_mb_s'],
+                                                        result['peak_rss_mb'], result['peak_rss_growth_mb']))
+    finally:
+        if not args.file:
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
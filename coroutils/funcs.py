@@ -1,6 +1,10 @@
+import asyncio
 import collections
+import heapq
 import operator
+import pickle
 import sys
+import tempfile
 from functools import update_wrapper
 from inspect import iscoroutinefunction
 
@@ -148,8 +152,84 @@ async def areversed(seq):
     return aiter(reversed(await aitersync(seq)))
 
 
-async def asorted(iterable, *args, **kwargs):
-    return aiter(sorted(await aitersync(iterable), *args, **kwargs))
+async def asorted(iterable, key=None, reverse=False, buffer_bytes=None):
+    """Sorts an async iterable.
+
+    With `buffer_bytes` set, the items kept in memory take up to about that many bytes, as measured by the size of
+    their pickles: full buffers are sorted and spilled to temporary files as runs, which are then lazily k-way merged
+    as the result is iterated."""
+
+    if buffer_bytes is None:
+        return aiter(sorted(await aitersync(iterable), key=key, reverse=reverse))
+
+    if buffer_bytes < 1:
+        raise ValueError('buffer_bytes must be a positive integer')
+
+    runs = []
+    buffer = []
+    size = 0
+
+    try:
+        async for x in aiter(iterable):
+            buffer.append(x)
+            size += len(pickle.dumps(x, pickle.HIGHEST_PROTOCOL))
+
+            if size >= buffer_bytes:
+                runs.append(_spill_run(buffer, key, reverse))
+                buffer = []
+                size = 0
+    except:
+        for run in runs:
+            run.close()
+
+        raise
+
+    buffer.sort(key=key, reverse=reverse)
+
+    if not runs:
+        return aiter(buffer)
+
+    return _merge_runs(runs, buffer, key, reverse)
+
+
+def _spill_run(items, key, reverse):
+    items.sort(key=key, reverse=reverse)
+
+    f = tempfile.TemporaryFile()
+    try:
+        for item in items:
+            pickle.dump(item, f, pickle.HIGHEST_PROTOCOL)
+
+        f.seek(0)
+    except:
+        f.close()
+        raise
+
+    return f
+
+
+def _read_run(f):
+    try:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+    finally:
+        f.close()
+
+
+@async_generator
+async def _merge_runs(runs, tail, key, reverse):
+    # runs are merged in spill order, with the in-memory tail last, so the merge stays stable like sorted()
+    readers = [_read_run(f) for f in runs]
+
+    try:
+        for x in heapq.merge(*readers, tail, key=key, reverse=reverse):
+            await async_yield(x)
+    finally:
+        for reader in readers:
+            reader.close()
 
 
 async def asum(iterable, start=0):
@@ -306,26 +386,58 @@ async def atakewhile(predicate, iterable):
             break
 
 
-@async_generator
-async def atee(iterable, n=2):
+def atee(iterable, n=2, maxsize=None):
+    """Returns `n` independent async iterators over `iterable`.
+
+    By default a branch that runs ahead buffers without limit for the others. With `maxsize` set, a branch that needs
+    a new value waits while any other branch already has `maxsize` values pending, so the branches must be consumed
+    concurrently."""
+
+    if maxsize is not None and maxsize < 1:
+        raise ValueError('maxsize must be a positive integer')
+
     it = aiter(iterable)
     deques = [collections.deque() for i in range(n)]
+    condition = asyncio.Condition()
+    exhausted = False
+
+    async def fetch(mydeque):
+        nonlocal exhausted
+
+        async with condition:
+            while not mydeque and not exhausted:
+                if maxsize is not None and any(len(d) >= maxsize for d in deques):
+                    await condition.wait()
+                    continue
 
-    async def gen(mydeque):
-        while True:
-            if not mydeque:  # when the local deque is empty
                 try:
                     newval = await anext(it)  # fetch a new value and
                 except StopAsyncIteration:
+                    exhausted = True
+                    condition.notify_all()
                     return
+
                 for d in deques:  # load it to all the deques
                     d.append(newval)
-            await async_yield(mydeque.popleft())
 
-    res = []
-    for d in deques:
-        res.append(await gen(d))
-    return tuple(res)
+    @async_generator
+    async def gen(mydeque):
+        while True:
+            if not mydeque:  # when the local deque is empty
+                await fetch(mydeque)
+
+                if not mydeque:
+                    return
+
+            value = mydeque.popleft()
+
+            if maxsize is not None:
+                async with condition:
+                    condition.notify_all()
+
+            await async_yield(value)
+
+    return tuple(gen(d) for d in deques)
 
 
 class AsyncZipExhausted(Exception):
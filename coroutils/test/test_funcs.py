@@ -1,10 +1,14 @@
+import asyncio
 import operator
 import unittest
+import unittest.mock
 from decimal import Decimal
 from fractions import Fraction
 
+import coroutils.funcs
 from coroutils.async_test import AsyncTestCase
 from coroutils.funcs import *
+from coroutils.generator import async_generator
 
 async def LIST(it):
     return list(await aitersync(it))
@@ -41,6 +45,80 @@ class TestBasicOps(AsyncTestCase):
         # with self.assertRaises(TypeError):
         #     await LIST(aaccumulate(s, chr))  # unary-operation
 
+    async def test_sorted(self):
+        data = [5, 3, 9, 1, 7, 3, 8, 0, 2, 6, 4]
+
+        self.assertEqual(await LIST(await asorted(data)), sorted(data))
+        self.assertEqual(await LIST(await asorted(arange(10), reverse=True)), list(range(9, -1, -1)))
+        self.assertEqual(await LIST(await asorted([])), [])
+
+        for buffer_bytes in 1, 10, 20, 1000:
+            self.assertEqual(await LIST(await asorted(data, buffer_bytes=buffer_bytes)), sorted(data))
+            self.assertEqual(await LIST(await asorted(data, key=lambda x: -x, buffer_bytes=buffer_bytes)),
+                             sorted(data, key=lambda x: -x))
+            self.assertEqual(await LIST(await asorted(data, reverse=True, buffer_bytes=buffer_bytes)),
+                             sorted(data, reverse=True))
+
+        # external merge is stable, like sorted()
+        pairs = [(i % 3, i) for i in range(20)]
+        self.assertEqual(await LIST(await asorted(pairs, key=operator.itemgetter(0), buffer_bytes=40)),
+                         sorted(pairs, key=operator.itemgetter(0)))
+
+        await self.assertRaisesAsync(ValueError, asorted, data, buffer_bytes=0)
+
+    async def test_sorted_spills_by_size(self):
+        spill = coroutils.funcs._spill_run
+        spilled = []
+
+        def spy(items, key, reverse):
+            spilled.append(len(items))
+            return spill(items, key, reverse)
+
+        small = [str(i) for i in range(100)]
+        large = ['x' * 1000 + str(i) for i in range(10)]
+
+        with unittest.mock.patch('coroutils.funcs._spill_run', spy):
+            self.assertEqual(await LIST(await asorted(small, buffer_bytes=5000)), sorted(small))
+            self.assertEqual(spilled, [])
+
+            self.assertEqual(await LIST(await asorted(large, buffer_bytes=2500)), sorted(large))
+            self.assertEqual(spilled, [3, 3, 3])
+
+    async def test_tee(self):
+        a, b = atee(arange(10))
+        self.assertEqual(await LIST(a), list(range(10)))
+        self.assertEqual(await LIST(b), list(range(10)))
+
+        self.assertEqual(len(atee('abc', 3)), 3)
+
+    async def test_tee_bounded(self):
+        @async_generator
+        async def source():
+            for i in range(20):
+                await async_yield(i)
+
+        a, b = atee(source(), maxsize=2)
+        result_a, result_b = [], []
+        lead = []
+
+        async def fast():
+            async for x in a:
+                result_a.append(x)
+                lead.append(len(result_a) - len(result_b))
+
+        async def slow():
+            async for x in b:
+                result_b.append(x)
+                await asyncio.sleep(0.001)
+
+        await asyncio.gather(fast(), slow())
+
+        self.assertEqual(result_a, list(range(20)))
+        self.assertEqual(result_b, list(range(20)))
+        self.assertLessEqual(max(lead), 3)
+
+        self.assertRaises(ValueError, atee, [], 2, 0)
+
 
 # TODO: get tests from test_itertools.py and port them
 
@@ -11,7 +11,7 @@ from distutils.command.build_py import build_py
 path, script = os.path.split(sys.argv[0])
 os.chdir(os.path.abspath(path))
 
-install_requires = ['asyncio >= 3.4.3', 'aiohttp >= 0.19']
+install_requires = ['asyncio >= 3.4.3', 'aiohttp >= 3.1']
 
 with open('LONG_DESCRIPTION.rst') as f:
     long_description = f.read()
@@ -30,7 +30,7 @@ setup(
     author_email='support@stripe.com',
     url='https://github.com/stripe/stripe-python',
     packages=['aiostripe', 'aiostripe.test', 'coroutils', 'uniondict'],
-    package_data={'aiostripe': ['data/ca-certificates.crt']},
+    package_data={'aiostripe': ['data/ca-certificates.crt', 'test/localhost.pem']},
     install_requires=install_requires,
     test_suite='aiostripe.test.all',
     tests_require=[],